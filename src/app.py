@@ -1,60 +1,70 @@
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, Response, g, request, jsonify, render_template, send_file
 import sqlite3
 from datetime import datetime
+import json
 import math
-from google.cloud import storage
-import io
-from openpyxl import Workbook
+import os
+import tempfile
+from projection import create_projection_schema, project_new_record, project_new_records_since, rebuild_projection, projection_is_stale
+from state_engine import RecordState, StateEngine
+from db import get_connection, SCAN_DATE_FORMAT
+from search import PAGE_SIZE, CountCache, search_page
+from metrics import Gauge, DUPLICATES, phase, register, render_metrics, init_app as init_metrics
+from http_cache import ResponseCache, conditional_json, init_app as init_http_cache
+from export import EXPORT_FORMATS, parse_export_filters, stream_csv, stream_ndjson, write_xlsx
+from export_jobs import EXPORT_CACHE_DIR, ExportJobs, export_job_id, open_export
+from timestamps import display_to_ts, migrate_timestamps, now_stamps, parse_date_range, range_clause
+from stats import activity_stats
+from history import ArchiveUnavailable, parse_as_of, resolve_as_of, state_as_of, search_state, record_timeline
+from backup import BUCKET_NAME, BackupScheduler, IncrementalShipper, backend_from_env, restore_from_backup
+from compaction import ARCHIVE_DIR, create_snapshot_schema
+from startup import Startup
+from write_queue import GroupCommitter
+from events import Broadcaster, StreamSlots, parse_event_id, stream_events
+from bulk_import import import_format, iter_import, iter_import_values
+from mutations import apply_mutations, parse_operations
+from membership import MembershipIndex
+from shards import DEFAULT_SHARD, ShardRegistry, parse_shard_key, parse_shard_keys, shard_backend, shard_path
 
 # --- GCS CONFIGURATION ---
-BUCKET_NAME = "valid-string-backup-bucket"
-
-def backup_to_gcs():
-    """Uploads the local SQLite DB file to Google Cloud Storage."""
-    try:
-        # Initialize the client using the key file
-        client = storage.Client()
-        bucket = client.bucket(BUCKET_NAME)
-
-        # Create a 'blob' (file object) in GCS
-        blob = bucket.blob("backups/qr_data_backup.db")
-
-        # Upload the actual file
-        blob.upload_from_filename(DB_FILE)
-        print(f"☁️ Cloud Backup Successful: {datetime.now()}")
-    except Exception as e:
-        print(f"❌ Cloud Backup Failed: {e}")
-
-def download_from_gcs():
-    """Downloads the local SQLite DB file from Google Cloud Storage on startup."""
-    try:
-        # Initialize the client exactly like the backup function!
-        client = storage.Client()
-        bucket = client.bucket(BUCKET_NAME)
-
-        # Point to the backup file in GCS
-        blob = bucket.blob("backups/qr_data_backup.db")
-
-        # Only download if it already exists in the bucket
-        if blob.exists():
-            blob.download_to_filename(DB_FILE)
-            print(f"☁️ Cloud Sync Download Successful: {datetime.now()}")
-        else:
-            print("☁️ No existing cloud backup found. Starting with a fresh local DB!")
-    except Exception as e:
-        print(f"❌ Cloud Sync Download Failed: {e}")
+BACKUP_WINDOW_SECONDS = float(os.environ.get("BACKUP_WINDOW_SECONDS", "5"))
+WRITE_WINDOW_SECONDS = float(os.environ.get("WRITE_WINDOW_SECONDS", "0.002"))
+EXPORT_CACHE_MAX_MB = float(os.environ.get("EXPORT_CACHE_MAX_MB", "512"))
+EXPORT_CACHE_MAX_AGE_HOURS = float(os.environ.get("EXPORT_CACHE_MAX_AGE_HOURS", "24"))
+EVENT_KEYS = os.environ.get("EVENT_KEYS", "") # Extra registries (one SQLite file each), e.g. "fair-2026,site-b"
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", "16")) # gunicorn --threads (see the Dockerfile)
+
+backup_backend = backend_from_env(BUCKET_NAME)
+
+
+def download_from_gcs(backend, db_file, progress=None):
+    """Brings a local SQLite DB file up to date with Google Cloud Storage on startup."""
+    # Only restore if a backup already exists in the bucket (base snapshot + delta segments),
+    # and only download what the local copy is missing
+    result = restore_from_backup(backend, db_file, progress)
+    if result == "restored":
+        print(f"☁️ Cloud Sync Download Successful: {datetime.now()}")
+    elif result == "local_ahead":
+        print("☁️ Local DB is newer than the cloud backup, kept it. The next backup ships a fresh base.")
+    elif result:
+        print(f"☁️ Local DB already matches the cloud backup ({result}), skipped the download.")
+    else:
+        print("☁️ No existing cloud backup found. Starting with a fresh local DB!")
+    return result
 
 
 app = Flask(__name__)
+init_metrics(app) # Per-request phase timings + /metrics
+init_http_cache(app) # gzip/brotli for larger JSON bodies
 
 
 # --- DATABASE SETUP ---
 DB_FILE = "qr_data.db"
 
 
-def init_db():
+def init_db(db_file=DB_FILE):
     """Creates the databases and tables if they don't exist."""
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
 
     # Your original table (UNTOUCHED)
@@ -71,20 +81,193 @@ def init_db():
         CREATE TABLE IF NOT EXISTS qr_mutations (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             record_id INTEGER NOT NULL,
-            action TEXT NOT NULL, 
-            new_string TEXT, 
+            action TEXT NOT NULL,
+            new_string TEXT,
             mutation_date TEXT NOT NULL,
             FOREIGN KEY(record_id) REFERENCES qr_records(id)
         )
     ''')
 
+    # Sortable scan_ts / mutation_ts next to the display dates, backfilled for existing rows (see timestamps.py)
+    if migrate_timestamps(conn):
+        print("🕒 Backfilled sortable timestamps for existing rows.")
+
+    # Lets a single record's timeline be read without scanning the whole log
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_qr_mutations_record_id ON qr_mutations (record_id, id)")
+
+    # The current-state projection (see projection.py)
+    create_projection_schema(cursor)
+
+    # Where compaction.py leaves the state of records whose old mutations it archived
+    create_snapshot_schema(cursor)
     conn.commit()
+
+    # Older backups won't have it filled in yet, so regenerate it from the log
+    if projection_is_stale(cursor):
+        print("🔁 qr_state is out of sync with the log. Rebuilding it...")
+        rebuild_projection(conn)
+
     conn.close()
 
 
-# Initialize the DB on startup
-download_from_gcs()
-init_db()
+# Routes that never touch the DB, served even while the restore is running
+NO_DB_ENDPOINTS = {'index', 'admin_page', 'readyz', 'backup_status', 'metrics', 'static'}
+
+
+class Shard:
+    """One event's registry: its DB file, its backup set, and the caches/workers that serve it."""
+
+    def __init__(self, key):
+        self.key = key
+        self.db_file = shard_path(key, DB_FILE)
+        self.archive_dir = shard_path(key, ARCHIVE_DIR)
+        backend = shard_backend(backup_backend, key)
+
+        # Restore + migrate in the background so the server can start listening right away (see startup.py)
+        self.startup = Startup(self.db_file + ".startup.lock",
+                               lambda progress: download_from_gcs(backend, self.db_file, progress),
+                               lambda: init_db(self.db_file)).start()
+
+        # Shared in-memory state, caught up incrementally from the log on every request
+        self.engine = StateEngine(self.db_file)
+        # Admin search totals, cached per (query, data version), and rendered read responses
+        self.search_counts = CountCache()
+        self.response_cache = ResponseCache()
+
+        # Debounced background backups (flushed one last time when the worker shuts down)
+        self.backup_scheduler = BackupScheduler(IncrementalShipper(self.db_file, backend),
+                                                window_seconds=BACKUP_WINDOW_SECONDS).register_shutdown_flush()
+        # One live-feed reader per worker, fanned out to every /events stream (see events.py)
+        self.broadcaster = Broadcaster(self.db_file, slots=stream_slots)
+        # Bloom filter of taken strings for offline scanners, rebuilt when the mutation high-water mark moves (see membership.py)
+        self.membership = MembershipIndex(self.db_file)
+        # Background export renders + the artifact cache shared by every worker (see export_jobs.py)
+        self.export_jobs = ExportJobs(self.db_file, cache_dir=shard_path(key, EXPORT_CACHE_DIR),
+                                      max_bytes=int(EXPORT_CACHE_MAX_MB * 1024 * 1024),
+                                      max_age_seconds=EXPORT_CACHE_MAX_AGE_HOURS * 3600, archive_dir=self.archive_dir)
+        # Scans and mutations from concurrent requests are committed together, a few ms at a time (see write_queue.py)
+        self.writer = GroupCommitter(self.db_file, window_seconds=WRITE_WINDOW_SECONDS, on_commit=self.after_group_commit)
+
+    def after_group_commit(self, group):
+        self.backup_scheduler.request_backup()
+        self.broadcaster.notify()
+
+    def data_version(self):
+        """What read endpoints derive their ETag from (one PRAGMA when nothing changed)."""
+        return (self.key,) + self.engine.refresh().version
+
+
+# Every open /events stream holds a gunicorn thread, whichever event it watches: all shards share
+# one budget of half the worker's threads, so streams can never starve /process-qr
+stream_slots = StreamSlots(max(1, WORKER_THREADS // 2))
+
+# Registries are opened on first use; the default one starts restoring right away, as it always has (see shards.py)
+shards = ShardRegistry(parse_shard_keys(EVENT_KEYS), Shard)
+shards.get(DEFAULT_SHARD)
+
+
+def current_shard():
+    """The shard this request is scoped to (picked in scope_request)."""
+    return g.shard
+
+
+def data_version():
+    return current_shard().data_version()
+
+
+def shard_response_cache():
+    return current_shard().response_cache
+
+
+@app.before_request
+def scope_request():
+    """Scopes the request to ?event= (or X-Event, default registry otherwise) and holds it until that registry is loaded."""
+    try:
+        g.shard = shards.get(parse_shard_key(request.args.get('event') or request.headers.get('X-Event')))
+    except (ValueError, KeyError):
+        return jsonify({"status": "error", "message": f"Unknown event. Use one of: {', '.join(shards.keys)}."}), 404
+
+    startup = g.shard.startup
+    if startup.ready or request.endpoint in NO_DB_ENDPOINTS:
+        return None
+    response = jsonify({
+        "status": "starting",
+        "message": "The registry is still loading, try again in a moment.",
+        "startup": startup.status()
+    })
+    response.status_code = 503
+    response.headers["Retry-After"] = "2"
+    return response
+
+
+def page_event():
+    """The event key the pages put on their requests (None for the default registry)."""
+    return None if current_shard().key == DEFAULT_SHARD else current_shard().key
+
+
+def across_shards(read, combine=sum):
+    """A number summed (or maxed) over the shards this worker has open and loaded, None if there are none."""
+    values = [read(shard) for shard in shards.open_shards() if shard.startup.ready]
+    values = [value for value in values if value is not None]
+    return combine(values) if values else None
+
+
+# Registry size + backup health, read fresh on every /metrics scrape (totals over the open shards)
+register(Gauge("qr_open_shards", "Event registries this worker has opened.", lambda: len(shards.open_shards())))
+register(Gauge("qr_records_count", "Records in the registry (including deleted).", lambda: across_shards(lambda s: len(s.engine.refresh().records))))
+register(Gauge("qr_mutations_count", "Ghost mutations in the log.", lambda: across_shards(lambda s: s.engine.refresh().mutation_count)))
+register(Gauge("qr_backups_total", "Successful cloud backups by this worker.", lambda: across_shards(lambda s: s.backup_scheduler.backup_count), kind="counter"))
+register(Gauge("qr_backup_failures_total", "Failed cloud backups by this worker.", lambda: across_shards(lambda s: s.backup_scheduler.failure_count), kind="counter"))
+register(Gauge("qr_backup_last_duration_seconds", "How long the slowest shard's last successful backup took.", lambda: across_shards(lambda s: s.backup_scheduler.last_duration, max)))
+register(Gauge("qr_write_groups_total", "Group commits by this worker.", lambda: across_shards(lambda s: s.writer.group_count), kind="counter"))
+register(Gauge("qr_write_jobs_total", "Writes coalesced into those group commits.", lambda: across_shards(lambda s: s.writer.job_count), kind="counter"))
+register(Gauge("qr_event_streams", "Open /events streams on this worker (all events).", lambda: stream_slots.in_use))
+register(Gauge("qr_export_jobs_running", "Export jobs queued or rendering on this worker.", lambda: across_shards(lambda s: s.export_jobs.stats()["running"])))
+register(Gauge("qr_membership_filter_builds_total", "Full membership filter rebuilds by this worker.", lambda: across_shards(lambda s: s.membership.build_count), kind="counter"))
+register(Gauge("qr_backup_lag_seconds", "Age of the oldest write not yet backed up (any shard).", lambda: across_shards(lambda s: s.backup_scheduler.status()["lag_seconds"], max)))
+
+
+# --- SCAN HELPERS ---
+BATCH_LIMIT = 500 # Max scans accepted per /process-qr/batch call
+
+
+def duplicate_message(rec, qr_string):
+    """Explains to the scanner WHY a string is already taken."""
+    if rec.status == 'DELETED':
+        return f"This exact string was previously scanned on {rec.scan_date}, but it has been deleted by an admin!"
+    elif rec.status == 'EDITED' and rec.qr_string != rec.original_string:
+        return f"This exact string is tied to an older record from {rec.scan_date} that an admin has since altered."
+    else:
+        return f"String '{qr_string}' already exists!\nFirst submitted on: {rec.scan_date}"
+
+
+def parse_client_scan_date(scanned_at):
+    """Turns an offline scanner's timestamp (epoch ms or ISO string) into our scan_date format."""
+    try:
+        if isinstance(scanned_at, (int, float)):
+            scanned = datetime.fromtimestamp(scanned_at / 1000)
+        else:
+            scanned = datetime.fromisoformat(str(scanned_at).replace('Z', '+00:00'))
+            if scanned.tzinfo:
+                scanned = scanned.astimezone().replace(tzinfo=None)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+    # Never trust a clock that says the scan happened in the future
+    if scanned > datetime.now():
+        return None
+    return scanned.strftime(SCAN_DATE_FORMAT)
+
+
+def recent_in_range(conn, limit, date_from, date_to):
+    """(id, qr_string, scan_date) of the newest non-deleted records scanned inside [date_from, date_to)."""
+    where, params = range_clause("r.scan_ts", date_from, date_to)
+    rows = conn.execute(
+        f"SELECT s.id, s.qr_string, s.scan_date FROM qr_state s JOIN qr_records r ON r.id = s.id "
+        f"WHERE {where} AND s.status != 'DELETED' ORDER BY r.scan_ts DESC, s.id DESC LIMIT ?",
+        params + [limit]
+    )
+    return [(r[0], r[1], r[2]) for r in rows]
 
 
 # --- ROUTES ---
@@ -92,140 +275,102 @@ init_db()
 @app.route('/')
 def index():
     # This serves your HTML file
-    return render_template('index.html')
+    return render_template('index.html', event=page_event())
 
 
 @app.route('/history', methods=['GET'])
+@conditional_json(data_version, shard_response_cache)
 def get_history():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row # Lets us access columns by name
-    cursor = conn.cursor()
+    shard = current_shard()
+    try:
+        date_from, date_to = parse_date_range(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
     try:
-        # 1. Fetch all records and mutations
-        cursor.execute("SELECT * FROM qr_records")
-        original_records = cursor.fetchall()
-
-        cursor.execute("SELECT * FROM qr_mutations ORDER BY id ASC")
-        mutations = cursor.fetchall()
-
-        # 2. Rebuild the current state in memory
-        records_state = {}
-        for r in original_records:
-            records_state[r['id']] = {
-                'id': r['id'],
-                'qr_string': r['qr_string'],
-                'original_string': r['qr_string'],
-                'scan_date': r['scan_date'],
-                'status': 'ACTIVE'
-            }
-
-        # 3. Fast-forward through history
-        for m in mutations:
-            rec_id = m['record_id']
-            if rec_id in records_state:
-                if m['action'] == 'DELETE':
-                    records_state[rec_id]['status'] = 'DELETED'
-                elif m['action'] == 'EDIT':
-                    records_state[rec_id]['status'] = 'EDITED'
-                    records_state[rec_id]['qr_string'] = m['new_string']
-                elif m['action'] == 'RESTORE':
-                    is_edited = records_state[rec_id]['qr_string'] != records_state[rec_id]['original_string']
-                    records_state[rec_id]['status'] = 'EDITED' if is_edited else 'ACTIVE'
-
-        # 4. Filter out deleted records and format for the frontend
-        active_records = [rec for rec in records_state.values() if rec['status'] != 'DELETED']
-
-        # 5. Sort descending by ID (newest first) and grab the top 10
-        active_records.sort(key=lambda x: x['id'], reverse=True)
-        top_10 = active_records[:10]
+        if date_from or date_to:
+            # A date window: let the scan_ts index find the newest 10 inside it
+            with phase("db_fetch"):
+                top_10 = recent_in_range(get_connection(shard.db_file), 10, date_from, date_to)
+        else:
+            with phase("replay"):
+                shard.engine.refresh()
+
+            # Newest 10 non-deleted records (the engine stops walking as soon as it has them)
+            with phase("db_fetch"):
+                top_10 = [(r.id, r.qr_string, r.scan_date) for r in shard.engine.recent(10)]
 
         # Format for JSON exactly how index.html expects it
-        history = [{"qr_string": r["qr_string"], "scan_date": r["scan_date"]} for r in top_10]
+        with phase("serialize"):
+            history = [{"id": record_id, "qr_string": qr_string, "scan_date": scan_date} for record_id, qr_string, scan_date in top_10]
+            return jsonify(history)
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
-        return jsonify(history)
 
+@app.route('/membership-filter', methods=['GET'])
+@conditional_json(data_version, shard_response_cache)
+def membership_filter():
+    """Bloom filter of every string a scan would be refused for, or just what was scanned since ?since=<version>."""
+    shard = current_shard()
+    since = parse_event_id(request.args.get('since')) if request.args.get('since') else None
+    try:
+        with phase("db_fetch"):
+            payload = shard.membership.payload(since)
+        with phase("serialize"):
+            return jsonify({"status": "success", **payload})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @app.route('/process-qr', methods=['POST'])
 def process_qr():
+    shard = current_shard()
     data = request.json
     qr_string = data.get('qr_string', '').strip()
 
     if len(qr_string) != 9:
         return jsonify({"status": "error", "message": "String must be 9 characters."}), 400
 
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
     try:
-        # Fetch all data to build the TRUE logical state (including all mutations)
-        cursor.execute("SELECT * FROM qr_records")
-        original_records = cursor.fetchall()
-
-        cursor.execute("SELECT * FROM qr_mutations ORDER BY id ASC")
-        mutations = cursor.fetchall()
-
-        records_state = {}
-        for r in original_records:
-            records_state[r['id']] = {
-                'id': r['id'],
-                'qr_string': r['qr_string'],
-                'original_string': r['qr_string'],
-                'scan_date': r['scan_date'],
-                'status': 'ACTIVE'
-            }
-
-        # Fast-forward through the ghost timeline
-        for m in mutations:
-            rec_id = m['record_id']
-            if rec_id in records_state:
-                if m['action'] == 'DELETE':
-                    records_state[rec_id]['status'] = 'DELETED'
-                elif m['action'] == 'EDIT':
-                    records_state[rec_id]['status'] = 'EDITED'
-                    records_state[rec_id]['qr_string'] = m['new_string']
-                elif m['action'] == 'RESTORE':
-                    is_edited = records_state[rec_id]['qr_string'] != records_state[rec_id]['original_string']
-                    records_state[rec_id]['status'] = 'EDITED' if is_edited else 'ACTIVE'
+        with phase("replay"):
+            shard.engine.refresh()
 
         # Check if the submitted EXACT string currently exists ANYWHERE in the logical state
-        for rec in records_state.values():
-            # Exact match (case-sensitive)
-            if rec['qr_string'] == qr_string:
-                if rec['status'] == 'DELETED':
-                    return jsonify({
-                        "status": "duplicate", 
-                        "message": f"This exact string was previously scanned on {rec['scan_date']}, but it has been deleted by an admin!"
-                    })
-                elif rec['status'] == 'EDITED' and rec['qr_string'] != rec['original_string']:
-                    return jsonify({
-                        "status": "duplicate", 
-                        "message": f"This exact string is tied to an older record from {rec['scan_date']} that an admin has since altered."
-                    })
-                else:
-                    return jsonify({
-                        "status": "duplicate", 
-                        "message": f"String '{qr_string}' already exists!\nFirst submitted on: {rec['scan_date']}"
-                    })
-
-        # If we made it here, the string is completely new (or a different case) and safe to save!
-        scan_date = datetime.now().strftime("%B %d, %Y at %H:%M:%S")
-        cursor.execute(
-            "INSERT INTO qr_records (qr_string, scan_date) VALUES (?, ?)", 
-            (qr_string, scan_date)
-        )
-        conn.commit()
-
-        backup_to_gcs() # Trigger cloud backup
+        with phase("dedupe_check"):
+            rec = shard.engine.lookup(qr_string)
+
+        if rec:
+            DUPLICATES.inc(route="/process-qr")
+            return jsonify({"status": "duplicate", "message": duplicate_message(rec, qr_string)})
+
+        def insert_scan(conn, group):
+            # Check again now that we hold the write lock (another worker, or an earlier scan
+            # in this same group commit, may have just saved it)
+            rec = group.claimed.get(qr_string) or shard.engine.refresh().lookup(qr_string)
+            if rec:
+                return rec
+
+            # If we made it here, the string is completely new (or a different case) and safe to save!
+            scan_date, scan_ts = now_stamps()
+            cursor = conn.execute(
+                "INSERT INTO qr_records (qr_string, scan_date, scan_ts) VALUES (?, ?, ?)",
+                (qr_string, scan_date, scan_ts)
+            )
+            project_new_record(conn, cursor.lastrowid, qr_string, scan_date)
+            group.claimed[qr_string] = RecordState(cursor.lastrowid, qr_string, scan_date)
+            group.dirty = True # The group commit queues the cloud backup
+            return None
+
+        with phase("commit"):
+            rec = shard.writer.submit(insert_scan)
+        if rec:
+            DUPLICATES.inc(route="/process-qr")
+            return jsonify({"status": "duplicate", "message": duplicate_message(rec, qr_string)})
 
         return jsonify({
-            "status": "success", 
+            "status": "success",
             "message": "Record saved successfully!"
         })
 
@@ -237,219 +382,494 @@ def process_qr():
         }), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
-    finally:
-        conn.close()
+
+
+@app.route('/process-qr/batch', methods=['POST'])
+def process_qr_batch():
+    """Ingests a whole offline queue at once: one transaction, one backup, one result per item."""
+    shard = current_shard()
+    data = request.json or {}
+    scans = data.get('scans')
+
+    if not isinstance(scans, list) or not scans:
+        return jsonify({"status": "error", "message": "Expected a non-empty 'scans' list."}), 400
+    if len(scans) > BATCH_LIMIT:
+        return jsonify({"status": "error", "message": f"Send at most {BATCH_LIMIT} scans per batch."}), 400
+
+    def ingest(conn, group):
+        # We hold the write lock for the whole batch, so nobody can sneak the same string in between our check and insert
+        shard.engine.refresh()
+
+        results = []
+        to_insert = []
+        seen_in_batch = set()
+        fallback_date, fallback_ts = now_stamps()
+
+        for item in scans:
+            # Accept plain strings (old queues) or {"qr_string": ..., "scanned_at": ...}
+            if isinstance(item, dict):
+                qr_string = str(item.get('qr_string', '')).strip()
+                scan_date = parse_client_scan_date(item.get('scanned_at')) if item.get('scanned_at') is not None else None
+            else:
+                qr_string = str(item).strip()
+                scan_date = None
+
+            if len(qr_string) != 9:
+                results.append({"qr_string": qr_string, "status": "error", "message": "String must be 9 characters."})
+                continue
+
+            rec = group.claimed.get(qr_string) or shard.engine.lookup(qr_string)
+            if rec:
+                results.append({"qr_string": qr_string, "status": "duplicate", "message": duplicate_message(rec, qr_string)})
+                continue
+
+            if qr_string in seen_in_batch:
+                results.append({
+                    "qr_string": qr_string,
+                    "status": "duplicate",
+                    "message": f"String '{qr_string}' appears more than once in this sync."
+                })
+                continue
+
+            seen_in_batch.add(qr_string)
+            if scan_date:
+                to_insert.append((qr_string, scan_date, display_to_ts(scan_date)))
+            else:
+                to_insert.append((qr_string, fallback_date, fallback_ts))
+            results.append({"qr_string": qr_string, "status": "success", "message": "Record saved successfully!"})
+
+        # Strings that are no longer current but still sit in qr_records would break the whole executemany
+        locked = set()
+        candidates = [row[0] for row in to_insert]
+        for i in range(0, len(candidates), 500):
+            chunk = candidates[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT qr_string FROM qr_records WHERE qr_string IN ({placeholders})", chunk)
+            locked.update(r[0] for r in rows)
+
+        if locked:
+            to_insert = [row for row in to_insert if row[0] not in locked]
+            for res in results:
+                if res["status"] == "success" and res["qr_string"] in locked:
+                    res["status"] = "error"
+                    res["message"] = "This exact string is locked in the database history. Please restore it via the Admin panel."
+
+        if to_insert:
+            last_record_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM qr_records").fetchone()[0]
+            conn.executemany("INSERT INTO qr_records (qr_string, scan_date, scan_ts) VALUES (?, ?, ?)", to_insert)
+            project_new_records_since(conn, last_record_id)
+            for row in conn.execute("SELECT id, qr_string, scan_date FROM qr_records WHERE id > ?", (last_record_id,)):
+                group.claimed[row[1]] = RecordState(row[0], row[1], row[2])
+            group.dirty = True # ONE cloud backup for the whole group
+        return results, len(to_insert)
+
+    try:
+        with phase("commit"):
+            results, inserted = shard.writer.submit(ingest)
+
+        duplicates = sum(1 for r in results if r["status"] == "duplicate")
+        if duplicates:
+            DUPLICATES.inc(duplicates, route="/process-qr/batch")
+
+        with phase("serialize"):
+            return jsonify({"status": "success", "inserted": inserted, "results": results})
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
 
 @app.route('/admin')
 def admin_page():
     """Serves the new Admin HTML page."""
-    return render_template('admin.html')
+    return render_template('admin.html', event=page_event(), events=shards.keys)
 
 
 @app.route('/admin/api/records', methods=['GET'])
+@conditional_json(data_version, shard_response_cache)
 def get_admin_records():
+    shard = current_shard()
     search_query = request.args.get('search', '').strip()
     # NEW: Grab the requested page number, default to 1
     page = int(request.args.get('page', 1))
-    per_page = 20 
+    # Keyset paging: the dashboard sends back the last id it saw instead of an offset
+    before_id = request.args.get('before_id', type=int)
+    per_page = PAGE_SIZE
 
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    as_of = None
+    try:
+        date_from, date_to = parse_date_range(request.args)
+        if request.args.get('as_of'):
+            as_of = parse_as_of(request.args['as_of'])
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
     try:
-        cursor.execute("SELECT * FROM qr_records ORDER BY id DESC")
-        original_records = cursor.fetchall()
-
-        cursor.execute("SELECT * FROM qr_mutations ORDER BY id ASC")
-        mutations = cursor.fetchall()
-
-        records_state = {}
-        for r in original_records:
-            records_state[r['id']] = {
-                'id': r['id'],
-                'qr_string': r['qr_string'],
-                'original_string': r['qr_string'],
-                'original_date': r['scan_date'],
-                'status': 'ACTIVE'
-            }
-
-        for m in mutations:
-            rec_id = m['record_id']
-            if rec_id in records_state:
-                if m['action'] == 'DELETE':
-                    records_state[rec_id]['status'] = 'DELETED'
-                elif m['action'] == 'EDIT':
-                    records_state[rec_id]['status'] = 'EDITED'
-                    records_state[rec_id]['qr_string'] = m['new_string']
-                elif m['action'] == 'RESTORE':
-                    is_edited = records_state[rec_id]['qr_string'] != records_state[rec_id]['original_string']
-                    records_state[rec_id]['status'] = 'EDITED' if is_edited else 'ACTIVE'
-        final_results = []
-        for rec in records_state.values():
-            if search_query and search_query not in rec['qr_string']:
-                continue
-            final_results.append(rec)
+        conn = get_connection(shard.db_file)
+        if as_of is not None:
+            return admin_records_as_of(shard, conn, as_of, search_query, page, before_id, per_page, date_from, date_to)
 
-        final_results.sort(key=lambda x: x['id'], reverse=True)
+        with phase("replay"):
+            shard.engine.refresh()
+
+        # Unfiltered totals come free from the engine, search totals are cached per data version
+        with phase("db_fetch"):
+            if search_query or date_from or date_to:
+                total_records = shard.search_counts.get_or_count(conn, search_query, shard.engine.version, date_from, date_to)
+            else:
+                total_records = len(shard.engine.records)
 
         # --- NEW: PAGINATION MATH ---
-        total_records = len(final_results)
         total_pages = math.ceil(total_records / per_page)
         if total_pages == 0: total_pages = 1 # Always show at least 1 page
 
-        start_idx = (page - 1) * per_page
-        end_idx = start_idx + per_page
-        paginated_results = final_results[start_idx:end_idx]
+        # Old-style ?page=N links still work, they just pay for the OFFSET
+        offset = 0 if before_id is not None else (page - 1) * per_page
+        with phase("db_fetch"):
+            paginated_results, has_more = search_page(conn, search_query, before_id=before_id, offset=offset, limit=per_page,
+                                                      date_from=date_from, date_to=date_to)
 
         # Send back a rich package containing the records AND the page info!
+        with phase("serialize"):
+            return jsonify({
+                "records": paginated_results,
+                "current_page": page,
+                "total_pages": total_pages,
+                "total_records": total_records,
+                "has_more": has_more,
+                "next_before_id": paginated_results[-1]["id"] if has_more else None
+            })
+
+    except ArchiveUnavailable as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+def admin_records_as_of(shard, conn, as_of, search_query, page, before_id, per_page, date_from=None, date_to=None):
+    """The admin listing, but of the registry as it was at ?as_of= (a mutation id or a date)."""
+    with phase("replay"):
+        mutation_id, cutoff = resolve_as_of(conn, as_of, shard.archive_dir)
+        past = state_as_of(conn, mutation_id, cutoff, shard.archive_dir, date_from=date_from, date_to=date_to)
+
+    with phase("db_fetch"):
+        if search_query:
+            total_records = sum(1 for rec in past.records.values() if search_query in rec.qr_string)
+        else:
+            total_records = len(past.records)
+        offset = 0 if before_id is not None else (page - 1) * per_page
+        paginated_results, has_more = search_state(past, search_query, before_id=before_id, offset=offset, limit=per_page)
+
+    with phase("serialize"):
         return jsonify({
             "records": paginated_results,
             "current_page": page,
-            "total_pages": total_pages,
-            "total_records": total_records
+            "total_pages": max(1, math.ceil(total_records / per_page)),
+            "total_records": total_records,
+            "has_more": has_more,
+            "next_before_id": paginated_results[-1]["id"] if has_more else None,
+            "as_of_mutation_id": mutation_id
         })
 
+
+SEARCH_ALL_LIMIT = 100 # Max merged rows per cross-event search
+
+
+@app.route('/admin/api/search-all', methods=['GET'])
+def search_all_events():
+    """The admin search run on every event's registry in parallel, merged newest first, each row tagged with its event."""
+    search_query = request.args.get('search', '').strip()
+    try:
+        date_from, date_to = parse_date_range(request.args)
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), SEARCH_ALL_LIMIT)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    def search_shard(shard):
+        if not shard.startup.ready:
+            return None # Opened just now (or still restoring): reported, not waited for
+        conn = get_connection(shard.db_file)
+        shard.engine.refresh()
+        if search_query or date_from or date_to:
+            total = shard.search_counts.get_or_count(conn, search_query, shard.engine.version, date_from, date_to)
+        else:
+            total = len(shard.engine.records)
+        records, has_more = search_page(conn, search_query, limit=limit, date_from=date_from, date_to=date_to)
+        return total, records, has_more
+
+    with phase("db_fetch"):
+        results = shards.fan_out(search_shard)
+
+    merged = []
+    events = {}
+    for key, (result, error) in results.items():
+        if error is not None:
+            events[key] = {"status": "error", "message": str(error)}
+        elif result is None:
+            events[key] = {"status": "starting"}
+        else:
+            total, records, has_more = result
+            events[key] = {"status": "ready", "total_records": total, "has_more": has_more}
+            merged.extend(dict(record, event=key) for record in records)
+
+    with phase("serialize"):
+        merged.sort(key=lambda record: (display_to_ts(record["original_date"]) or "", record["id"]), reverse=True)
+        return jsonify({
+            "records": merged[:limit],
+            "total_records": sum(e["total_records"] for e in events.values() if e["status"] == "ready"),
+            "events": events
+        })
+
+
+@app.route('/admin/api/records/<int:record_id>/timeline', methods=['GET'])
+def get_record_timeline(record_id):
+    """One record's full history, straight off the (record_id, id) index."""
+    shard = current_shard()
+    include_archived = request.args.get('include_archived') == '1'
+    try:
+        with phase("db_fetch"):
+            timeline = record_timeline(get_connection(shard.db_file), record_id, include_archived, shard.archive_dir)
+        if timeline is None:
+            return jsonify({"status": "error", "message": "Record not found."}), 404
+        return jsonify(timeline)
+    except ArchiveUnavailable as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @app.route('/admin/api/mutate', methods=['POST'])
 def mutate_record():
-    """Appends a new action to the ghost table with Edit Collision prevention."""
-    data = request.json
-    record_id = data.get('record_id')
-    action = data.get('action') # 'EDIT', 'DELETE', or 'RESTORE'
-    new_string = data.get('new_string')
-
-    if not record_id or action not in ['EDIT', 'DELETE', 'RESTORE']:
-        return jsonify({"status": "error", "message": "Invalid data."}), 400
+    """Appends actions to the ghost table with Edit Collision prevention.
 
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    Takes one {"record_id", "action", "new_string"} or {"operations": [...]} of them; a batch is
+    checked and logged in one transaction with one backup, and answers with a result per item.
+    """
+    shard = current_shard()
+    data = request.json or {}
     try:
-        # --- NEW: COLLISION CHECK FOR EDITS ---
-        if action == 'EDIT':
-            if not new_string or len(new_string) != 9:
-                return jsonify({"status": "error", "message": "String must be 9 characters."}), 400
-
-            # 1. Rebuild the logical state to check if the new string already exists
-            cursor.execute("SELECT * FROM qr_records")
-            original_records = cursor.fetchall()
-
-            cursor.execute("SELECT * FROM qr_mutations ORDER BY id ASC")
-            mutations = cursor.fetchall()
-
-            records_state = {}
-            for r in original_records:
-                records_state[r['id']] = {'qr_string': r['qr_string'], 'original_string': r['qr_string']}
-
-            for m in mutations:
-                rec_id = m['record_id']
-                if rec_id in records_state:
-                    if m['action'] == 'EDIT':
-                        records_state[rec_id]['qr_string'] = m['new_string']
-                    elif m['action'] == 'RESTORE':
-                        records_state[rec_id]['qr_string'] = records_state[rec_id]['original_string']
-
-            # 2. Check if the submitted string currently belongs to ANY OTHER record
-            for rec_id, rec_data in records_state.items():
-                if rec_id != record_id and rec_data['qr_string'] == new_string:
-                    return jsonify({
-                        "status": "error", 
-                        "message": f"Cannot edit: The string '{new_string}' is already in use by another record!"
-                    }), 400
-
-        # If it passes the check, log the mutation!
-        mutation_date = datetime.now().strftime("%B %d, %Y at %H:%M:%S")
-        cursor.execute(
-            "INSERT INTO qr_mutations (record_id, action, new_string, mutation_date) VALUES (?, ?, ?, ?)",
-            (record_id, action, new_string, mutation_date)
-        )
-        conn.commit()
+        operations = parse_operations(data)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
-        # Trigger your existing GCS Backup!
-        backup_to_gcs()
+    try:
+        with phase("commit"):
+            results = shard.writer.submit(lambda conn, group: apply_mutations(conn, operations, group))
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
+    if 'operations' not in data:
+        # The single-record shape the dashboard has always used
+        if results[0]["status"] != "success":
+            return jsonify({"status": "error", "message": results[0]["message"]}), 400
         return jsonify({"status": "success"})
+
+    applied = sum(1 for r in results if r["status"] == "success")
+    with phase("serialize"):
+        return jsonify({"status": "success", "applied": applied, "failed": len(results) - applied, "results": results})
+
+
+@app.route('/admin/api/stats', methods=['GET'])
+def get_stats():
+    """Per-day and per-hour scan/edit/delete/restore counts (?from=&to=, default the last 30 days)."""
+    shard = current_shard()
+    try:
+        date_from, date_to = parse_date_range(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    try:
+        with phase("db_fetch"):
+            stats = activity_stats(get_connection(shard.db_file), date_from, date_to)
+        return jsonify(stats)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route('/admin/api/import', methods=['POST'])
+def import_codes():
+    """Bulk-loads a CSV/XLSX of pre-issued codes (multipart 'file', optional 'column', 1-based).
+
+    Streams NDJSON: a progress line per committed chunk, then the summary. One backup at the end.
+    """
+    shard = current_shard()
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({"status": "error", "message": "Attach a CSV or XLSX file as 'file'."}), 400
+    try:
+        import_type = import_format(upload.filename)
+        column = int(request.form.get('column', 1)) - 1
+        if column < 0:
+            raise ValueError("column starts at 1.")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    # Spooled to disk: openpyxl needs a seekable file, and the rows are read while the response streams
+    fd, path = tempfile.mkstemp(suffix=f".{import_type}")
+    os.close(fd)
+    upload.save(path)
+
+    def run():
+        summary = None
+        try:
+            # Each chunk is one job in the group commit, so live scans keep flowing in between
+            for summary in iter_import(iter_import_values(path, import_type, column), shard.writer.submit):
+                yield json.dumps({"status": "progress", "rows": summary["rows"], "inserted": summary["inserted"]}) + "\n"
+            yield json.dumps({"status": "success", **summary}) + "\n"
+        except Exception as e:
+            yield json.dumps({"status": "error", "message": str(e), **(summary or {})}) + "\n"
+        finally:
+            os.remove(path)
+            # The chunks don't mark their groups dirty: the whole import gets ONE backup, queued here
+            if summary and summary["inserted"]:
+                shard.backup_scheduler.request_backup()
+                shard.broadcaster.notify()
+
+    return Response(run(), mimetype="application/x-ndjson")
+
+
+@app.route('/events', methods=['GET'])
+def live_events():
+    """Server-Sent Events: new scans and mutations right after they commit (resumes from Last-Event-ID)."""
+    shard = current_shard()
+    subscriber, position = shard.broadcaster.subscribe()
+    if subscriber is None:
+        response = jsonify({"status": "error", "message": "Too many live connections, try again shortly."})
+        response.status_code = 503
+        response.headers["Retry-After"] = "10"
+        return response
+
+    # EventSource sends Last-Event-ID on reconnects, ?last_event_id= lets a fresh page resume too
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    response = Response(stream_events(shard.broadcaster, subscriber, position, last_event_id), mimetype='text/event-stream')
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no" # Don't let a proxy sit on the stream
+    response.call_on_close(lambda: shard.broadcaster.unsubscribe(subscriber)) # Even if the body never started
+    return response
+
+
+@app.route('/admin/api/backup-status', methods=['GET'])
+def backup_status():
+    """When did the last cloud backup land, and how far behind is it?"""
+    shard = current_shard()
+    return jsonify(shard.backup_scheduler.status())
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness probe: 200 once the DB is restored and migrated, 503 (with progress) until then."""
+    shard = current_shard()
+    status = shard.startup.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint (numbers are for this worker process)."""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+def parse_export_request(args):
+    """(format, filters, as_of) from the query string/body; raises ValueError on bad input."""
+    export_format = (args.get('format') or 'xlsx').lower()
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}.")
+    filters = parse_export_filters(args)
+    as_of = parse_as_of(args['as_of']) if args.get('as_of') else None
+    return export_format, filters, as_of
+
+
+def export_job_response(job):
+    if job["status"] == "done":
+        job["download_url"] = f"/export-jobs/{job['job_id']}/download"
+    return jsonify({"status": "success", "job": job}), 200 if job["status"] == "done" else 202
+
+
+@app.route('/export-jobs', methods=['POST'])
+def start_export_job():
+    """Queues an export in the background (same parameters as /export-excel). Poll the job, then download it.
+
+    Nothing changed since the same export last ran? The finished file is returned straight away.
+    """
+    shard = current_shard()
+    try:
+        export_format, filters, as_of = parse_export_request(request.get_json(silent=True) or request.values)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    try:
+        with phase("replay"):
+            version = data_version()
+        return export_job_response(shard.export_jobs.submit(export_format, filters, as_of, version))
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
-    finally:
-        conn.close()
+
+
+@app.route('/export-jobs/<job_id>', methods=['GET'])
+def export_job_status(job_id):
+    """queued / running (rows done of total) / done (with download_url) / failed."""
+    shard = current_shard()
+    job = shard.export_jobs.status(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Export job not found (it may have expired)."}), 404
+    return export_job_response(job)
+
+
+@app.route('/export-jobs/<job_id>/download', methods=['GET'])
+def download_export_job(job_id):
+    shard = current_shard()
+    artifact = shard.export_jobs.artifact(job_id)
+    if artifact is None:
+        return jsonify({"status": "error", "message": "Export not ready (or expired)."}), 404
+    path, download_name, mimetype = artifact
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=download_name, mimetype=mimetype)
 
 
 @app.route('/export-excel', methods=['GET'])
 def export_excel():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    """Streams the registry as xlsx (default), csv or ndjson (?format=), with optional status/date filters."""
+    shard = current_shard()
+    try:
+        export_format, filters, as_of = parse_export_request(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
 
     try:
-        # 1. Fetch data and rebuild logical state (just like your other routes!)
-        cursor.execute("SELECT * FROM qr_records")
-        original_records = cursor.fetchall()
-        cursor.execute("SELECT * FROM qr_mutations ORDER BY id ASC")
-        mutations = cursor.fetchall()
-
-        records_state = {}
-        for r in original_records:
-            records_state[r['id']] = {
-                'id': r['id'],
-                'qr_string': r['qr_string'],
-                'original_string': r['qr_string'],
-                'scan_date': r['scan_date'],
-                'status': 'ACTIVE'
-            }
-
-        # Fast-forward history
-        for m in mutations:
-            rec_id = m['record_id']
-            if rec_id in records_state:
-                if m['action'] == 'DELETE':
-                    records_state[rec_id]['status'] = 'DELETED'
-                elif m['action'] == 'EDIT':
-                    records_state[rec_id]['status'] = 'EDITED'
-                    records_state[rec_id]['qr_string'] = m['new_string']
-                elif m['action'] == 'RESTORE':
-                    is_edited = records_state[rec_id]['qr_string'] != records_state[rec_id]['original_string']
-                    records_state[rec_id]['status'] = 'EDITED' if is_edited else 'ACTIVE'
-
-        # 2. Filter out deleted items and sort them
-        active_records = [rec for rec in records_state.values() if rec['status'] != 'DELETED']
-        active_records.sort(key=lambda x: x['id'], reverse=True) # Newest first
-
-        # 3. Create the simple Excel Workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "QR Scans"
-
-        # Add header row
-        ws.append(["QR String", "Scan Date", "Status"])
-
-        # Add the data rows
-        for rec in active_records:
-            ws.append([rec['qr_string'], rec['scan_date'], rec['status']])
-
-        # 4. Save to memory and send it to the user!
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
-
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name="QR_Registry_Export.xlsx",
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        # Already rendered by an export job and nothing changed since: hand that file over
+        with phase("replay"):
+            artifact = shard.export_jobs.artifact(export_job_id(export_format, filters, as_of, data_version()))
+        if artifact is not None:
+            path, download_name, mimetype = artifact
+            return send_file(os.path.abspath(path), as_attachment=True, download_name=download_name, mimetype=mimetype)
+
+        with phase("replay"):
+            rows, name, _ = open_export(shard.db_file, filters, as_of, archive_dir=shard.archive_dir)
+        download_name = f"{name}.{extension}"
+
+        if export_format == 'csv':
+            body = stream_csv(rows)
+        elif export_format == 'ndjson':
+            body = stream_ndjson(rows)
+        else:
+            # xlsx is a zip, so it has to be finished before we can send it.
+            # Render it to a temp file (not memory) and stream that back.
+            output = tempfile.TemporaryFile()
+            with phase("serialize"):
+                write_xlsx(rows, output)
+            output.seek(0)
+            return send_file(output, as_attachment=True, download_name=download_name, mimetype=mimetype)
+
+        return Response(
+            body,
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment; filename={download_name}"}
         )
 
+    except ArchiveUnavailable as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
-    finally:
-        conn.close()
 
 
 if __name__ == '__main__':
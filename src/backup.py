@@ -0,0 +1,752 @@
+import atexit
+import base64
+import contextlib
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError: # Windows dev boxes: no cross-process lock, one worker is the norm there anyway
+    fcntl = None
+
+# Backups used to run inline in every write request (new storage.Client, full upload
+# of a file other connections might be writing to). Now writes just call
+# request_backup() and a background thread takes a consistent snapshot with the
+# SQLite online backup API and uploads it, at most once per window.
+#
+# Both tables are append-only (except when the janitor runs), so instead of
+# re-uploading the whole DB every time we ship:
+#   * a gzipped full "base" snapshot every so often,
+#   * small gzipped JSON "segments" with the rows added since the last shipment,
+#   * a manifest.json tying them together.
+# Restoring = base + replay the segments in order.
+#
+# Several processes ship the same DB (every gunicorn worker, bulk_import.py), so:
+#   * a file lock next to the DB lets only one of them ship at a time,
+#   * the manifest is only written if it is still the version we read (generation
+#     precondition), otherwise we start over from the new one,
+#   * objects an old manifest pointed to are deleted only once the new one is written,
+#   * a local DB that is behind the backup (e.g. a failed restore) never replaces it.
+
+BUCKET_NAME = "valid-string-backup-bucket"
+BACKUP_OBJECT = "backups/qr_data_backup.db" # Legacy single-file backup (still restorable)
+MANIFEST_OBJECT = "backups/manifest.json"
+FULL_EVERY_SEGMENTS = 200 # Take a fresh base once this many segments have piled up
+MANIFEST_RETRIES = 5      # Attempts when another shipper moves the manifest under us
+SHIP_LOCK_SUFFIX = ".ship.lock"
+LOG_TABLES = ("qr_records", "qr_mutations")
+
+# Big objects are pulled as parallel ranged reads instead of one long stream
+PARALLEL_DOWNLOAD_THRESHOLD = 32 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+DOWNLOAD_WORKERS = 8
+
+
+class PreconditionFailed(Exception):
+    """A conditional write lost the race: the object is no longer at the generation we read."""
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive lock on path across every process (and thread) on this machine."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# --- STORAGE BACKENDS ---
+
+class GCSBackend:
+    """Google Cloud Storage, with ONE client reused for every upload."""
+
+    def __init__(self, bucket_name):
+        self.bucket_name = bucket_name
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    def _get_bucket(self):
+        with self._lock:
+            if self._bucket is None:
+                from google.cloud import storage # Only pay for the import when we actually talk to GCS
+                self._bucket = storage.Client().bucket(self.bucket_name)
+            return self._bucket
+
+    def upload_file(self, local_path, object_name):
+        self._get_bucket().blob(object_name).upload_from_filename(local_path)
+
+    def download_file(self, object_name, local_path):
+        """Returns False if the object doesn't exist yet."""
+        blob = self._get_bucket().blob(object_name)
+        if not blob.exists():
+            return False
+        blob.download_to_filename(local_path)
+        return True
+
+    def upload_bytes(self, data, object_name, if_generation_match=None):
+        """With if_generation_match, only writes if the object is still at that generation (0 = doesn't exist yet)."""
+        from google.api_core.exceptions import PreconditionFailed as GCSPreconditionFailed
+        try:
+            self._get_bucket().blob(object_name).upload_from_string(data, if_generation_match=if_generation_match)
+        except GCSPreconditionFailed as e:
+            raise PreconditionFailed(object_name) from e
+
+    def download_versioned(self, object_name):
+        """(data, generation) of a small object, or (None, 0) if it doesn't exist yet."""
+        from google.api_core.exceptions import PreconditionFailed as GCSPreconditionFailed
+        blob = self._get_bucket().get_blob(object_name)
+        if blob is None:
+            return None, 0
+        try:
+            return blob.download_as_bytes(if_generation_match=blob.generation), blob.generation
+        except GCSPreconditionFailed as e:
+            raise PreconditionFailed(object_name) from e # Rewritten between the lookup and the read
+
+    def object_info(self, object_name):
+        """Size, generation and crc32c of an object (None if it doesn't exist), without downloading it."""
+        blob = self._get_bucket().get_blob(object_name)
+        if blob is None:
+            return None
+        return {"size": blob.size, "generation": blob.generation, "crc32c": blob.crc32c}
+
+    def download_bytes(self, object_name, progress=None):
+        """Returns None if the object doesn't exist yet. progress(done_bytes, total_bytes) is called as chunks land."""
+        blob = self._get_bucket().get_blob(object_name)
+        if blob is None:
+            return None
+        if blob.size < PARALLEL_DOWNLOAD_THRESHOLD:
+            data = blob.download_as_bytes(if_generation_match=blob.generation)
+            if progress:
+                progress(len(data), blob.size)
+            return data
+
+        # Pin the generation so every range comes from the same version of the object
+        ranges = [(start, min(start + DOWNLOAD_CHUNK_SIZE, blob.size) - 1) for start in range(0, blob.size, DOWNLOAD_CHUNK_SIZE)]
+        done = [0]
+        done_lock = threading.Lock()
+
+        def fetch(byte_range):
+            chunk = blob.download_as_bytes(start=byte_range[0], end=byte_range[1], if_generation_match=blob.generation)
+            if progress:
+                with done_lock:
+                    done[0] += len(chunk)
+                    progress(done[0], blob.size)
+            return chunk
+
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+            data = b"".join(pool.map(fetch, ranges))
+        if not crc32c_matches(data, blob.crc32c):
+            raise IOError(f"Checksum mismatch downloading {object_name}")
+        return data
+
+    def delete(self, object_name):
+        blob = self._get_bucket().blob(object_name)
+        if blob.exists():
+            blob.delete()
+
+
+class LocalDirBackend:
+    """Stand-in for GCS that just copies objects into a local directory (handy for testing)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, object_name):
+        return os.path.join(self.root, *object_name.split("/"))
+
+    def _part_path(self, dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # Unique per writer, so two processes writing the same object don't share a temp file
+        return f"{dest}.{os.getpid()}-{threading.get_ident()}.part"
+
+    def upload_file(self, local_path, object_name):
+        dest = self._path(object_name)
+        # Copy then rename so a half-written object is never visible
+        tmp = self._part_path(dest)
+        shutil.copyfile(local_path, tmp)
+        os.replace(tmp, dest)
+
+    def download_file(self, object_name, local_path):
+        src = self._path(object_name)
+        if not os.path.exists(src):
+            return False
+        shutil.copyfile(src, local_path)
+        return True
+
+    def upload_bytes(self, data, object_name, if_generation_match=None):
+        dest = self._path(object_name)
+        tmp = self._part_path(dest)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        if if_generation_match is None:
+            os.replace(tmp, dest)
+            return
+
+        with file_lock(dest + ".lock"):
+            info = self.object_info(object_name)
+            current = info["generation"] if info else 0
+            if current != if_generation_match:
+                os.remove(tmp)
+                raise PreconditionFailed(object_name)
+            # The generation is the mtime: make sure it moves even if two writes land in the same clock tick
+            stamp = max(time.time_ns(), current + 1)
+            os.utime(tmp, ns=(stamp, stamp))
+            os.replace(tmp, dest)
+
+    def download_versioned(self, object_name):
+        try:
+            with open(self._path(object_name), "rb") as f:
+                return f.read(), os.fstat(f.fileno()).st_mtime_ns
+        except FileNotFoundError:
+            return None, 0
+
+    def object_info(self, object_name):
+        src = self._path(object_name)
+        if not os.path.exists(src):
+            return None
+        stat = os.stat(src)
+        return {"size": stat.st_size, "generation": stat.st_mtime_ns, "crc32c": None}
+
+    def download_bytes(self, object_name, progress=None):
+        src = self._path(object_name)
+        if not os.path.exists(src):
+            return None
+        with open(src, "rb") as f:
+            data = f.read()
+        if progress:
+            progress(len(data), len(data))
+        return data
+
+    def delete(self, object_name):
+        src = self._path(object_name)
+        if os.path.exists(src):
+            os.remove(src)
+
+
+def backend_from_env(bucket_name):
+    """BACKUP_BACKEND=local (+ BACKUP_LOCAL_DIR) swaps GCS out for a plain directory."""
+    if os.environ.get("BACKUP_BACKEND", "gcs") == "local":
+        return LocalDirBackend(os.environ.get("BACKUP_LOCAL_DIR", "local_backups"))
+    return GCSBackend(bucket_name)
+
+
+def crc32c_of(data):
+    """GCS-style (base64, big-endian) crc32c, or None without the checksum library."""
+    try:
+        import google_crc32c # Ships with google-cloud-storage
+    except ImportError:
+        return None
+    return base64.b64encode(google_crc32c.Checksum(data).digest()).decode("ascii")
+
+
+def crc32c_matches(data, expected):
+    """For verifying downloads: only False on a real mismatch."""
+    actual = crc32c_of(data) if expected else None
+    return actual is None or actual == expected
+
+
+# --- SNAPSHOTS ---
+
+def snapshot_database(db_file, dest_path):
+    """Copies a consistent snapshot of db_file into dest_path, even while others are writing."""
+    src = sqlite3.connect(db_file)
+    dst = sqlite3.connect(dest_path)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _read_generation(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _read_tips(conn):
+    """Highest qr_records.id / qr_mutations.id in a database."""
+    return tuple(conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0] for table in LOG_TABLES)
+
+
+# --- SHIPPERS ---
+
+class FullSnapshotShipper:
+    """The old behaviour: upload the whole DB as one object every time."""
+
+    def __init__(self, db_file, backend, object_name=BACKUP_OBJECT):
+        self.db_file = db_file
+        self.backend = backend
+        self.object_name = object_name
+
+    def ship(self):
+        fd, snapshot_path = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(self.db_file)))
+        os.close(fd)
+        try:
+            snapshot_database(self.db_file, snapshot_path)
+            self.backend.upload_file(snapshot_path, self.object_name)
+        finally:
+            os.remove(snapshot_path)
+        return "full"
+
+
+class IncrementalShipper:
+    """Ships only the log rows added since the last shipment, plus a periodic full base."""
+
+    def __init__(self, db_file, backend, full_every_segments=FULL_EVERY_SEGMENTS):
+        self.db_file = db_file
+        self.backend = backend
+        self.full_every_segments = full_every_segments
+
+    def load_manifest(self):
+        return self._load_manifest()[0]
+
+    def _load_manifest(self):
+        """(manifest or None, its object generation). Always re-read: another worker may have shipped since."""
+        data, object_generation = self.backend.download_versioned(MANIFEST_OBJECT)
+        return (json.loads(data) if data else None), object_generation
+
+    def _save_manifest(self, manifest, if_generation_match):
+        self.backend.upload_bytes(json.dumps(manifest, indent=1).encode("utf-8"), MANIFEST_OBJECT,
+                                  if_generation_match=if_generation_match)
+
+    def _delete_objects(self, objects):
+        for obj in objects:
+            try:
+                self.backend.delete(obj)
+            except Exception as e:
+                print(f"⚠️ Could not delete old backup object {obj}: {e}")
+
+    def ship(self):
+        """Returns 'base', 'segment' or None (nothing new to ship)."""
+        # Every worker (and bulk_import.py) ships from this same file: one of them at a time
+        with file_lock(self.db_file + SHIP_LOCK_SUFFIX):
+            for attempt in range(MANIFEST_RETRIES):
+                try:
+                    return self._ship_once()
+                except PreconditionFailed:
+                    # Someone else (another machine) moved the manifest between our read and write: redo from theirs
+                    if attempt == MANIFEST_RETRIES - 1:
+                        raise
+
+    def _ship_once(self):
+        manifest, object_generation = self._load_manifest()
+
+        conn = sqlite3.connect(self.db_file)
+        try:
+            generation = _read_generation(conn)
+            tips = _read_tips(conn)
+        finally:
+            conn.close()
+
+        if manifest is not None and is_behind(manifest, generation, tips):
+            # Most likely the restore failed and we started on an empty/old DB: shipping it would throw the backup away
+            raise RuntimeError(
+                f"Local DB (generation {generation}, tips {tips}) is behind the backup "
+                f"(generation {manifest['generation']}, tips {manifest_tips(manifest)}); not overwriting it. "
+                "Restart to restore, or move backups/manifest.json aside to start a new backup."
+            )
+        if manifest is None or self._needs_base(manifest, generation):
+            self._ship_base(manifest, object_generation)
+            return "base"
+        return self._ship_segment(manifest, object_generation)
+
+    def _needs_base(self, manifest, generation):
+        if manifest.get("generation") != generation:
+            return True # The janitor rewrote history, segments can't describe that
+        return len(manifest["segments"]) >= self.full_every_segments
+
+    def _ship_base(self, old_manifest, object_generation):
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        fd, snapshot_path = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(self.db_file)))
+        os.close(fd)
+        try:
+            snapshot_database(self.db_file, snapshot_path)
+
+            # Read the tips from the snapshot itself so they match exactly what we upload
+            snap = sqlite3.connect(snapshot_path)
+            try:
+                generation = _read_generation(snap)
+                tips = _read_tips(snap)
+            finally:
+                snap.close()
+
+            with open(snapshot_path, "rb") as f:
+                data = gzip.compress(f.read())
+        finally:
+            os.remove(snapshot_path)
+
+        base_object = f"backups/base/{stamp}-{os.urandom(3).hex()}.db.gz"
+        self.backend.upload_bytes(data, base_object)
+        try:
+            self._save_manifest({
+                "format": 1,
+                "generation": generation,
+                "base": {"object": base_object, "last_record_id": tips[0], "last_mutation_id": tips[1]},
+                "segments": []
+            }, object_generation)
+        except PreconditionFailed:
+            self._delete_objects([base_object]) # Nothing points at it
+            raise
+
+        # Old base + segments are unreachable now (and only now)
+        if old_manifest:
+            self._delete_objects(manifest_objects(old_manifest))
+
+    def _ship_segment(self, manifest, object_generation):
+        last_record_id, last_mutation_id = manifest_tips(manifest)
+
+        conn = sqlite3.connect(self.db_file)
+        try:
+            # One read snapshot for both tables
+            conn.execute("BEGIN")
+            tables = {}
+            for table, last_id in zip(LOG_TABLES, (last_record_id, last_mutation_id)):
+                cursor = conn.execute(f"SELECT * FROM {table} WHERE id > ? ORDER BY id ASC", (last_id,))
+                tables[table] = {
+                    "columns": [d[0] for d in cursor.description],
+                    "rows": [list(r) for r in cursor.fetchall()]
+                }
+            conn.commit()
+        finally:
+            conn.close()
+
+        new_records = tables["qr_records"]["rows"]
+        new_mutations = tables["qr_mutations"]["rows"]
+        if not new_records and not new_mutations:
+            return None
+
+        to_record_id = new_records[-1][0] if new_records else last_record_id
+        to_mutation_id = new_mutations[-1][0] if new_mutations else last_mutation_id
+
+        # The random suffix keeps a losing shipper's cleanup from deleting the winner's object of the same range
+        segment_object = f"backups/segments/{manifest['generation']}-{to_record_id}-{to_mutation_id}-{os.urandom(3).hex()}.json.gz"
+        self.backend.upload_bytes(gzip.compress(json.dumps(tables).encode("utf-8")), segment_object)
+
+        manifest["segments"].append({
+            "object": segment_object,
+            "last_record_id": to_record_id,
+            "last_mutation_id": to_mutation_id
+        })
+        try:
+            self._save_manifest(manifest, object_generation)
+        except PreconditionFailed:
+            self._delete_objects([segment_object])
+            raise
+        return "segment"
+
+
+def manifest_tips(manifest):
+    """The (record id, mutation id) high-water mark a manifest covers."""
+    latest = manifest["segments"][-1] if manifest["segments"] else manifest["base"]
+    return latest["last_record_id"], latest["last_mutation_id"]
+
+
+def is_behind(manifest, generation, tips):
+    """Is a local DB at (generation, tips) older than what the manifest already holds?"""
+    if generation != manifest["generation"]:
+        return generation < manifest["generation"] # The janitor/compaction only ever moves it forward
+    shipped = manifest_tips(manifest)
+    return tips[0] < shipped[0] or tips[1] < shipped[1]
+
+
+def manifest_objects(manifest):
+    return [manifest["base"]["object"]] + [seg["object"] for seg in manifest["segments"]]
+
+
+def apply_segment(conn, segment):
+    """Replays one segment's rows into a restored DB (INSERT OR IGNORE makes overlaps harmless)."""
+    for table in LOG_TABLES:
+        part = segment.get(table)
+        if not part or not part["rows"]:
+            continue
+        columns = ", ".join(part["columns"])
+        placeholders = ", ".join("?" * len(part["columns"]))
+        conn.executemany(f"INSERT OR IGNORE INTO {table} ({columns}) VALUES ({placeholders})", part["rows"])
+
+
+def _drop_wal_files(db_file):
+    # A leftover WAL from the old file would be replayed on top of the restored one
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(db_file + suffix):
+            os.remove(db_file + suffix)
+
+
+SOURCE_SUFFIX = ".source.json" # Remembers which legacy backup object a local DB came from
+
+
+def _local_position(db_file):
+    """(generation, tips) of an existing local DB, or None if there isn't a usable one."""
+    if not os.path.exists(db_file):
+        return None
+    try:
+        conn = sqlite3.connect(db_file)
+        try:
+            return _read_generation(conn), _read_tips(conn)
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+def _catch_up_local(backend, db_file, manifest, local_tips, report):
+    """Applies just the segments past local_tips to the local DB. Returns how many were applied."""
+    from projection import project_new_records_since, project_mutation
+    from timestamps import migrate_timestamps
+
+    pending = [seg for seg in manifest["segments"]
+               if seg["last_record_id"] > local_tips[0] or seg["last_mutation_id"] > local_tips[1]]
+    if not pending:
+        return 0
+
+    conn = sqlite3.connect(db_file)
+    try:
+        migrate_timestamps(conn)
+        for i, seg in enumerate(pending, 1):
+            apply_segment(conn, json.loads(gzip.decompress(backend.download_bytes(seg["object"]))))
+            report("applying_segments", i, len(pending))
+        migrate_timestamps(conn) # Segments shipped before the timestamp columns existed
+
+        # Bring qr_state along incrementally instead of rebuilding it
+        cursor = conn.cursor()
+        project_new_records_since(cursor, local_tips[0])
+        for m in conn.execute(
+            "SELECT record_id, action, new_string FROM qr_mutations WHERE id > ? ORDER BY id ASC", (local_tips[1],)
+        ).fetchall():
+            project_mutation(cursor, m[0], m[1], m[2])
+        conn.commit()
+    finally:
+        conn.close()
+    return len(pending)
+
+
+def restore_from_backup(backend, db_file, progress=None):
+    """Brings db_file up to date with the backup, downloading as little as possible.
+
+    Returns "restored" (full download), "caught_up" (only missing segments applied),
+    "up_to_date" (nothing to fetch), "local_ahead" (the local DB is newer than the backup,
+    left alone) or False if there's no backup at all.
+    progress(stage, done, total) is called along the way (for the readiness endpoint).
+    """
+    from projection import rebuild_projection
+    from timestamps import migrate_timestamps
+
+    def report(stage, done=None, total=None):
+        if progress:
+            progress(stage, done, total)
+
+    report("checking")
+    manifest = backend.download_bytes(MANIFEST_OBJECT)
+    if manifest is None:
+        return _restore_legacy(backend, db_file, report)
+    manifest = json.loads(manifest)
+
+    # Same history (generation) and at least as far as the base: only the newer segments are missing
+    local = _local_position(db_file)
+    base = manifest["base"]
+    if local and local[0] == manifest["generation"] and local[1][0] >= base["last_record_id"] and local[1][1] >= base["last_mutation_id"]:
+        applied = _catch_up_local(backend, db_file, manifest, local[1], report)
+        return "caught_up" if applied else "up_to_date"
+    if local and not is_behind(manifest, local[0], local[1]):
+        # Compacted or cleaned (generation bumped) since the last ship: replacing it would throw that
+        # away, along with any scans made since. The next ship sees the new generation and uploads a base.
+        return "local_ahead"
+
+    fd, restore_path = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(db_file)))
+    os.close(fd)
+    try:
+        data = backend.download_bytes(base["object"], lambda done, total: report("downloading", done, total))
+        with open(restore_path, "wb") as f:
+            f.write(gzip.decompress(data))
+        del data
+
+        conn = sqlite3.connect(restore_path)
+        try:
+            # An older base may predate scan_ts / mutation_ts while newer segments carry them
+            migrate_timestamps(conn)
+            segments = manifest["segments"]
+            for i, seg in enumerate(segments, 1):
+                apply_segment(conn, json.loads(gzip.decompress(backend.download_bytes(seg["object"]))))
+                report("applying_segments", i, len(segments))
+            migrate_timestamps(conn)
+            conn.commit()
+
+            # Segments only carry the log, so regenerate the current-state table from it
+            report("rebuilding_projection")
+            rebuild_projection(conn)
+        finally:
+            conn.close()
+
+        _drop_wal_files(db_file)
+        os.replace(restore_path, db_file)
+    finally:
+        if os.path.exists(restore_path):
+            os.remove(restore_path)
+    return "restored"
+
+
+def _restore_legacy(backend, db_file, report):
+    """The old single-file backup: skip the download if the local copy is that exact object already."""
+    info = backend.object_info(BACKUP_OBJECT)
+    if info is None:
+        return False
+
+    source_file = db_file + SOURCE_SUFFIX
+    if os.path.exists(db_file):
+        if os.path.exists(source_file):
+            with open(source_file) as f:
+                if json.load(f).get("generation") == info["generation"]:
+                    return "up_to_date"
+        elif info["crc32c"] and not os.path.exists(db_file + "-wal"):
+            # No record of where it came from, but reading it locally still beats downloading it
+            with open(db_file, "rb") as f:
+                if crc32c_of(f.read()) == info["crc32c"]:
+                    return "up_to_date"
+
+    data = backend.download_bytes(BACKUP_OBJECT, lambda done, total: report("downloading", done, total))
+    _drop_wal_files(db_file)
+    tmp = db_file + ".part"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, db_file)
+    with open(source_file, "w") as f:
+        json.dump({"object": BACKUP_OBJECT, "generation": info["generation"]}, f)
+    return "restored"
+
+
+# --- THE SCHEDULER ---
+
+class BackupScheduler:
+    """Coalesces bursts of writes into one snapshot + upload per window."""
+
+    def __init__(self, shipper, window_seconds=5.0):
+        self.shipper = shipper
+        self.window_seconds = window_seconds
+
+        self._cond = threading.Condition()
+        self._thread = None
+        self._dirty_since = None   # time.time() of the oldest write not yet backed up
+        self._running = False       # an upload is in flight right now
+        self._stopping = False
+        self._last_attempt = 0.0     # so a failing backend is retried once per window, not in a hot loop
+
+        self.last_success = None    # datetime of the last good upload
+        self.last_error = None
+        self.backup_count = 0
+        self.failure_count = 0
+        self.last_kind = None       # 'base', 'segment', 'full' or None (nothing new)
+        self.last_duration = None   # seconds the last successful ship took
+
+    def request_backup(self):
+        """Called after every committed write. Cheap: it only flags the DB as dirty."""
+        with self._cond:
+            if self._dirty_since is None:
+                self._dirty_since = time.time()
+            self._ensure_thread()
+            self._cond.notify_all()
+
+    def _ensure_thread(self):
+        # Started lazily so each gunicorn worker gets its own thread after the fork
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._worker, name="backup-scheduler", daemon=True)
+            self._thread.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self._dirty_since is None and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+
+                # Let the burst finish: wait until the window since the first dirty write has passed
+                deadline = max(self._dirty_since, self._last_attempt) + self.window_seconds
+                while not self._stopping and time.time() < deadline:
+                    self._cond.wait(deadline - time.time())
+
+            self.run_backup()
+
+    def run_backup(self):
+        """Snapshots and uploads right now. Returns True on success."""
+        with self._cond:
+            # One upload at a time per process
+            while self._running:
+                self._cond.wait()
+            # Anything written after this point will need another backup
+            dirty_since = self._dirty_since
+            self._dirty_since = None
+            self._running = True
+            self._last_attempt = time.time()
+
+        started = time.perf_counter()
+        try:
+            kind = self.shipper.ship()
+        except Exception as e:
+            with self._cond:
+                # Put the dirty marker back so the next window retries
+                if dirty_since is not None and (self._dirty_since is None or dirty_since < self._dirty_since):
+                    self._dirty_since = dirty_since
+                self.last_error = str(e)
+                self.failure_count += 1
+            print(f"❌ Cloud Backup Failed: {e}")
+            return False
+        finally:
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
+
+        with self._cond:
+            self.last_success = datetime.now()
+            self.last_error = None
+            self.backup_count += 1
+            self.last_kind = kind
+            self.last_duration = time.perf_counter() - started
+        print(f"☁️ Cloud Backup Successful ({kind or 'nothing new'}): {self.last_success}")
+        return True
+
+    def flush(self):
+        """Uploads any pending changes immediately (used on shutdown)."""
+        with self._cond:
+            while self._running:
+                self._cond.wait()
+            pending = self._dirty_since is not None
+        if pending:
+            return self.run_backup()
+        return True
+
+    def shutdown(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=self.window_seconds + 1)
+        self.flush()
+
+    def status(self):
+        with self._cond:
+            lag = time.time() - self._dirty_since if self._dirty_since is not None else 0.0
+            return {
+                "last_success": self.last_success.isoformat() if self.last_success else None,
+                "lag_seconds": round(lag, 3),
+                "pending": self._dirty_since is not None,
+                "last_error": self.last_error,
+                "backup_count": self.backup_count,
+                "last_kind": self.last_kind,
+                "failure_count": self.failure_count,
+                "window_seconds": self.window_seconds
+            }
+
+    def register_shutdown_flush(self):
+        atexit.register(self.shutdown)
+        return self
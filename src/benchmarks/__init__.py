@@ -0,0 +1 @@
+"""Synthetic-registry benchmarks for the QR registry (see run.py / compare.py)."""
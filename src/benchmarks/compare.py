@@ -0,0 +1,73 @@
+import argparse
+import json
+import sys
+
+# Compares a fresh benchmark run against a stored baseline and exits non-zero
+# if anything got slower than the allowed threshold.
+#
+#   python -m benchmarks.compare baseline.json bench_results.json --threshold 0.25
+
+# Below this many ms, timer noise dominates, so don't flag it
+NOISE_FLOOR_MS = 1.0
+
+
+def collect_metrics(report):
+    """Flattens a report into {(size, metric): value} where bigger is worse."""
+    metrics = {}
+    for size, result in report.get('sizes', {}).items():
+        for route, stats in result.get('routes', {}).items():
+            metrics[(size, f"{route}.p50_ms")] = stats['p50_ms']
+            metrics[(size, f"{route}.p95_ms")] = stats['p95_ms']
+        if 'concurrent' in result:
+            metrics[(size, "concurrent.p99_ms")] = result['concurrent']['p99_ms']
+        if 'janitor_s' in result:
+            metrics[(size, "janitor_ms")] = result['janitor_s'] * 1000
+    return metrics
+
+
+def compare(baseline, current, threshold):
+    """Returns a list of (size, metric, baseline, current, ratio) regressions."""
+    base = collect_metrics(baseline)
+    regressions = []
+    for key, value in sorted(collect_metrics(current).items()):
+        old = base.get(key)
+        if old is None or value < NOISE_FLOOR_MS:
+            continue
+        ratio = value / old if old else float('inf')
+        if ratio > 1 + threshold:
+            regressions.append((key[0], key[1], old, value, ratio))
+
+    # Throughput is the one metric where smaller is worse
+    for size, result in current.get('sizes', {}).items():
+        old = baseline.get('sizes', {}).get(size, {}).get('concurrent', {}).get('throughput_rps')
+        new = result.get('concurrent', {}).get('throughput_rps')
+        if old and new is not None and new < old * (1 - threshold):
+            regressions.append((size, "concurrent.throughput_rps", old, new, new / old))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flag benchmark regressions against a stored baseline.")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown, 0.25 = 25%%")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    regressions = compare(baseline, current, args.threshold)
+    if not regressions:
+        print(f"✅ No regressions beyond {args.threshold:.0%}.")
+        return 0
+
+    print(f"❌ {len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+    for size, metric, old, new, ratio in regressions:
+        print(f"   [{size} records] {metric}: {old:.3f} -> {new:.3f} ({ratio:.2f}x)")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
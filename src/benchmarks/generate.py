@@ -0,0 +1,92 @@
+import argparse
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+from db import SCAN_DATE_FORMAT
+
+# Builds a synthetic qr_data.db with the same log tables the app uses, so the
+# routes and the janitor can be timed at sizes we don't have in production yet.
+
+DEFAULT_MIX = {'EDIT': 0.5, 'DELETE': 0.35, 'RESTORE': 0.15}
+
+
+def parse_mix(text):
+    """'EDIT=0.5,DELETE=0.3,RESTORE=0.2' -> normalised dict."""
+    mix = {}
+    for part in text.split(','):
+        action, _, weight = part.partition('=')
+        action = action.strip().upper()
+        if action not in DEFAULT_MIX:
+            raise ValueError(f"Unknown action '{action}' in mix.")
+        mix[action] = float(weight)
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("Mix weights must add up to something positive.")
+    return {action: weight / total for action, weight in mix.items()}
+
+
+def generate_registry(db_file, records, mutations_per_record=0.2, mix=None, seed=42):
+    """Writes `records` scans plus roughly records * mutations_per_record ghost mutations."""
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    actions = list(mix)
+    weights = [mix[a] for a in actions]
+
+    conn = sqlite3.connect(db_file)
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS qr_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            qr_string TEXT UNIQUE NOT NULL,
+            scan_date TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS qr_mutations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            record_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            new_string TEXT,
+            mutation_date TEXT NOT NULL,
+            FOREIGN KEY(record_id) REFERENCES qr_records(id)
+        );
+    ''')
+
+    # Spread the scans over the last ~90 days, oldest first
+    start = datetime.now() - timedelta(days=90)
+    step = timedelta(days=90) / max(records, 1)
+    conn.executemany(
+        "INSERT INTO qr_records (qr_string, scan_date) VALUES (?, ?)",
+        ((f"R{i:08d}", (start + step * i).strftime(SCAN_DATE_FORMAT)) for i in range(records))
+    )
+
+    # Edits always get a fresh string so the generated registry has no logical collisions
+    mutation_count = int(records * mutations_per_record)
+    rows = []
+    for i in range(mutation_count):
+        action = rng.choices(actions, weights)[0]
+        record_id = rng.randint(1, records)
+        new_string = f"M{i:08d}" if action == 'EDIT' else None
+        rows.append((record_id, action, new_string, datetime.now().strftime(SCAN_DATE_FORMAT)))
+    conn.executemany(
+        "INSERT INTO qr_mutations (record_id, action, new_string, mutation_date) VALUES (?, ?, ?, ?)", rows
+    )
+
+    conn.commit()
+    conn.close()
+    return {'records': records, 'mutations': mutation_count, 'mix': mix}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic qr_data.db for benchmarking.")
+    parser.add_argument("db_file")
+    parser.add_argument("--records", type=int, default=10000)
+    parser.add_argument("--mutations-per-record", type=float, default=0.2)
+    parser.add_argument("--mix", default="EDIT=0.5,DELETE=0.35,RESTORE=0.15")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    info = generate_registry(args.db_file, args.records, args.mutations_per_record, parse_mix(args.mix), args.seed)
+    print(f"✅ Generated {info['records']} records and {info['mutations']} mutations in {args.db_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from benchmarks.generate import generate_registry, parse_mix
+
+# Times every route through the Flask test client against synthetic registries
+# of several sizes, plus the janitor and an optional concurrent-client run.
+#
+#   cd src && python -m benchmarks.run --sizes 1000,10000,100000 --output bench.json
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Seconds in, milliseconds out."""
+    ms = [s * 1000 for s in samples]
+    return {
+        'count': len(ms),
+        'mean_ms': round(sum(ms) / len(ms), 3) if ms else 0.0,
+        'p50_ms': round(percentile(ms, 50), 3),
+        'p95_ms': round(percentile(ms, 95), 3),
+        'p99_ms': round(percentile(ms, 99), 3),
+        'max_ms': round(max(ms), 3) if ms else 0.0
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """The app and janitor print a lot, keep it out of the benchmark output."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def load_app(workdir):
+    """(Re)imports app.py against the qr_data.db in workdir, with backups kept local and idle."""
+    os.chdir(workdir)
+    os.environ['BACKUP_BACKEND'] = 'local'
+    os.environ['BACKUP_LOCAL_DIR'] = os.path.join(workdir, 'backups')
+    os.environ['BACKUP_WINDOW_SECONDS'] = '3600' # Never let an upload land inside a timing
+    sys.modules.pop('app', None)
+    with quiet():
+        app_module = importlib.import_module('app')
+        # The restore runs in the background, don't time requests against a 503
+        app_module.shards.get(app_module.DEFAULT_SHARD).startup.wait()
+    return app_module
+
+
+# --- ROUTE SCENARIOS ---
+# Each one is called with (client, iteration, records) and must return a response.
+
+def _history(client, i, records):
+    return client.get('/history')
+
+
+def _scan_new(client, i, records):
+    return client.post('/process-qr', json={'qr_string': f"N{i:08d}"})
+
+
+def _scan_duplicate(client, i, records):
+    return client.post('/process-qr', json={'qr_string': f"R{i % records:08d}"})
+
+
+def _scan_batch(client, i, records):
+    return client.post('/process-qr/batch', json={'scans': [f"B{i:04d}{j:04d}" for j in range(50)]})
+
+
+def _admin_page_1(client, i, records):
+    return client.get('/admin/api/records')
+
+
+def _admin_deep_page(client, i, records):
+    return client.get(f'/admin/api/records?page={max(1, records // 40)}')
+
+
+def _admin_search(client, i, records):
+    return client.get(f'/admin/api/records?search={i % 10}{i % 7}{i % 3}1')
+
+
+def _mutate(client, i, records):
+    action = 'DELETE' if i % 2 == 0 else 'RESTORE'
+    return client.post('/admin/api/mutate', json={'record_id': (i // 2) % records + 1, 'action': action})
+
+
+def _export_csv(client, i, records):
+    response = client.get('/export-excel?format=csv')
+    response.get_data() # Drain the stream so we time the whole export
+    return response
+
+
+def _export_xlsx(client, i, records):
+    return client.get('/export-excel')
+
+
+ROUTES = {
+    'history': _history,
+    'process_qr_new': _scan_new,
+    'process_qr_duplicate': _scan_duplicate,
+    'process_qr_batch_50': _scan_batch,
+    'admin_records_page_1': _admin_page_1,
+    'admin_records_deep_page': _admin_deep_page,
+    'admin_records_search': _admin_search,
+    'admin_mutate': _mutate,
+    'export_csv': _export_csv,
+    'export_xlsx': _export_xlsx
+}
+SLOW_ROUTES = {'export_csv', 'export_xlsx'} # Fewer repeats, these scan everything
+
+
+def time_routes(app_module, records, repeat):
+    client = app_module.app.test_client()
+    results = {}
+    for name, scenario in ROUTES.items():
+        runs = max(1, repeat // 5) if name in SLOW_ROUTES else repeat
+        samples = []
+        for i in range(runs):
+            started = time.perf_counter()
+            response = scenario(client, i, records)
+            samples.append(time.perf_counter() - started)
+            if response.status_code >= 500:
+                raise RuntimeError(f"{name} failed with {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        results[name] = summarize(samples)
+    return results
+
+
+def time_janitor():
+    import db_cleanup
+    started = time.perf_counter()
+    with quiet():
+        db_cleanup.run_ultimate_janitor()
+    return round(time.perf_counter() - started, 4)
+
+
+def run_concurrent(app_module, records, clients, requests_per_client):
+    """N threads, each with its own test client, hammering a scan/history mix."""
+    samples = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(n):
+        client = app_module.app.test_client()
+        local = []
+        for i in range(requests_per_client):
+            started = time.perf_counter()
+            if i % 3 == 0:
+                response = client.get('/history')
+            elif i % 3 == 1:
+                response = client.post('/process-qr', json={'qr_string': f"C{n:03d}{i:05d}"})
+            else:
+                response = client.post('/process-qr', json={'qr_string': f"R{(n * 7919 + i) % records:08d}"})
+            local.append(time.perf_counter() - started)
+            if response.status_code >= 500:
+                with lock:
+                    errors.append(response.status_code)
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    stats = summarize(samples)
+    stats.update({
+        'clients': clients,
+        'errors': len(errors),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else 0.0
+    })
+    return stats
+
+
+def bench_size(records, args):
+    workdir = tempfile.mkdtemp(prefix=f"qr_bench_{records}_")
+    home = os.getcwd()
+    try:
+        started = time.perf_counter()
+        info = generate_registry(os.path.join(workdir, 'qr_data.db'), records,
+                                 args.mutations_per_record, args.mix, args.seed)
+        generate_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        app_module = load_app(workdir)
+        startup_seconds = time.perf_counter() - started
+
+        result = {
+            'records': records,
+            'mutations': info['mutations'],
+            'generate_s': round(generate_seconds, 4),
+            'startup_s': round(startup_seconds, 4),
+            'routes': time_routes(app_module, records, args.repeat)
+        }
+        if args.concurrency:
+            result['concurrent'] = run_concurrent(app_module, records, args.concurrency, args.concurrent_requests)
+
+        # Stop the background uploader before the janitor rewrites history underneath it
+        with quiet():
+            app_module.shards.get(app_module.DEFAULT_SHARD).backup_scheduler.shutdown()
+        if not args.skip_janitor:
+            result['janitor_s'] = time_janitor()
+
+        result['db_bytes'] = os.path.getsize(os.path.join(workdir, 'qr_data.db'))
+        return result
+    finally:
+        os.chdir(home)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the QR registry routes at several registry sizes.")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated record counts")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calls per route")
+    parser.add_argument("--mutations-per-record", type=float, default=0.2)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("EDIT=0.5,DELETE=0.35,RESTORE=0.15"))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--concurrency", type=int, default=0, help="Also run N concurrent clients")
+    parser.add_argument("--concurrent-requests", type=int, default=100, help="Requests per concurrent client")
+    parser.add_argument("--skip-janitor", action="store_true")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    # The app imports its siblings by plain module name, so make sure src/ is importable
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if src_dir not in sys.path:
+        sys.path.insert(0, src_dir)
+
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'repeat': args.repeat,
+            'mutations_per_record': args.mutations_per_record,
+            'mix': args.mix
+        },
+        'sizes': {}
+    }
+
+    for size in (int(s) for s in args.sizes.split(',') if s.strip()):
+        print(f"⏱️ Benchmarking {size} records...")
+        result = bench_size(size, args)
+        report['sizes'][str(size)] = result
+        for name, stats in result['routes'].items():
+            print(f"   {name:<26} p50 {stats['p50_ms']:>9.3f} ms   p95 {stats['p95_ms']:>9.3f} ms")
+        if 'concurrent' in result:
+            c = result['concurrent']
+            print(f"   concurrent x{c['clients']:<16} p50 {c['p50_ms']:>9.3f} ms   p99 {c['p99_ms']:>9.3f} ms   {c['throughput_rps']} req/s")
+        if 'janitor_s' in result:
+            print(f"   janitor                    {result['janitor_s']} s")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import argparse
+import csv
+import os
+
+from db import get_connection, run_write
+from projection import project_new_records_since
+from state_engine import RecordState
+from timestamps import now_stamps
+
+# Loads pre-issued code lists (CSV or XLSX) straight into the registry.
+#   * the file is streamed row by row (openpyxl read-only mode for Excel), never loaded whole
+#   * same 9-character rule as /process-qr; duplicates are caught within the file (a set of
+#     what we've seen) and against the registry (one IN (...) lookup per chunk)
+#   * valid strings go in with executemany, IMPORT_CHUNK_SIZE per transaction, so scanners
+#     keep getting their turn between chunks
+#   * one backup once the whole file is in, not one per row
+# Usable from the command line or through the admin upload (/admin/api/import).
+
+DB_FILE = "qr_data.db"
+IMPORT_CHUNK_SIZE = 2000
+IMPORT_FORMATS = ('csv', 'xlsx')
+HEADER_NAMES = {"qr string", "qr_string", "qr", "code"} # A first row like this is a header, not a code
+SAMPLE_LIMIT = 20 # Rejected/duplicate rows echoed back in the summary
+LOOKUP_CHUNK = 500 # Strings per IN (...) lookup, well under SQLite's bound-parameter limit
+
+
+def import_format(filename):
+    """'csv' or 'xlsx' from the file name, raises ValueError for anything else."""
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if extension not in IMPORT_FORMATS:
+        raise ValueError(f"Upload a {' or '.join(IMPORT_FORMATS)} file.")
+    return extension
+
+
+def _cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value) # Excel hands purely numeric codes back as floats
+    return str(value).strip()
+
+
+def _iter_rows(path, fmt):
+    if fmt == 'xlsx':
+        from openpyxl import load_workbook # Heavy import, only needed for Excel files
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            yield from workbook.active.iter_rows(values_only=True)
+        finally:
+            workbook.close()
+    else:
+        with open(path, newline="", encoding="utf-8-sig", errors="replace") as f:
+            yield from csv.reader(f)
+
+
+def iter_import_values(path, fmt, column=0):
+    """Yields (row number, string) for every non-empty cell in the given column (0-based)."""
+    for row_number, row in enumerate(_iter_rows(path, fmt), 1):
+        text = _cell_text(row[column] if column < len(row) else None)
+        if text and not (row_number == 1 and text.lower() in HEADER_NAMES):
+            yield row_number, text
+
+
+def insert_chunk(conn, strings, group=None):
+    """Inserts the strings that aren't taken yet. Returns (inserted count, {string: (result, reason)} for the rest).
+
+    Runs inside the caller's write transaction. Pass the WriteGroup when running through the
+    GroupCommitter, so scans committed in the same group see what this chunk claimed.
+    """
+    taken = {}
+    for i in range(0, len(strings), LOOKUP_CHUNK):
+        chunk = strings[i:i + LOOKUP_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        # Locked strings first (they can't be inserted again): current ones below get the plainer message
+        for row in conn.execute(f"SELECT qr_string FROM qr_records WHERE qr_string IN ({placeholders})", chunk):
+            taken[row[0]] = ("rejected", "locked in the registry history, restore it from the admin panel")
+        for row in conn.execute(f"SELECT qr_string FROM qr_state WHERE qr_string IN ({placeholders})", chunk):
+            taken[row[0]] = ("duplicates", "already in the registry")
+    if group is not None:
+        for qr_string in strings:
+            if qr_string in group.claimed:
+                taken[qr_string] = ("duplicates", "already in the registry")
+
+    scan_date, scan_ts = now_stamps()
+    to_insert = [(s, scan_date, scan_ts) for s in strings if s not in taken]
+    if to_insert:
+        last_record_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM qr_records").fetchone()[0]
+        conn.executemany("INSERT INTO qr_records (qr_string, scan_date, scan_ts) VALUES (?, ?, ?)", to_insert)
+        project_new_records_since(conn, last_record_id)
+        if group is not None:
+            for row in conn.execute("SELECT id, qr_string, scan_date FROM qr_records WHERE id > ?", (last_record_id,)):
+                group.claimed[row[1]] = RecordState(row[0], row[1], row[2])
+    return len(to_insert), taken
+
+
+def iter_import(values, submit, chunk_size=IMPORT_CHUNK_SIZE):
+    """Validates, dedupes and inserts (row number, string) pairs, yielding the running summary after every chunk.
+
+    The last summary yielded is the final one. submit(work) must run work(conn, group) in a write
+    transaction and return its result (GroupCommitter.submit in the app, a plain run_write from the CLI).
+    Stopping early keeps the chunks already committed; importing the same file again just skips them.
+    """
+    summary = {"rows": 0, "inserted": 0, "duplicates": 0, "duplicates_in_file": 0, "rejected": 0, "samples": []}
+    seen = set()
+    pending = [] # (row number, string)
+
+    def note(row_number, qr_string, kind, reason):
+        summary[kind] += 1
+        if len(summary["samples"]) < SAMPLE_LIMIT:
+            summary["samples"].append({"row": row_number, "qr_string": qr_string, "result": kind, "reason": reason})
+
+    def flush():
+        strings = [s for _, s in pending]
+        inserted, taken = submit(lambda conn, group: insert_chunk(conn, strings, group))
+        summary["inserted"] += inserted
+        for row_number, qr_string in pending:
+            if qr_string in taken:
+                note(row_number, qr_string, *taken[qr_string])
+        pending.clear()
+
+    for row_number, qr_string in values:
+        summary["rows"] += 1
+        if len(qr_string) != 9:
+            note(row_number, qr_string, "rejected", "String must be 9 characters.")
+            continue
+        if qr_string in seen:
+            note(row_number, qr_string, "duplicates_in_file", "appears earlier in this file")
+            continue
+        seen.add(qr_string)
+        pending.append((row_number, qr_string))
+        if len(pending) >= chunk_size:
+            flush()
+            yield summary
+
+    if pending:
+        flush()
+    yield summary
+
+
+def _dry_run_submit(db_file):
+    # Same checks and inserts, rolled back: later chunks still dedupe through the in-file set
+    def submit(work):
+        conn = get_connection(db_file)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            return work(conn, None)
+        finally:
+            conn.execute("ROLLBACK")
+    return submit
+
+
+if __name__ == "__main__":
+    from backup import BUCKET_NAME, IncrementalShipper, backend_from_env
+    from shards import parse_shard_key, shard_backend, shard_path
+
+    parser = argparse.ArgumentParser(description="Bulk-load pre-issued QR strings from a CSV or XLSX file.")
+    parser.add_argument("file")
+    parser.add_argument("--column", type=int, default=1, help="Which column holds the strings (1 = first)")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Report what would happen, insert nothing")
+    parser.add_argument("--no-backup", action="store_true", help="Skip the cloud backup at the end")
+    parser.add_argument("--event", default="", help="Which event's registry (default: the main one)")
+    args = parser.parse_args()
+    event = parse_shard_key(args.event)
+    db_file = shard_path(event, DB_FILE)
+
+    fmt = import_format(args.file)
+    if args.dry_run:
+        submit = _dry_run_submit(db_file)
+    else:
+        submit = lambda work: run_write(db_file, lambda conn: work(conn, None))
+
+    for summary in iter_import(iter_import_values(args.file, fmt, args.column - 1), submit, args.chunk_size):
+        print(f"   ...{summary['rows']} rows read, {summary['inserted']} inserted")
+    for sample in summary.pop("samples"):
+        print(f"   row {sample['row']}: {sample['qr_string']!r} {sample['result']} ({sample['reason']})")
+    print(f"{'🧪 Dry run: ' if args.dry_run else '✅ '}{summary}")
+
+    if summary["inserted"] and not args.dry_run and not args.no_backup:
+        print(f"☁️ Backup after import: {IncrementalShipper(db_file, shard_backend(backend_from_env(BUCKET_NAME), event)).ship() or 'nothing new'}")
@@ -0,0 +1,251 @@
+import argparse
+import gzip
+import json
+import os
+from datetime import datetime
+from backup import IncrementalShipper
+from db import connect
+from state_engine import StateEngine, bump_generation, read_snapshot
+
+# qr_mutations only ever grows, and every base backup / cold-start restore used to
+# drag the whole history along even though the app only needs the current state.
+# Compaction:
+#   * saves the state every record had at mutation N into qr_snapshot,
+#   * moves mutations <= N into gzipped, append-only NDJSON files under archive/
+#     (uploaded next to the backups, never touched again),
+#   * deletes them from the live DB, so qr_data.db stays roughly "registry + recent edits" sized,
+#   * uploads the archive file and a fresh base backup, so the bucket never advertises the old history.
+# The StateEngine starts from the snapshot and replays only what came after it.
+# The archive files are only read for audits (see iter_archived_mutations).
+#
+#   python compaction.py --keep-recent 1000
+#   python compaction.py --audit 42
+
+DB_FILE = "qr_data.db"
+ARCHIVE_DIR = "archive"
+ARCHIVE_PREFIX = "archive/" # Object prefix in the backup bucket
+ARCHIVE_INDEX_OBJECT = "archive/index.json"
+KEEP_RECENT = 1000 # Mutations left in the live DB by default
+CHUNK = 500 # Max ids per IN (...) list
+ARCHIVE_COLUMNS = ("id", "record_id", "action", "new_string", "mutation_date")
+
+
+def create_snapshot_schema(cursor):
+    """The state at the last compaction point (one row per record that had archived mutations)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS qr_snapshot (
+            record_id INTEGER PRIMARY KEY,
+            qr_string TEXT NOT NULL,
+            status TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS qr_snapshot_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            through_mutation_id INTEGER NOT NULL,
+            archived_mutations INTEGER NOT NULL,
+            compacted_at TEXT NOT NULL
+        )
+    ''')
+
+
+def _chunks(items):
+    items = list(items)
+    for i in range(0, len(items), CHUNK):
+        yield items[i:i + CHUNK]
+
+
+def archive_file_name(first_id, last_id):
+    # Zero-padded so a plain sort keeps the files in log order
+    return f"mutations_{first_id:012d}_{last_id:012d}.ndjson.gz"
+
+
+def write_archive(rows, archive_dir):
+    """Writes the rows to a new archive file (fsynced, renamed into place) and returns its path."""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, archive_file_name(rows[0][0], rows[-1][0]))
+    tmp = path + ".part"
+    with open(tmp, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            for row in rows:
+                f.write((json.dumps(dict(zip(ARCHIVE_COLUMNS, row))) + "\n").encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+def has_archive(archive_dir=ARCHIVE_DIR):
+    return os.path.isdir(archive_dir) and any(name.endswith(".ndjson.gz") for name in os.listdir(archive_dir))
+
+
+def iter_archived_mutations(archive_dir=ARCHIVE_DIR, record_ids=None):
+    """Yields archived mutation dicts in log order, optionally only for some records."""
+    if not os.path.isdir(archive_dir):
+        return
+    wanted = set(record_ids) if record_ids is not None else None
+    for name in sorted(os.listdir(archive_dir)):
+        if not name.endswith(".ndjson.gz"):
+            continue
+        with gzip.open(os.path.join(archive_dir, name), "rt", encoding="utf-8") as f:
+            for line in f:
+                mutation = json.loads(line)
+                if wanted is None or mutation["record_id"] in wanted:
+                    yield mutation
+
+
+def upload_archive(backend, path):
+    """Ships a new archive file and adds it to the archive index in the bucket."""
+    name = os.path.basename(path)
+    backend.upload_file(path, ARCHIVE_PREFIX + name)
+    index = backend.download_bytes(ARCHIVE_INDEX_OBJECT)
+    files = json.loads(index)["files"] if index else []
+    if name not in files:
+        files.append(name)
+    backend.upload_bytes(json.dumps({"files": sorted(files)}).encode("utf-8"), ARCHIVE_INDEX_OBJECT)
+
+
+def fetch_archives(backend, archive_dir=ARCHIVE_DIR):
+    """Downloads any archive files we don't have locally yet (restores don't bring them back)."""
+    index = backend.download_bytes(ARCHIVE_INDEX_OBJECT)
+    if index is None:
+        return 0
+    os.makedirs(archive_dir, exist_ok=True)
+    fetched = 0
+    for name in json.loads(index)["files"]:
+        path = os.path.join(archive_dir, name)
+        if not os.path.exists(path) and backend.download_file(ARCHIVE_PREFIX + name, path):
+            fetched += 1
+    return fetched
+
+
+def _state_through(conn, previous_through, rows):
+    """Replays the archived rows on top of the previous snapshot for just the records they touch."""
+    engine = StateEngine()
+    record_ids = sorted({row[1] for row in rows})
+    for chunk in _chunks(record_ids):
+        placeholders = ",".join("?" * len(chunk))
+        for r in conn.execute(f"SELECT id, qr_string, scan_date FROM qr_records WHERE id IN ({placeholders})", chunk):
+            engine.apply_record(r[0], r[1], r[2])
+        for s in conn.execute(f"SELECT record_id, qr_string, status FROM qr_snapshot WHERE record_id IN ({placeholders})", chunk):
+            engine.apply_snapshot(s[0], s[1], s[2])
+    engine.last_mutation_id = previous_through
+    for row in rows:
+        engine.apply_mutation(row[0], row[1], row[2], row[3])
+    return engine.records.values()
+
+
+def compact(db_file=DB_FILE, through=None, keep_recent=KEEP_RECENT, archive_dir=ARCHIVE_DIR, backend=None, vacuum=True):
+    """Archives every mutation up to `through` (default: all but the newest keep_recent). Returns a summary or None.
+
+    With a backend, the archive file and a new base backup of the compacted DB are uploaded afterwards.
+    """
+    conn = connect(db_file)
+    try:
+        create_snapshot_schema(conn.cursor())
+
+        # Same write lock the app uses, so scans just wait a moment instead of failing
+        conn.execute("BEGIN IMMEDIATE")
+        previous_through, _ = read_snapshot(conn)
+        newest = conn.execute("SELECT COALESCE(MAX(id), 0) FROM qr_mutations").fetchone()[0]
+        target = min(through if through is not None else newest - keep_recent, newest)
+
+        if target <= previous_through:
+            conn.execute("ROLLBACK")
+            print(f"✨ Nothing to compact (already compacted through mutation {previous_through}).")
+            return None
+
+        rows = conn.execute(
+            f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM qr_mutations WHERE id > ? AND id <= ? ORDER BY id ASC",
+            (previous_through, target)
+        ).fetchall()
+        if not rows:
+            conn.execute("ROLLBACK")
+            print("✨ Nothing to compact.")
+            return None
+
+        print(f"🗜️ Compacting {len(rows)} mutation(s) ({rows[0][0]}..{rows[-1][0]})...")
+
+        # The archive hits the disk BEFORE the rows are deleted, so a crash can only leave a harmless extra file
+        path = write_archive(rows, archive_dir)
+        print(f"📦 Archived to {path}")
+
+        states = _state_through(conn, previous_through, rows)
+        conn.executemany(
+            "INSERT OR REPLACE INTO qr_snapshot (record_id, qr_string, status) VALUES (?, ?, ?)",
+            [(rec.id, rec.qr_string, rec.status) for rec in states]
+        )
+        conn.execute("DELETE FROM qr_mutations WHERE id > ? AND id <= ?", (previous_through, target))
+        archived_total = conn.execute(
+            "SELECT COALESCE((SELECT archived_mutations FROM qr_snapshot_meta WHERE id = 1), 0)"
+        ).fetchone()[0] + len(rows)
+        conn.execute(
+            "INSERT OR REPLACE INTO qr_snapshot_meta (id, through_mutation_id, archived_mutations, compacted_at) VALUES (1, ?, ?, ?)",
+            (target, archived_total, datetime.now().isoformat(timespec='seconds'))
+        )
+
+        # The log changed under every running StateEngine, make them reload (from the snapshot)
+        bump_generation(conn.cursor())
+        conn.execute("COMMIT")
+
+        if vacuum:
+            # Hand the freed pages back to the filesystem so the file (and the next base backup) actually shrinks
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)") # In WAL mode the shrink only lands on checkpoint
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    if backend is not None:
+        upload_archive(backend, path)
+        print("☁️ Archive uploaded.")
+        # The generation moved, so this ships a base: the bucket's copy of the history is gone from the DB now
+        print(f"☁️ Backup after compaction: {IncrementalShipper(db_file, backend).ship() or 'nothing new'}")
+
+    print(f"✅ Compacted through mutation {target}. {archived_total} mutation(s) archived in total.")
+    return {'through': target, 'archived': len(rows), 'archive_file': path}
+
+
+def audit_timeline(db_file, record_id, archive_dir=ARCHIVE_DIR):
+    """Every mutation a record ever had: archived ones first, then the live log."""
+    timeline = list(iter_archived_mutations(archive_dir, [record_id]))
+    conn = connect(db_file)
+    try:
+        for row in conn.execute(
+            f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM qr_mutations WHERE record_id = ? ORDER BY id ASC", (record_id,)
+        ):
+            timeline.append(dict(zip(ARCHIVE_COLUMNS, row)))
+    finally:
+        conn.close()
+    return timeline
+
+
+if __name__ == "__main__":
+    from backup import BUCKET_NAME, backend_from_env
+    from shards import parse_shard_key, shard_backend, shard_path
+
+    parser = argparse.ArgumentParser(description="Archive old mutations and keep qr_data.db small.")
+    parser.add_argument("--through", type=int, help="Archive every mutation with id <= this")
+    parser.add_argument("--keep-recent", type=int, default=KEEP_RECENT, help="Mutations to keep live when --through isn't given")
+    parser.add_argument("--event", default="", help="Which event's registry (default: the main one)")
+    parser.add_argument("--archive-dir", help=f"Default: {ARCHIVE_DIR} (under shards/<event>/ for other events)")
+    parser.add_argument("--no-upload", action="store_true", help="Don't copy the archive file or a fresh base backup to the backup bucket")
+    parser.add_argument("--no-vacuum", action="store_true")
+    parser.add_argument("--audit", type=int, metavar="RECORD_ID", help="Print a record's full timeline instead of compacting")
+    parser.add_argument("--fetch", action="store_true", help="With --audit, download missing archive files first")
+    args = parser.parse_args()
+
+    event = parse_shard_key(args.event)
+    db_file = shard_path(event, DB_FILE)
+    archive_dir = args.archive_dir or shard_path(event, ARCHIVE_DIR)
+    backend = None if args.no_upload else shard_backend(backend_from_env(BUCKET_NAME), event)
+    if args.audit is not None:
+        if args.fetch and backend is not None:
+            print(f"☁️ Fetched {fetch_archives(backend, archive_dir)} archive file(s).")
+        for mutation in audit_timeline(db_file, args.audit, archive_dir):
+            print(json.dumps(mutation))
+    else:
+        compact(db_file, args.through, args.keep_recent, archive_dir, backend, vacuum=not args.no_vacuum)
@@ -0,0 +1,89 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+
+# Small database layer shared by the routes.
+#   * one persistent connection per thread (no more connect/close per request)
+#   * WAL so readers never block on the writer, synchronous=NORMAL, busy_timeout, mmap reads
+#   * sqlite3's per-connection statement cache keeps our handful of queries prepared
+#   * writes go through run_write(), which retries with backoff if another worker holds the lock
+
+BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+CACHED_STATEMENTS = 256
+WRITE_RETRIES = 6
+RETRY_BASE_DELAY = 0.02 # seconds, doubled on every retry (plus jitter)
+
+SCAN_DATE_FORMAT = "%B %d, %Y at %H:%M:%S" # How scan_date / mutation_date are stored
+
+_local = threading.local()
+
+
+def connect(db_file, check_same_thread=True):
+    """Opens a new connection with all our PRAGMAs applied."""
+    conn = sqlite3.connect(
+        db_file,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None, # We issue BEGIN ourselves, so nothing sits in an implicit transaction
+        check_same_thread=check_same_thread,
+        cached_statements=CACHED_STATEMENTS
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    return conn
+
+
+def get_connection(db_file):
+    """Returns this thread's persistent connection to db_file (opened on first use)."""
+    # Forked gunicorn workers must never reuse a connection inherited from the parent
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}
+
+    # Key on the absolute path so a chdir can't hand back a connection to the wrong file
+    key = os.path.abspath(db_file)
+    conn = _local.connections.get(key)
+    if conn is None:
+        conn = connect(key)
+        _local.connections[key] = conn
+    return conn
+
+
+def close_thread_connections():
+    for conn in getattr(_local, "connections", {}).values():
+        conn.close()
+    _local.connections = {}
+
+
+def is_busy_error(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def run_write(db_file, work):
+    """Runs work(conn) inside BEGIN IMMEDIATE ... COMMIT, retrying if the DB is busy.
+
+    Whatever work() returns is passed back. Any other exception rolls back and bubbles up.
+    """
+    conn = get_connection(db_file)
+    for attempt in range(WRITE_RETRIES):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            result = work(conn)
+            conn.execute("COMMIT")
+            return result
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if not is_busy_error(e) or attempt == WRITE_RETRIES - 1:
+                raise
+            time.sleep(RETRY_BASE_DELAY * (2 ** attempt) * (1 + random.random()))
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
@@ -1,132 +1,390 @@
-import sqlite3
-import shutil
+import argparse
+import os
 from datetime import datetime
+from backup import BUCKET_NAME, IncrementalShipper, backend_from_env, file_lock, snapshot_database
+from compaction import create_snapshot_schema
+from db import connect
+from projection import create_projection_schema
+from shards import parse_shard_key, shard_backend, shard_path
+from state_engine import StateEngine, replay_log, bump_generation
 
 DB_FILE = "qr_data.db"
+CHUNK = 500 # Max ids per IN (...) list
+BATCH = 500 # Merges / records per write transaction: the app's writers get the lock in between
+PROGRESS_EVERY = 100000
 
-def run_ultimate_janitor():
-    print("🧹 Starting the Ultimate State-Aware Janitor...")
 
-    # 1. Create a safety backup
-    backup_name = f"qr_data_backup_before_cleanup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
-    shutil.copy2(DB_FILE, backup_name)
-    print(f"📦 Created safety backup: {backup_name}\n")
+def ensure_janitor_schema(conn):
+    """The checkpoint row remembers how far the last run got, so the next one only looks at what's new."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS janitor_checkpoint (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_record_id INTEGER NOT NULL,
+            last_mutation_id INTEGER NOT NULL,
+            run_at TEXT NOT NULL
+        )
+    ''')
+    create_snapshot_schema(conn.cursor())
+    create_projection_schema(conn.cursor())
+    # Lets us pull one record's timeline without scanning the whole log
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_qr_mutations_record_id ON qr_mutations (record_id, id)")
 
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    try:
-        # ==========================================
-        # PART 1: REBUILD THE LOGICAL STATE
-        # ==========================================
-        cursor.execute("SELECT * FROM qr_records ORDER BY id ASC")
-        original_records = cursor.fetchall()
-
-        cursor.execute("SELECT * FROM qr_mutations ORDER BY id ASC")
-        mutations = cursor.fetchall()
-        
-        records_state = {}
-        for r in original_records:
-            records_state[r['id']] = {
-                'id': r['id'],
-                'qr_string': r['qr_string'],
-                'original_string': r['qr_string'],
-                'status': 'ACTIVE'
-            }
-
-        # Fast-forward through the timeline to find the FINAL string of every record
-        for m in mutations:
-            rec_id = m['record_id']
-            if rec_id in records_state:
-                if m['action'] == 'DELETE':
-                    records_state[rec_id]['status'] = 'DELETED'
-                elif m['action'] == 'EDIT':
-                    records_state[rec_id]['status'] = 'EDITED'
-                    records_state[rec_id]['qr_string'] = m['new_string']
-                elif m['action'] == 'RESTORE':
-                    is_edited = records_state[rec_id]['qr_string'] != records_state[rec_id]['original_string']
-                    records_state[rec_id]['status'] = 'EDITED' if is_edited else 'ACTIVE'
-
-        # ==========================================
-        # PART 2: FIND LOGICAL COLLISIONS
-        # ==========================================
-        # Group by the exact, case-sensitive FINAL string
-        string_groups = {}
-        for rec in records_state.values():
-            final_string = rec['qr_string']
-            if final_string not in string_groups:
-                string_groups[final_string] = []
-            string_groups[final_string].append(rec['id'])
-
-        duplicates_found = False
-        for qr_string, ids in string_groups.items():
-            if len(ids) > 1:
-                duplicates_found = True
-                ids.sort() # Oldest ID becomes the keeper
-                keeper_id = ids[0]
-                duplicate_ids = ids[1:]
-
-                print(f"  -> Fixing collision for '{qr_string}': Keeping ID {keeper_id}, Removing IDs {duplicate_ids}")
-
-                # Move all timeline events to the keeper
-                for dup_id in duplicate_ids:
-                    cursor.execute("UPDATE qr_mutations SET record_id = ? WHERE record_id = ?", (keeper_id, dup_id))
-                    cursor.execute("DELETE FROM qr_records WHERE id = ?", (dup_id,))
-
-        if not duplicates_found:
-            print("✨ No logical duplicates found in the final state!")
-
-        # ==========================================
-        # PART 3: SWEEP REDUNDANT MUTATIONS
-        # ==========================================
-        # Now that timelines are merged, we might have back-to-back Deletes/Restores. Let's clean them!
-        print("\n🧹 Sweeping qr_mutations for redundant actions...")
-        cursor.execute("SELECT * FROM qr_mutations ORDER BY record_id ASC, id ASC")
-        all_mutations = cursor.fetchall()
-
-        mutations_to_delete = []
-        current_mut_state = {}
-
-        for m in all_mutations:
-            rec_id = m['record_id']
-            action = m['action']
-            mut_id = m['id']
-
-            if rec_id not in current_mut_state:
+
+def _chunks(items):
+    items = list(items)
+    for i in range(0, len(items), CHUNK):
+        yield items[i:i + CHUNK]
+
+
+def load_checkpoint(conn):
+    row = conn.execute("SELECT last_record_id, last_mutation_id FROM janitor_checkpoint WHERE id = 1").fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def read_tips(conn):
+    """(last record id, last mutation id) of the log right now."""
+    return (conn.execute("SELECT COALESCE(MAX(id), 0) FROM qr_records").fetchone()[0],
+            conn.execute("SELECT COALESCE(MAX(id), 0) FROM qr_mutations").fetchone()[0])
+
+
+def save_checkpoint(conn, tips):
+    """Records how far this run examined (the tips of its analysis snapshot, not of the log now)."""
+    conn.execute(
+        "INSERT OR REPLACE INTO janitor_checkpoint (id, last_record_id, last_mutation_id, run_at) VALUES (1, ?, ?, ?)",
+        (tips[0], tips[1], datetime.now().isoformat(timespec='seconds'))
+    )
+
+
+def touched_record_ids(conn, checkpoint):
+    """Records scanned or mutated since the checkpoint."""
+    last_record_id, last_mutation_id = checkpoint
+    touched = {r[0] for r in conn.execute("SELECT id FROM qr_records WHERE id > ?", (last_record_id,))}
+    touched.update(r[0] for r in conn.execute(
+        "SELECT DISTINCT record_id FROM qr_mutations WHERE id > ?", (last_mutation_id,)
+    ))
+    # Duplicates a projection rebuild set aside are never in qr_state, so look at them every time until merged
+    touched.update(r[0] for r in conn.execute("SELECT id FROM qr_state_conflicts"))
+    return touched
+
+
+def snapshot_states(conn, record_ids):
+    """{record_id: (qr_string, status)} saved by compaction.py for the records whose early mutations are archived."""
+    states = {}
+    for chunk in _chunks(sorted(record_ids)):
+        placeholders = ",".join("?" * len(chunk))
+        for s in conn.execute(
+            f"SELECT record_id, qr_string, status FROM qr_snapshot WHERE record_id IN ({placeholders})", chunk
+        ):
+            states[s[0]] = (s[1], s[2])
+    return states
+
+
+def replay_records(conn, record_ids):
+    """Replays just these records' timelines (index lookups, not a full log scan)."""
+    engine = StateEngine()
+    for chunk in _chunks(sorted(record_ids)):
+        placeholders = ",".join("?" * len(chunk))
+        for r in conn.execute(
+            f"SELECT id, qr_string, scan_date FROM qr_records WHERE id IN ({placeholders}) ORDER BY id", chunk
+        ):
+            engine.apply_record(r[0], r[1], r[2])
+    for record_id, (qr_string, status) in snapshot_states(conn, record_ids).items():
+        engine.apply_snapshot(record_id, qr_string, status)
+
+    mutations = []
+    for chunk in _chunks(sorted(record_ids)):
+        placeholders = ",".join("?" * len(chunk))
+        mutations.extend(conn.execute(
+            f"SELECT id, record_id, action, new_string FROM qr_mutations WHERE record_id IN ({placeholders})", chunk
+        ).fetchall())
+    for m in sorted(mutations, key=lambda m: m[0]):
+        engine.apply_mutation(m[0], m[1], m[2], m[3])
+    return engine.records
+
+
+def find_collisions(conn, states, incremental):
+    """Groups record ids by their exact, case-sensitive FINAL string. Returns {string: [ids]} with 2+ ids."""
+    string_groups = {}
+    for rec in states.values():
+        string_groups.setdefault(rec.qr_string, []).append(rec.id)
+
+    if incremental:
+        # Untouched records were clean last time, qr_state tells us which strings they hold now
+        for chunk in _chunks(string_groups):
+            placeholders = ",".join("?" * len(chunk))
+            for r in conn.execute(f"SELECT id, qr_string FROM qr_state WHERE qr_string IN ({placeholders})", chunk):
+                if r[0] not in states:
+                    string_groups[r[1]].append(r[0])
+
+    return {qr: sorted(ids) for qr, ids in string_groups.items() if len(ids) > 1}
+
+
+def find_redundant_mutations(conn, record_ids=None, remap=None):
+    """Back-to-back DELETEs / RESTOREs that don't change anything. Returns [(mutation id, record id)].
+
+    remap ({duplicate id: keeper id}) looks at the timelines as if those merges had been made (dry runs).
+    """
+    if record_ids is None and not remap:
+        rows = conn.execute("SELECT id, record_id, action FROM qr_mutations ORDER BY record_id ASC, id ASC")
+    else:
+        if record_ids is None:
+            rows = conn.execute("SELECT id, record_id, action FROM qr_mutations").fetchall()
+        else:
+            rows = []
+            for chunk in _chunks(sorted(record_ids)):
+                placeholders = ",".join("?" * len(chunk))
+                rows.extend(conn.execute(
+                    f"SELECT id, record_id, action FROM qr_mutations WHERE record_id IN ({placeholders})", chunk
+                ).fetchall())
+        if remap:
+            rows = [(m[0], remap.get(m[1], m[1]), m[2]) for m in rows]
+        rows.sort(key=lambda m: (m[1], m[0]))
+
+    mutations_to_delete = []
+    # Records with archived history start from their compaction snapshot, not from ACTIVE
+    current_mut_state = {
+        record_id: status for record_id, (_, status) in snapshot_states(
+            conn, record_ids if record_ids is not None else [r[0] for r in conn.execute("SELECT record_id FROM qr_snapshot")]
+        ).items()
+    }
+
+    for i, m in enumerate(rows, 1):
+        mut_id, rec_id, action = m[0], m[1], m[2]
+
+        if rec_id not in current_mut_state:
+            current_mut_state[rec_id] = 'ACTIVE'
+
+        is_redundant = False
+        if action == 'DELETE' and current_mut_state[rec_id] == 'DELETED':
+            is_redundant = True
+        elif action == 'RESTORE' and current_mut_state[rec_id] == 'ACTIVE':
+            is_redundant = True
+        elif action == 'EDIT':
+            current_mut_state[rec_id] = 'EDITED'
+
+        if is_redundant:
+            mutations_to_delete.append((mut_id, rec_id))
+        else:
+            if action == 'DELETE':
+                current_mut_state[rec_id] = 'DELETED'
+            elif action == 'RESTORE':
                 current_mut_state[rec_id] = 'ACTIVE'
 
-            is_redundant = False
-            if action == 'DELETE' and current_mut_state[rec_id] == 'DELETED':
-                is_redundant = True
-            elif action == 'RESTORE' and current_mut_state[rec_id] == 'ACTIVE':
-                is_redundant = True
-            elif action == 'EDIT':
-                current_mut_state[rec_id] = 'EDITED'
+        if i % PROGRESS_EVERY == 0:
+            print(f"   ...checked {i} mutation(s)")
+
+    return mutations_to_delete
+
+
+def refresh_projection_for(conn, keeper_ids, removed_ids):
+    """Rewrites qr_state for just the records the merge changed."""
+    for chunk in _chunks(set(keeper_ids) | set(removed_ids)):
+        placeholders = ",".join("?" * len(chunk))
+        conn.execute(f"DELETE FROM qr_state WHERE id IN ({placeholders})", chunk)
+        conn.execute(f"DELETE FROM qr_state_conflicts WHERE id IN ({placeholders})", chunk)
 
-            if is_redundant:
-                mutations_to_delete.append(mut_id)
+    states = replay_records(conn, keeper_ids)
+    conn.executemany(
+        "INSERT INTO qr_state (id, qr_string, original_string, status, scan_date) VALUES (?, ?, ?, ?, ?)",
+        [(rec.id, rec.qr_string, rec.original_string, rec.status, rec.scan_date) for rec in states.values()]
+    )
+
+
+def merge_batches(collisions):
+    """Splits {string: [ids]} into batches of (keeper, duplicate) pairs, never splitting one string's group."""
+    batch = []
+    for ids in collisions.values():
+        batch.extend((ids[0], dup_id) for dup_id in ids[1:])
+        if len(batch) >= BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def apply_merges(conn, merges):
+    """Re-checks one batch of merges under the write lock and applies the ones that still collide.
+
+    An admin may have edited one side since the analysis; those pairs are left for the next run.
+    """
+    states = replay_records(conn, {record_id for pair in merges for record_id in pair})
+    merges = [(keeper_id, dup_id) for keeper_id, dup_id in merges
+              if keeper_id in states and dup_id in states and states[keeper_id].qr_string == states[dup_id].qr_string]
+    if merges:
+        # Move all timeline events to the keepers, then drop the duplicates (set-based, not one by one)
+        conn.executemany("UPDATE qr_mutations SET record_id = ? WHERE record_id = ?", merges)
+        conn.executemany("DELETE FROM qr_records WHERE id = ?", [(dup_id,) for _, dup_id in merges])
+        conn.executemany("DELETE FROM qr_snapshot WHERE record_id = ?", [(dup_id,) for _, dup_id in merges])
+        refresh_projection_for(conn, {keeper for keeper, _ in merges}, {dup for _, dup in merges})
+        # History was rewritten in place, so any running app has to reload its state from scratch
+        bump_generation(conn.cursor())
+    return merges
+
+
+def release_conflicts(conn):
+    """Puts records a projection rebuild set aside back into qr_state once their string is free again.
+
+    Returns how many. (Their rivals may have been edited away since, not only merged.)
+    """
+    conflict_ids = [r[0] for r in conn.execute("SELECT id FROM qr_state_conflicts")]
+    if not conflict_ids:
+        return 0
+    taken = set()
+    free = []
+    for rec in replay_records(conn, conflict_ids).values():
+        if rec.qr_string in taken or conn.execute("SELECT 1 FROM qr_state WHERE qr_string = ?", (rec.qr_string,)).fetchone():
+            continue
+        taken.add(rec.qr_string)
+        free.append(rec.id)
+    if free:
+        refresh_projection_for(conn, free, [])
+    return len(free)
+
+
+def sweep_records(conn, record_ids):
+    """Re-finds and deletes the redundant mutations of these records under the write lock. Returns how many."""
+    mutations_to_delete = find_redundant_mutations(conn, record_ids)
+    conn.executemany("DELETE FROM qr_mutations WHERE id = ?", [(mut_id,) for mut_id, _ in mutations_to_delete])
+    return len(mutations_to_delete)
+
+
+def _write(conn, work, *args):
+    """One short BEGIN IMMEDIATE ... COMMIT (the app's writers queue behind it for just this long)."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = work(conn, *args)
+        conn.execute("COMMIT")
+        return result
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def run_ultimate_janitor(dry_run=False, full=False, db_file=DB_FILE, backend=None):
+    """Merges logical duplicates and sweeps redundant mutations. Returns the counts (None if it failed).
+
+    With a backend, a run that rewrote history ships a new base backup at the end.
+    """
+    mode = "full" if full else "incremental"
+    print(f"🧹 Starting the Ultimate State-Aware Janitor ({mode}{', dry run' if dry_run else ''})...")
+
+    # 1. Create a safety backup (the online backup API copies a consistent snapshot, even mid-write)
+    if not dry_run:
+        backup_name = os.path.join(os.path.dirname(db_file),
+                                   f"qr_data_backup_before_cleanup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db")
+        snapshot_database(db_file, backup_name)
+        print(f"📦 Created safety backup: {backup_name}\n")
+
+    conn = connect(db_file)
+
+    # Two janitors interleaving their batches would each be working from a stale analysis
+    with file_lock(db_file + ".janitor.lock"):
+        try:
+            ensure_janitor_schema(conn)
+
+            # ==========================================
+            # PART 1: FIND THE LOGICAL COLLISIONS
+            # ==========================================
+            # A plain read transaction: in WAL mode the app keeps writing while we replay
+            conn.execute("BEGIN")
+            tips = read_tips(conn)
+            checkpoint = None if full else load_checkpoint(conn)
+            incremental = checkpoint is not None
+
+            if incremental:
+                touched = touched_record_ids(conn, checkpoint)
+                print(f"🔎 {len(touched)} record(s) touched since the last run.")
+                states = replay_records(conn, touched)
             else:
-                if action == 'DELETE':
-                    current_mut_state[rec_id] = 'DELETED'
-                elif action == 'RESTORE':
-                    current_mut_state[rec_id] = 'ACTIVE'
-
-        if mutations_to_delete:
-            print(f"🗑️ Found {len(mutations_to_delete)} redundant mutation(s). Removing them...")
-            for mut_id in mutations_to_delete:
-                cursor.execute("DELETE FROM qr_mutations WHERE id = ?", (mut_id,))
-        else:
-            print("✨ qr_mutations is perfectly clean!")
+                if not full:
+                    print("🔎 No checkpoint yet, examining the whole registry this time.")
+                # Fast-forward through the timeline to find the FINAL string of every record
+                states = replay_log(conn).records
+                touched = set(states)
+                print(f"🔎 Replayed {len(states)} record(s).")
+
+            collisions = find_collisions(conn, states, incremental)
+            for qr_string, ids in collisions.items():
+                keeper_id, duplicate_ids = ids[0], ids[1:] # Oldest ID becomes the keeper
+                print(f"  -> {'Would fix' if dry_run else 'Fixing'} collision for '{qr_string}': Keeping ID {keeper_id}, Removing IDs {duplicate_ids}")
+            if not collisions:
+                print("✨ No logical duplicates found in the final state!")
+
+            sweep_scope = None if not incremental else touched | {ids[0] for ids in collisions.values()}
+
+            if dry_run:
+                # Sweep the timelines as they would look after the merges, without making them
+                remap = {dup_id: ids[0] for ids in collisions.values() for dup_id in ids[1:]}
+                scope = None if sweep_scope is None else sweep_scope | set(remap)
+                mutations_to_delete = find_redundant_mutations(conn, scope, remap)
+                conn.execute("ROLLBACK")
+                print(f"\n📝 Dry run: {len(remap)} duplicate record(s) and {len(mutations_to_delete)} redundant mutation(s) would be cleaned. Nothing was changed.")
+                return {'merged': len(remap), 'swept': len(mutations_to_delete), 'dry_run': True}
+            conn.execute("COMMIT")
+
+            # ==========================================
+            # PART 2: MERGE THEM, A BATCH PER TRANSACTION
+            # ==========================================
+            merged = 0
+            for batch in merge_batches(collisions):
+                merged += len(_write(conn, apply_merges, batch))
+            if merged:
+                print(f"🔁 Merged {merged} duplicate record(s) (qr_state refreshed along the way).")
+            released = _write(conn, release_conflicts)
+            if released:
+                print(f"🔁 {released} record(s) set aside by a projection rebuild are back in qr_state.")
+
+            # ==========================================
+            # PART 3: SWEEP REDUNDANT MUTATIONS
+            # ==========================================
+            # Now that timelines are merged, we might have back-to-back Deletes/Restores. Let's clean them!
+            print("\n🧹 Sweeping qr_mutations for redundant actions...")
+            conn.execute("BEGIN")
+            candidates = sorted({rec_id for _, rec_id in find_redundant_mutations(conn, sweep_scope)})
+            conn.execute("COMMIT")
+
+            swept = 0
+            for i in range(0, len(candidates), BATCH):
+                swept += _write(conn, sweep_records, candidates[i:i + BATCH])
+            if swept:
+                print(f"🗑️ Removed {swept} redundant mutation(s).")
+            else:
+                print("✨ qr_mutations is perfectly clean!")
+
+            # ==========================================
+            # PART 4: CHECKPOINT
+            # ==========================================
+            def finish(conn):
+                if swept:
+                    # Redundant mutations change no state, but event ids and counts do: reload once
+                    bump_generation(conn.cursor())
+                save_checkpoint(conn, tips)
+            _write(conn, finish)
+
+            if backend is not None and (merged or swept):
+                # The generation moved, so this ships a base: the bucket would otherwise keep the old history
+                try:
+                    print(f"☁️ Backup after cleanup: {IncrementalShipper(db_file, backend).ship() or 'nothing new'}")
+                except Exception as e:
+                    print(f"⚠️ The cleanup is committed, but the backup after it failed: {e}")
 
-        conn.commit()
-        print("\n✅ Ultimate Cleanup complete! Your database is truly pristine.")
+            print("\n✅ Ultimate Cleanup complete! Your database is truly pristine.")
+            return {'merged': merged, 'swept': swept, 'dry_run': False}
 
-    except Exception as e:
-        print(f"❌ Error: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        finally:
+            conn.close()
 
 if __name__ == "__main__":
-    run_ultimate_janitor()
+    parser = argparse.ArgumentParser(description="Merge logical duplicates and sweep redundant mutations.")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without touching anything")
+    parser.add_argument("--full", action="store_true", help="Ignore the checkpoint and examine the whole registry")
+    parser.add_argument("--event", default="", help="Which event's registry (default: the main one)")
+    parser.add_argument("--no-upload", action="store_true", help="Don't ship a fresh base backup after a run that changed something")
+    args = parser.parse_args()
+    event = parse_shard_key(args.event)
+    backend = None if args.no_upload else shard_backend(backend_from_env(BUCKET_NAME), event)
+    run_ultimate_janitor(dry_run=args.dry_run, full=args.full, db_file=shard_path(event, DB_FILE), backend=backend)
@@ -0,0 +1,300 @@
+import json
+import threading
+import time
+
+from db import connect, get_connection
+
+# Live feed for the scanner and admin pages (Server-Sent Events on /events).
+#   * ONE broadcaster thread per worker reads what was committed and fans it out
+#     to every open stream, no matter how many dashboards are watching
+#   * it's woken right after this worker's group commits, and polls (one PRAGMA
+#     when idle) to pick up writes made by the other workers
+#   * every event id is the log position "<generation>-<record id>-<mutation id>",
+#     so a reconnect with Last-Event-ID replays exactly what the client missed
+# When the janitor or compaction rewrites history (new generation) clients are
+# told to "reset", i.e. reload instead of patching.
+
+POLL_SECONDS = 1.0
+HEARTBEAT_SECONDS = 15
+STREAM_SECONDS = 300  # Streams are closed now and then, EventSource reconnects (and resumes) by itself
+RETRY_MS = 3000
+QUEUE_LIMIT = 1000    # A client this far behind is dropped, it catches up from Last-Event-ID on reconnect
+BACKLOG_LIMIT = 5000  # Resuming from further back than this gets a "reset" instead
+MAX_SUBSCRIBERS = 8   # Default stream cap per worker process, every open stream holds one gunicorn thread
+
+
+def format_event_id(position):
+    return "-".join(str(part) for part in position)
+
+
+def parse_event_id(value):
+    """Last-Event-ID -> (generation, record id, mutation id), or None if it isn't one of ours."""
+    try:
+        generation, record_id, mutation_id = (int(part) for part in (value or "").split("-"))
+    except ValueError:
+        return None
+    return generation, record_id, mutation_id
+
+
+def log_position(conn):
+    """(generation, last record id, last mutation id) of the log right now."""
+    generation = conn.execute("PRAGMA user_version").fetchone()[0]
+    record_id, mutation_id = conn.execute(
+        "SELECT (SELECT COALESCE(MAX(id), 0) FROM qr_records), (SELECT COALESCE(MAX(id), 0) FROM qr_mutations)"
+    ).fetchone()
+    return generation, record_id, mutation_id
+
+
+def read_events(conn, since, until=None, limit=None):
+    """[(event id, event type, payload), ...] for everything committed after position `since`.
+
+    Stops at `until` (inclusive) if given, and returns None if there are more than `limit` events.
+    """
+    generation, last_record_id, last_mutation_id = since
+    record_bound = until[1] if until else -1
+    mutation_bound = until[2] if until else -1
+    fetch = (limit + 1) if limit is not None else -1
+
+    in_transaction = conn.in_transaction
+    if not in_transaction:
+        conn.execute("BEGIN")
+    try:
+        records = conn.execute(
+            "SELECT id, qr_string, scan_date FROM qr_records WHERE id > ? AND (? < 0 OR id <= ?) ORDER BY id ASC LIMIT ?",
+            (last_record_id, record_bound, record_bound, fetch)
+        ).fetchall()
+        # The record's state now (not necessarily right after this mutation): clients converge on the last event
+        mutations = conn.execute(
+            "SELECT m.id, m.record_id, m.action, m.new_string, m.mutation_date, "
+            "s.qr_string, s.original_string, s.scan_date, s.status "
+            "FROM qr_mutations m LEFT JOIN qr_state s ON s.id = m.record_id "
+            "WHERE m.id > ? AND (? < 0 OR m.id <= ?) ORDER BY m.id ASC LIMIT ?",
+            (last_mutation_id, mutation_bound, mutation_bound, fetch)
+        ).fetchall()
+    finally:
+        if not in_transaction:
+            conn.commit()
+
+    if limit is not None and len(records) + len(mutations) > limit:
+        return None
+
+    events = []
+    for r in records:
+        last_record_id = r[0]
+        events.append((format_event_id((generation, last_record_id, last_mutation_id)), "scan", {
+            "id": r[0], "qr_string": r[1], "original_string": r[1], "original_date": r[2], "status": "ACTIVE"
+        }))
+    for m in mutations:
+        last_mutation_id = m[0]
+        events.append((format_event_id((generation, last_record_id, last_mutation_id)), "mutation", {
+            "mutation_id": m[0], "record_id": m[1], "action": m[2], "new_string": m[3], "mutation_date": m[4],
+            "record": {"id": m[1], "qr_string": m[5], "original_string": m[6], "original_date": m[7], "status": m[8]}
+        }))
+    return events
+
+
+def format_sse(event_id, event_type, payload):
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(payload)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class _Subscriber:
+    __slots__ = ('events', 'overflowed')
+
+    def __init__(self):
+        self.events = []
+        self.overflowed = False
+
+
+class StreamSlots:
+    """The open-stream budget of one worker process, shared by the broadcasters of every event registry."""
+
+    def __init__(self, limit=MAX_SUBSCRIBERS):
+        self.limit = limit
+        self.in_use = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a slot if one is free. Returns whether it got one."""
+        with self._lock:
+            if self.in_use >= self.limit:
+                return False
+            self.in_use += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+
+class Broadcaster:
+    """Reads new log entries once per worker and hands them to every open /events stream."""
+
+    def __init__(self, db_file, poll_seconds=POLL_SECONDS, slots=None):
+        self.db_file = db_file
+        self.poll_seconds = poll_seconds
+        self.slots = slots or StreamSlots()
+
+        self._cond = threading.Condition()
+        self._subscribers = set()
+        self._position = None # Where the last fan-out stopped, None while nobody listens
+        self._woken = False
+        self._thread = None
+        self._conn = None
+        self._data_version = None
+
+        self.event_count = 0
+
+    def notify(self):
+        """Something was just committed: look now instead of at the next poll."""
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+
+    def subscribe(self):
+        """(subscriber, position it starts from), or (None, None) if this worker is at capacity."""
+        if not self.slots.acquire():
+            return None, None
+        with self._cond:
+            if self._position is None:
+                try:
+                    self._position = log_position(get_connection(self.db_file))
+                except Exception:
+                    self.slots.release()
+                    raise
+            subscriber = _Subscriber()
+            self._subscribers.add(subscriber)
+            self._ensure_thread()
+            return subscriber, self._position
+
+    def unsubscribe(self, subscriber):
+        """Safe to call twice (the stream's finally and the response's on-close both do)."""
+        with self._cond:
+            if subscriber not in self._subscribers:
+                return
+            self._subscribers.discard(subscriber)
+            if not self._subscribers:
+                self._position = None # Nobody to catch up for, start fresh on the next subscribe
+        self.slots.release()
+
+    def next_events(self, subscriber, timeout):
+        """Blocks until there's something for this subscriber (or timeout). Returns the events."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # The condition is shared by every stream, so keep waiting until something is for us
+            while not subscriber.events and not subscriber.overflowed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            events, subscriber.events = subscriber.events, []
+            return events
+
+    def _ensure_thread(self):
+        # Started lazily so each gunicorn worker gets its own broadcaster after the fork
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._worker, name="event-broadcaster", daemon=True)
+            self._thread.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                if not self._woken:
+                    self._cond.wait(self.poll_seconds)
+                self._woken = False
+                start = self._position
+            if start is None:
+                continue
+            try:
+                self._fan_out(start)
+            except Exception as e:
+                print(f"⚠️ Event broadcaster failed to read the log: {e}")
+                time.sleep(self.poll_seconds)
+
+    def _fan_out(self, start):
+        if self._conn is None:
+            self._conn = connect(self.db_file)
+
+        # data_version only moves when another connection commits, so an idle registry costs one PRAGMA
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+
+        position = log_position(self._conn)
+        if position[0] != start[0]:
+            events = [(format_event_id(position), "reset", {"reason": "history was rewritten"})]
+        else:
+            events = read_events(self._conn, start, position)
+            if not events:
+                return
+
+        with self._cond:
+            if self._position != start:
+                return # Everyone left (or a fresh subscriber restarted the feed) while we were reading
+            self._position = position
+            for subscriber in self._subscribers:
+                if len(subscriber.events) + len(events) > QUEUE_LIMIT:
+                    subscriber.overflowed = True
+                else:
+                    subscriber.events.extend(events)
+            self.event_count += len(events)
+            self._cond.notify_all()
+
+    def status(self):
+        with self._cond:
+            return {
+                "subscribers": len(self._subscribers),
+                "position": format_event_id(self._position) if self._position else None,
+                "events": self.event_count
+            }
+
+
+def _is_new(event, seen):
+    event_id, event_type, payload = event
+    if event_type == "scan":
+        return payload["id"] > seen[1]
+    if event_type == "mutation":
+        return payload["mutation_id"] > seen[2]
+    return True
+
+
+def stream_events(broadcaster, subscriber, position, last_event_id=None):
+    """The text/event-stream body for one client: its backlog (if resuming), then live events."""
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+
+        seen = position
+        resume = parse_event_id(last_event_id)
+        if resume is None:
+            # Tell the client where it starts, so a reconnect resumes from here
+            yield format_sse(format_event_id(position), "ready", {"position": format_event_id(position)})
+        elif resume[0] != position[0]:
+            yield format_sse(format_event_id(position), "reset", {"reason": "history was rewritten"})
+        else:
+            if resume[1] < position[1] or resume[2] < position[2]:
+                backlog = read_events(get_connection(broadcaster.db_file), resume, position, limit=BACKLOG_LIMIT)
+                if backlog is None:
+                    yield format_sse(format_event_id(position), "reset", {"reason": "too far behind"})
+                    backlog = []
+                for event in backlog:
+                    yield format_sse(*event)
+            # It may have got further on another worker than this one has fanned out yet
+            seen = (position[0], max(resume[1], position[1]), max(resume[2], position[2]))
+
+        deadline = time.monotonic() + STREAM_SECONDS
+        while time.monotonic() < deadline:
+            events = broadcaster.next_events(subscriber, HEARTBEAT_SECONDS)
+            if subscriber.overflowed:
+                return # Too slow to keep up: reconnecting resumes from the last id it got
+            events = [event for event in events if _is_new(event, seen)]
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            yield "".join(format_sse(*event) for event in events)
+    finally:
+        broadcaster.unsubscribe(subscriber)
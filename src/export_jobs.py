@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db import get_connection
+from export import EXPORT_FORMATS, count_export_rows, iter_export_rows, iter_state_rows, stream_csv, stream_ndjson, write_xlsx
+from compaction import ARCHIVE_DIR
+from history import resolve_as_of, state_as_of
+from metrics import Counter, register
+
+# Big exports render in the background instead of holding a request open:
+#   * POST /export-jobs queues the render on a small per-worker thread pool and returns a job id
+#   * the job id IS the cache key (format + filters + as_of + data version), so asking again
+#     while nothing changed returns the finished file straight away, from any worker
+#   * progress and results live in a small JSON status file next to the artifact, which is
+#     what lets a poll that lands on another gunicorn worker still find the job
+#   * finished artifacts are dropped once unused for EXPORT_CACHE_MAX_AGE_SECONDS, and
+#     least recently used first while the cache is over EXPORT_CACHE_MAX_BYTES
+
+EXPORT_CACHE_DIR = "export_cache"
+EXPORT_WORKERS = 2
+EXPORT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+EXPORT_CACHE_MAX_AGE_SECONDS = 24 * 3600
+PROGRESS_EVERY = 5000 # Rows between status file updates
+STALE_SECONDS = 300   # A queued/running job silent for this long died with its worker
+
+JOB_ID = re.compile(r"[0-9a-f]{20}")
+
+EXPORT_JOBS = register(Counter("qr_export_jobs_total", "Export job requests by result (queued, joined, cached, done, failed)."))
+
+
+def export_job_id(export_format, filters, as_of, version):
+    raw = json.dumps([export_format, list(filters['statuses']), filters['date_from'], filters['date_to'],
+                      None if as_of is None else str(as_of), list(version)])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def open_export(db_file, filters, as_of=None, with_total=False, archive_dir=ARCHIVE_DIR):
+    """(rows, download name without extension, row count or None) for one export request."""
+    if as_of is None:
+        total = count_export_rows(db_file, **filters) if with_total else None
+        return iter_export_rows(db_file, **filters), "QR_Registry_Export", total
+
+    # Point-in-time export: replay only up to as_of, then filter the same way
+    conn = get_connection(db_file)
+    mutation_id, cutoff = resolve_as_of(conn, as_of, archive_dir)
+    past = state_as_of(conn, mutation_id, cutoff, archive_dir, date_from=filters['date_from'], date_to=filters['date_to'])
+    total = sum(1 for rec in past.records.values() if rec.status in filters['statuses']) if with_total else None
+    return iter_state_rows(past, filters['statuses']), f"QR_Registry_Export_as_of_{mutation_id}", total
+
+
+def render_export(export_format, rows, output):
+    """Writes the whole export into a binary file object."""
+    if export_format == 'xlsx':
+        write_xlsx(rows, output)
+        return
+    chunks = stream_csv(rows) if export_format == 'csv' else stream_ndjson(rows)
+    for chunk in chunks:
+        output.write(chunk.encode("utf-8"))
+
+
+def _remove(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class ExportJobs:
+    """Background export renders plus the artifact cache they fill."""
+
+    def __init__(self, db_file, cache_dir=EXPORT_CACHE_DIR, workers=EXPORT_WORKERS,
+                 max_bytes=EXPORT_CACHE_MAX_BYTES, max_age_seconds=EXPORT_CACHE_MAX_AGE_SECONDS, archive_dir=ARCHIVE_DIR):
+        self.db_file = db_file
+        self.archive_dir = archive_dir
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._running = set() # Job ids queued or rendering in THIS worker
+
+    def _pool(self):
+        # Created lazily (and again after a fork) so each gunicorn worker gets its own threads
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="export-job")
+            self._pid = os.getpid()
+            self._running = set()
+        return self._executor
+
+    def _status_path(self, job_id):
+        return os.path.join(self.cache_dir, f"{job_id}.json")
+
+    def _artifact_path(self, job_id, export_format):
+        return os.path.join(self.cache_dir, f"{job_id}.{EXPORT_FORMATS[export_format][1]}")
+
+    def _write_status(self, job_id, **status):
+        status["updated"] = time.time()
+        path = self._status_path(job_id)
+        tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(status, f)
+        os.replace(tmp, path) # Pollers never see a half-written file
+
+    def status(self, job_id):
+        """The job's status dict ({"status": queued|running|done|failed, ...}), or None if unknown/evicted."""
+        if not JOB_ID.fullmatch(job_id or ""):
+            return None
+        try:
+            with open(self._status_path(job_id)) as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if status["status"] == "done" and not os.path.exists(self._artifact_path(job_id, status["format"])):
+            return None
+        if (status["status"] in ("queued", "running") and job_id not in self._running
+                and time.time() - status["updated"] > STALE_SECONDS):
+            status = {"status": "failed", "format": status["format"], "message": "The export stopped, start it again."}
+        status["job_id"] = job_id
+        return status
+
+    def submit(self, export_format, filters, as_of, version):
+        """Starts (or finds) the export for these parameters. Returns its status dict."""
+        job_id = export_job_id(export_format, filters, as_of, version)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._lock:
+            pool = self._pool()
+            current = self.status(job_id)
+            if current is not None and current["status"] != "failed":
+                EXPORT_JOBS.inc(result="cached" if current["status"] == "done" else "joined")
+                return current
+            self._write_status(job_id, status="queued", format=export_format)
+            self._running.add(job_id)
+            pool.submit(self._run, job_id, export_format, filters, as_of)
+        EXPORT_JOBS.inc(result="queued")
+        return self.status(job_id)
+
+    def artifact(self, job_id):
+        """(path, download name, mimetype) of a finished export, or None. Counts as a use for eviction."""
+        status = self.status(job_id)
+        if status is None or status["status"] != "done":
+            return None
+        try:
+            os.utime(self._status_path(job_id)) # Recently downloaded artifacts are evicted last
+        except OSError:
+            pass
+        return self._artifact_path(job_id, status["format"]), status["download_name"], status["mimetype"]
+
+    def _run(self, job_id, export_format, filters, as_of):
+        mimetype = EXPORT_FORMATS[export_format][0]
+        artifact = self._artifact_path(job_id, export_format)
+        tmp = f"{artifact}.{os.getpid()}.tmp"
+        try:
+            rows, name, total = open_export(self.db_file, filters, as_of, with_total=True, archive_dir=self.archive_dir)
+            self._write_status(job_id, status="running", format=export_format, rows=0, total=total)
+
+            def counted():
+                for i, row in enumerate(rows, 1):
+                    yield row
+                    if i % PROGRESS_EVERY == 0:
+                        self._write_status(job_id, status="running", format=export_format, rows=i, total=total)
+
+            with open(tmp, "wb") as output:
+                render_export(export_format, counted(), output)
+            os.replace(tmp, artifact)
+            self._write_status(job_id, status="done", format=export_format, rows=total, total=total,
+                               size=os.path.getsize(artifact), mimetype=mimetype,
+                               download_name=f"{name}.{EXPORT_FORMATS[export_format][1]}")
+            EXPORT_JOBS.inc(result="done")
+        except Exception as e:
+            print(f"⚠️ Export job {job_id} failed: {e}")
+            _remove(tmp)
+            self._write_status(job_id, status="failed", format=export_format, message=str(e))
+            EXPORT_JOBS.inc(result="failed")
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+
+        try:
+            self.evict(keep=job_id)
+        except OSError as e:
+            print(f"⚠️ Export cache eviction failed: {e}")
+
+    def evict(self, keep=None):
+        """Drops artifacts unused for max_age_seconds, then the least recently used ones while over max_bytes."""
+        now = time.time()
+        cached = [] # (last used, size, paths)
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp"):
+                # Left behind by a worker that died mid-render
+                if now - os.path.getmtime(path) > STALE_SECONDS:
+                    _remove(path)
+                continue
+            job_id, extension = os.path.splitext(name)
+            if extension != ".json" or job_id == keep:
+                continue
+
+            status = self.status(job_id)
+            last_used = os.path.getmtime(path)
+            if status is None or status["status"] == "failed":
+                if now - last_used > STALE_SECONDS: # Failures stay visible to pollers for a while
+                    _remove(path)
+                continue
+            if status["status"] != "done":
+                continue
+
+            paths = (path, self._artifact_path(job_id, status["format"]))
+            if now - last_used > self.max_age_seconds:
+                _remove(*paths)
+            else:
+                cached.append((last_used, status["size"], paths))
+
+        total = sum(size for _, size, _ in cached)
+        for _, size, paths in sorted(cached):
+            if total <= self.max_bytes:
+                break
+            _remove(*paths)
+            total -= size
+
+    def stats(self):
+        return {"running": len(self._running) if self._pid == os.getpid() else 0}
@@ -0,0 +1,201 @@
+from datetime import datetime, timedelta
+
+from compaction import ARCHIVE_DIR, has_archive, iter_archived_mutations
+from db import SCAN_DATE_FORMAT
+from state_engine import RecordState, StateEngine, read_snapshot
+from timestamps import range_clause, to_ts
+
+# Audit queries, answered without replaying the whole log:
+#   * a record's timeline is a point lookup on idx_qr_mutations_record_id
+#   * "as of" a mutation id / timestamp replays only up to that point
+#     (a timestamp is turned into an id with one lookup on idx_qr_mutations_ts)
+# Anything before the last compaction lives in archive/ (see compaction.py) and
+# is only read when the question actually reaches back that far.
+
+AS_OF_FORMATS = ("%Y-%m-%d", "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S")
+
+
+class ArchiveUnavailable(Exception):
+    """The question reaches back past the last compaction, and the archive isn't here or can't be read."""
+
+
+def archived_mutations(archive_dir=ARCHIVE_DIR, record_ids=None):
+    """iter_archived_mutations, with a truncated/corrupt archive file raised as ArchiveUnavailable."""
+    try:
+        yield from iter_archived_mutations(archive_dir, record_ids)
+    except (OSError, EOFError, ValueError, KeyError) as e:
+        raise ArchiveUnavailable(
+            f"The archive in {archive_dir} can't be read ({e}). "
+            "Fetch it again with: python compaction.py --audit <id> --fetch"
+        ) from e
+
+
+def parse_as_of(value):
+    """?as_of= is a mutation id (digits) or a local date/time. Returns an int or a datetime; raises ValueError."""
+    value = (value or "").strip()
+    if value.isdigit():
+        return int(value)
+    for fmt in AS_OF_FORMATS:
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt == "%Y-%m-%d":
+            parsed = parsed.replace(hour=23, minute=59, second=59) # A bare date means "by the end of that day"
+        return parsed
+    raise ValueError("as_of must be a mutation id or a date like YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS.")
+
+
+def _parse_date(text):
+    return datetime.strptime(text, SCAN_DATE_FORMAT)
+
+
+def last_mutation_before(conn, cutoff, archive_dir=ARCHIVE_DIR):
+    """The id of the last mutation made at or before cutoff (0 if none)."""
+    found = conn.execute("SELECT MAX(id) FROM qr_mutations WHERE mutation_ts <= ?", (to_ts(cutoff),)).fetchone()[0]
+    if found is not None:
+        return found
+
+    # Before every live mutation, so the answer (if any) is in the archive
+    found = 0
+    for m in archived_mutations(archive_dir):
+        if _parse_date(m["mutation_date"]) > cutoff:
+            break
+        found = m["id"]
+    return found
+
+
+def resolve_as_of(conn, as_of, archive_dir=ARCHIVE_DIR):
+    """Turns a parsed as_of into (mutation_id, cutoff datetime)."""
+    if isinstance(as_of, datetime):
+        return last_mutation_before(conn, as_of, archive_dir), as_of
+
+    # A mutation id: records scanned after that mutation didn't exist yet either
+    row = conn.execute("SELECT mutation_date FROM qr_mutations WHERE id = ?", (as_of,)).fetchone()
+    if row is None:
+        row = next((m for m in archived_mutations(archive_dir) if m["id"] == as_of), None)
+        row = (row["mutation_date"],) if row else None
+    return as_of, _parse_date(row[0]) if row else None
+
+
+def state_as_of(conn, mutation_id, cutoff=None, archive_dir=ARCHIVE_DIR, date_from=None, date_to=None):
+    """A throwaway StateEngine holding the registry as it was right after mutation_id.
+
+    date_from / date_to (sortable timestamps) optionally keep only the records scanned in that window.
+    """
+    engine = StateEngine()
+    # Records scanned after the cutoff didn't exist yet (timestamps are whole seconds)
+    upper = to_ts(cutoff + timedelta(seconds=1)) if cutoff is not None else None
+    if date_to and (upper is None or date_to < upper):
+        upper = date_to
+    where, params = range_clause("scan_ts", date_from, upper)
+
+    # One read snapshot, so a write landing mid-replay can't tear the picture
+    in_transaction = conn.in_transaction
+    if not in_transaction:
+        conn.execute("BEGIN")
+    try:
+        for r in conn.execute(
+            f"SELECT id, qr_string, scan_date FROM qr_records {'WHERE ' + where if where else ''} ORDER BY id ASC", params
+        ):
+            engine.apply_record(r[0], r[1], r[2])
+
+        through, snapshot = read_snapshot(conn)
+        if mutation_id >= through:
+            # The compaction snapshot + the live log is enough
+            for s in snapshot:
+                engine.apply_snapshot(s[0], s[1], s[2])
+            mutations = conn.execute(
+                "SELECT id, record_id, action, new_string FROM qr_mutations WHERE id <= ? ORDER BY id ASC",
+                (mutation_id,)
+            )
+        else:
+            # Reaches back past the last compaction: this one has to read the archive
+            if not has_archive(archive_dir):
+                raise ArchiveUnavailable(
+                    f"Mutations up to {through} are archived and the archive isn't here. "
+                    "Fetch it with: python compaction.py --audit <id> --fetch"
+                )
+            mutations = (
+                (m["id"], m["record_id"], m["action"], m["new_string"])
+                for m in archived_mutations(archive_dir) if m["id"] <= mutation_id
+            )
+        for m in mutations:
+            engine.apply_mutation(m[0], m[1], m[2], m[3])
+    finally:
+        if not in_transaction:
+            conn.commit()
+    return engine
+
+
+def search_state(engine, search_query="", before_id=None, offset=0, limit=20):
+    """Same contract as search.search_page, but over an in-memory (as-of) state."""
+    records = []
+    skipped = 0
+    for rec in reversed(engine.records.values()):
+        if before_id is not None and rec.id >= before_id:
+            continue
+        if search_query and search_query not in rec.qr_string:
+            continue
+        if skipped < offset:
+            skipped += 1
+            continue
+        records.append(rec)
+        if len(records) > limit:
+            break
+    return [admin_record(rec) for rec in records[:limit]], len(records) > limit
+
+
+def admin_record(rec):
+    """The same shape the admin dashboard gets from search.search_page."""
+    return {
+        "id": rec.id,
+        "qr_string": rec.qr_string,
+        "original_string": rec.original_string,
+        "original_date": rec.scan_date,
+        "status": rec.status
+    }
+
+
+def record_timeline(conn, record_id, include_archived=False, archive_dir=ARCHIVE_DIR):
+    """Every step of one record's history with the state after each, or None if there's no such record."""
+    record = conn.execute("SELECT id, qr_string, scan_date FROM qr_records WHERE id = ?", (record_id,)).fetchone()
+    if record is None:
+        return None
+
+    rec = RecordState(record[0], record[1], record[2])
+    events = [{"mutation_id": None, "action": "SCAN", "new_string": None, "date": record[2],
+               "qr_string": rec.qr_string, "status": rec.status}]
+
+    through, _ = read_snapshot(conn)
+    if through and include_archived:
+        archived = archived_mutations(archive_dir, [record_id])
+        mutations = [(m["id"], m["action"], m["new_string"], m["mutation_date"]) for m in archived]
+    else:
+        mutations = []
+        if through:
+            # Jump to where compaction left it, the steps before that are archived
+            snap = conn.execute("SELECT qr_string, status FROM qr_snapshot WHERE record_id = ?", (record_id,)).fetchone()
+            if snap is not None:
+                rec.qr_string, rec.status = snap[0], snap[1]
+                events.append({"mutation_id": through, "action": "SNAPSHOT", "new_string": None, "date": None,
+                               "qr_string": rec.qr_string, "status": rec.status})
+
+    # Point lookup on idx_qr_mutations_record_id
+    mutations.extend(conn.execute(
+        "SELECT id, action, new_string, mutation_date FROM qr_mutations WHERE record_id = ? ORDER BY id ASC",
+        (record_id,)
+    ).fetchall())
+
+    for m in mutations:
+        rec.apply(m[1], m[2])
+        events.append({"mutation_id": m[0], "action": m[1], "new_string": m[2], "date": m[3],
+                       "qr_string": rec.qr_string, "status": rec.status})
+
+    return {
+        "record": {"id": record[0], "original_string": record[1], "scan_date": record[2]},
+        "current": rec.to_dict(),
+        "archived_through": through,
+        "archive_included": bool(through and include_archived and has_archive(archive_dir)),
+        "events": events
+    }
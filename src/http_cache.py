@@ -0,0 +1,172 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache, wraps
+
+from flask import Response, make_response, request
+
+from metrics import Counter, phase, register
+
+# Polling an idle registry should cost next to nothing:
+#   * read endpoints get a weak ETag built from the data version (janitor generation,
+#     last record id, last mutation id) + the query, so If-None-Match is answered with
+#     a 304 before the view (and its replay/search) ever runs
+#   * rendered bodies are kept per (endpoint, params, version), compressed at most once
+#   * JSON bodies over MIN_COMPRESS_BYTES go out brotli- (if installed) or gzip-compressed
+# Every gunicorn worker reads the same DB, so they all hand out the same ETags.
+
+MIN_COMPRESS_BYTES = 1024
+CACHE_SIZE = 256
+MAX_CACHED_BODY = 1024 * 1024 # Bigger payloads are still compressed, just not kept
+
+CACHE_RESULTS = register(Counter("qr_http_cache_total", "Cached read endpoint lookups by result (not_modified, hit, miss)."))
+
+
+@lru_cache(maxsize=None)
+def _brotli():
+    try:
+        import brotli # Optional, gzip is used when it isn't installed
+    except ImportError:
+        return None
+    return brotli
+
+
+def pick_encoding(size):
+    """The Content-Encoding to use for a body of this size, given the request's Accept-Encoding."""
+    if size < MIN_COMPRESS_BYTES:
+        return None
+    accepted = request.accept_encodings
+    if _brotli() is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return _brotli().compress(body)
+    return gzip.compress(body, compresslevel=6)
+
+
+class _Entry:
+    __slots__ = ("body", "mimetype", "encoded")
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.encoded = {} # Content-Encoding -> compressed body, filled on first use
+
+
+class ResponseCache:
+    """LRU of rendered response bodies. A new data version drops everything older (it can't be served again)."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, entry):
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._entries[key] = entry
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def encoded(self, entry, encoding):
+        body = entry.encoded.get(encoding)
+        if body is None:
+            # Two threads may race to compress the same body, both results are identical
+            body = entry.encoded[encoding] = compress(entry.body, encoding)
+        return body
+
+
+response_cache = ResponseCache()
+
+
+def make_etag(endpoint, params, version):
+    digest = hashlib.sha1(repr((endpoint, params)).encode("utf-8")).hexdigest()[:12]
+    return "-".join(str(part) for part in version) + "-" + digest
+
+
+def _finish(response, etag):
+    response.set_etag(etag, weak=True)
+    # Browsers may keep the body, but have to revalidate (cheaply, via If-None-Match) every time
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def conditional_json(version, cache=None):
+    """Decorates a read-only JSON view with ETags, 304s, the payload cache and compression.
+
+    version() must return the current data version; it's called before the view runs.
+    cache() picks the ResponseCache to use (one per registry shard), the shared one by default.
+    Only 200 responses are cached, errors pass straight through.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with phase("etag"):
+                current = version()
+            params = (tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))))
+            key = (request.endpoint, params, current)
+            etag = make_etag(request.endpoint, params, current)
+
+            if request.if_none_match.contains_weak(etag):
+                CACHE_RESULTS.inc(result="not_modified")
+                return _finish(Response(status=304), etag)
+
+            entries = cache() if cache is not None else response_cache
+            entry = entries.get(key)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                CACHE_RESULTS.inc(result="miss")
+                entry = _Entry(response.get_data(), response.mimetype)
+                if len(entry.body) <= MAX_CACHED_BODY:
+                    entries.put(key, current, entry)
+            else:
+                CACHE_RESULTS.inc(result="hit")
+
+            with phase("compress"):
+                encoding = pick_encoding(len(entry.body))
+                response = Response(entries.encoded(entry, encoding) if encoding else entry.body,
+                                    mimetype=entry.mimetype)
+                if encoding:
+                    response.headers["Content-Encoding"] = encoding
+            return _finish(response, etag)
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    """Compresses the remaining (uncached) JSON responses that are big enough to be worth it."""
+
+    @app.after_request
+    def _compress_json(response):
+        if (response.mimetype != "application/json" or response.status_code != 200
+                or response.is_streamed or response.direct_passthrough
+                or "Content-Encoding" in response.headers):
+            return response
+        body = response.get_data()
+        encoding = pick_encoding(len(body))
+        if encoding:
+            response.set_data(compress(body, encoding))
+            response.headers["Content-Encoding"] = encoding
+            response.vary.add("Accept-Encoding")
+        return response
+
+    return app
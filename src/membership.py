@@ -0,0 +1,128 @@
+import base64
+import math
+import threading
+import zlib
+
+from db import get_connection
+from events import format_event_id, log_position
+
+# Offline scanners pre-check duplicates against a Bloom filter (/membership-filter) of every
+# string a scan would be refused for: each record's original string (locked forever) plus
+# the string it holds now, if an edit changed it.
+#   * hashing is two CRC32s (zlib here, a table in index.html), combined Kirsch-Mitzenmacher style
+#   * scans only ever ADD strings, so a client with the filter of the same mutation high-water
+#     mark just gets the strings scanned since (a delta)
+#   * a new mutation (an edit can free a string) or a janitor run moves the filter to a new
+#     version, and clients download it whole again
+# A hit means "probably taken": the server still has the final word when the scan syncs.
+
+FALSE_POSITIVE_RATE = 0.01
+HASH_COUNT = 7        # Optimal for 1%: (bits / capacity) * ln 2
+HEADROOM = 1.25       # Room for scans before the filter has to be rebuilt bigger
+MIN_CAPACITY = 1024
+DELTA_LIMIT = 5000    # A client further behind than this gets the full filter
+SECOND_SEED = 0x9747B28C
+
+
+def filter_hashes(qr_string):
+    data = qr_string.encode("utf-8")
+    return zlib.crc32(data), zlib.crc32(data, SECOND_SEED) | 1
+
+
+class BloomFilter:
+    """A fixed-size Bloom filter sized for `capacity` strings at FALSE_POSITIVE_RATE."""
+
+    def __init__(self, capacity):
+        self.capacity = max(MIN_CAPACITY, int(capacity))
+        bits = math.ceil(-self.capacity * math.log(FALSE_POSITIVE_RATE) / math.log(2) ** 2)
+        self.bit_count = (bits + 7) // 8 * 8
+        self.bits = bytearray(self.bit_count // 8)
+        self.count = 0
+        self._encoded = None
+
+    def _positions(self, qr_string):
+        h1, h2 = filter_hashes(qr_string)
+        for i in range(HASH_COUNT):
+            yield ((h1 + i * h2) & 0xFFFFFFFF) % self.bit_count
+
+    def add(self, qr_string):
+        self.update((qr_string,))
+
+    def update(self, qr_strings):
+        # The hot loop of a rebuild: everything inlined and local
+        bits, bit_count, crc32 = self.bits, self.bit_count, zlib.crc32
+        offsets = range(HASH_COUNT)
+        added = 0
+        for qr_string in qr_strings:
+            data = qr_string.encode("utf-8")
+            h1, h2 = crc32(data), crc32(data, SECOND_SEED) | 1
+            for i in offsets:
+                position = ((h1 + i * h2) & 0xFFFFFFFF) % bit_count
+                bits[position >> 3] |= 1 << (position & 7)
+            added += 1
+        self.count += added
+        self._encoded = None
+
+    def __contains__(self, qr_string):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(qr_string))
+
+    def to_dict(self):
+        if self._encoded is None:
+            self._encoded = base64.b64encode(self.bits).decode("ascii")
+        return {"bits": self.bit_count, "hashes": HASH_COUNT, "count": self.count,
+                "capacity": self.capacity, "filter": self._encoded}
+
+
+class MembershipIndex:
+    """Keeps this worker's filter in step with the log and answers /membership-filter."""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._filter = None
+        self._position = None # (generation, last record id, last mutation id) the filter reflects
+        self.build_count = 0
+
+    def payload(self, since=None):
+        """The delta since `since` (a log position) when it can be used, otherwise the full filter."""
+        conn = get_connection(self.db_file)
+        with self._lock:
+            # One read snapshot: the version we hand out is exactly what the strings reflect
+            conn.execute("BEGIN")
+            try:
+                position = log_position(conn)
+                if (since is not None and since[0] == position[0] and since[2] == position[2]
+                        and 0 <= position[1] - since[1] <= DELTA_LIMIT):
+                    added = [row[0] for row in conn.execute(
+                        "SELECT qr_string FROM qr_records WHERE id > ? ORDER BY id", (since[1],)
+                    )]
+                    return {"type": "delta", "version": format_event_id(position),
+                            "since": format_event_id(since), "add": added}
+
+                self._catch_up(conn, position)
+                return {"type": "full", "version": format_event_id(position), **self._filter.to_dict()}
+            finally:
+                conn.commit()
+
+    def _catch_up(self, conn, position):
+        previous = self._position
+        if previous is not None and previous[0] == position[0] and previous[2] == position[2]:
+            # Only new scans since the last build: add them, unless the filter would overflow
+            added = [row[0] for row in conn.execute(
+                "SELECT qr_string FROM qr_records WHERE id > ? ORDER BY id", (previous[1],)
+            )]
+            if self._filter.count + len(added) <= self._filter.capacity:
+                self._filter.update(added)
+                self._position = position
+                return
+        self._rebuild(conn)
+        self._position = position
+
+    def _rebuild(self, conn):
+        query = ("SELECT qr_string FROM qr_records "
+                 "UNION ALL SELECT qr_string FROM qr_state WHERE qr_string != original_string")
+        total = conn.execute(f"SELECT COUNT(*) FROM ({query})").fetchone()[0]
+        bloom = BloomFilter(total * HEADROOM)
+        bloom.update(row[0] for row in conn.execute(query))
+        self._filter = bloom
+        self.build_count += 1
@@ -0,0 +1,168 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+# Lightweight, dependency-free instrumentation.
+#   * every request records how long each phase took (replay, dedupe check, commit, ...)
+#   * /metrics renders counters + histograms in the Prometheus text format
+#   * ?timing=1 or an "X-Debug-Timing: 1" header adds a Server-Timing breakdown to the response
+# Numbers are per process: each gunicorn worker reports its own (Prometheus sums them up).
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {} # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for i, bound in enumerate(self.buckets):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {series[i]}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Read at scrape time from a callback, so it never goes stale."""
+
+    def __init__(self, name, help_text, read, kind="gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.kind = kind
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}", f"{self.name} {value}"]
+
+
+REQUESTS = Counter("qr_requests_total", "HTTP requests by route, method and status code.")
+REQUEST_SECONDS = Histogram("qr_request_duration_seconds", "End-to-end request latency by route.")
+PHASE_SECONDS = Histogram("qr_request_phase_seconds", "Time spent in each phase of a request.")
+DUPLICATES = Counter("qr_duplicate_scans_total", "Scans rejected because the string already exists.")
+
+_registry = [REQUESTS, REQUEST_SECONDS, PHASE_SECONDS, DUPLICATES]
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render_metrics():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def phase(name):
+    """Times one phase of the current request (etag, db_fetch, replay, dedupe_check, commit, serialize, compress).
+
+    A phase entered more than once in a request is reported once, with the durations added up.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        timings = g.setdefault("phase_timings", {}) # name -> seconds, in the order first entered
+        timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def _route_label():
+    # The URL rule keeps label cardinality low (/admin/api/records, not every ?search=...)
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+def _wants_server_timing():
+    return request.args.get("timing") == "1" or request.headers.get("X-Debug-Timing") == "1"
+
+
+def init_app(app):
+    """Hooks the per-request timing into a Flask app."""
+
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop("request_started", None)
+        if started is None:
+            return response
+        total = time.perf_counter() - started
+        route = _route_label()
+        timings = g.pop("phase_timings", {}).items()
+
+        REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+        REQUEST_SECONDS.observe(total, route=route)
+        for name, elapsed in timings:
+            PHASE_SECONDS.observe(elapsed, route=route, phase=name)
+
+        if _wants_server_timing():
+            entries = [f"{name};dur={elapsed * 1000:.3f}" for name, elapsed in timings]
+            entries.append(f"total;dur={total * 1000:.3f}")
+            response.headers["Server-Timing"] = ", ".join(entries)
+        return response
+
+    return app
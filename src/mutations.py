@@ -0,0 +1,142 @@
+from projection import project_mutation
+from state_engine import RecordState
+from timestamps import now_stamps
+
+# Admin mutations, one or many per request (/admin/api/mutate).
+# Everything is checked against qr_state inside the write transaction, set-based:
+#   * one IN (...) query loads every record the batch touches
+#   * one IN (...) query finds the current owner of every string it wants to EDIT to
+#   * the batch is then walked in order, in memory, so collisions INSIDE the batch
+#     (two edits to the same string, or an edit into a string an earlier item frees) resolve
+#     exactly as if the items had been sent one by one
+# Valid items are logged with one executemany; each item gets its own result.
+
+MUTATION_ACTIONS = ('EDIT', 'DELETE', 'RESTORE')
+MUTATE_LIMIT = 500 # Max operations per /admin/api/mutate call
+LOOKUP_CHUNK = 500
+
+
+def collision_message(new_string):
+    return f"Cannot edit: The string '{new_string}' is already in use by another record!"
+
+
+def parse_operations(data):
+    """The request body as a list of operations: {"operations": [...]} or one bare operation.
+
+    Raises ValueError if it isn't usable at all; bad individual items are reported per item later.
+    """
+    operations = data.get('operations') if isinstance(data, dict) and 'operations' in data else [data]
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("Expected a non-empty 'operations' list.")
+    if len(operations) > MUTATE_LIMIT:
+        raise ValueError(f"Send at most {MUTATE_LIMIT} operations per call.")
+    return [op if isinstance(op, dict) else {} for op in operations]
+
+
+def _normalize(op):
+    """(record_id, action, new_string) or raises ValueError with the per-item message."""
+    action = op.get('action')
+    try:
+        record_id = int(op.get('record_id')) # The edit modal sends it back as a string
+    except (TypeError, ValueError):
+        record_id = None
+    if not record_id or action not in MUTATION_ACTIONS:
+        raise ValueError("Invalid data.")
+
+    new_string = op.get('new_string')
+    if action == 'EDIT':
+        new_string = str(new_string or '').strip()
+        if len(new_string) != 9:
+            raise ValueError("String must be 9 characters.")
+    else:
+        new_string = None
+    return record_id, action, new_string
+
+
+def _select_in(conn, sql, values):
+    rows = []
+    values = list(values)
+    for i in range(0, len(values), LOOKUP_CHUNK):
+        chunk = values[i:i + LOOKUP_CHUNK]
+        rows.extend(conn.execute(sql.format(placeholders=",".join("?" * len(chunk))), chunk).fetchall())
+    return rows
+
+
+def apply_mutations(conn, operations, group=None):
+    """Validates and logs a batch of operations in the caller's write transaction.
+
+    Returns one {"record_id", "action", "status", "message"} per operation, in order.
+    Pass the WriteGroup when running through the GroupCommitter so later jobs see the claimed strings.
+    """
+    results = []
+    parsed = []
+    for op in operations:
+        try:
+            parsed.append(_normalize(op))
+            results.append(None)
+        except ValueError as e:
+            parsed.append(None)
+            results.append({"record_id": op.get('record_id'), "action": op.get('action'),
+                            "status": "error", "message": str(e)})
+
+    valid = [p for p in parsed if p is not None]
+    records = {}
+    for row in _select_in(conn, "SELECT id, qr_string, original_string, scan_date, status FROM qr_state WHERE id IN ({placeholders})",
+                          {p[0] for p in valid}):
+        rec = RecordState(row[0], row[2], row[3])
+        rec.qr_string, rec.status = row[1], row[4]
+        records[rec.id] = rec
+
+    # string -> id of the record holding it right now (None once the batch frees it)
+    owners = {row[0]: row[1] for row in _select_in(
+        conn, "SELECT qr_string, id FROM qr_state WHERE qr_string IN ({placeholders})", {p[2] for p in valid if p[2]}
+    )}
+    if group is not None:
+        for p in valid:
+            if p[2] and p[2] in group.claimed:
+                owners[p[2]] = group.claimed[p[2]].id
+
+    to_log = []
+    for i, p in enumerate(parsed):
+        if p is None:
+            continue
+        record_id, action, new_string = p
+        result = {"record_id": record_id, "action": action, "status": "error"}
+        results[i] = result
+
+        rec = records.get(record_id)
+        if rec is None:
+            result["message"] = "Record not found."
+            continue
+
+        if action == 'EDIT':
+            owner = owners.get(new_string)
+            if owner is not None and owner != record_id:
+                result["message"] = collision_message(new_string)
+                continue
+            if owners.get(rec.qr_string) == record_id:
+                owners[rec.qr_string] = None # Free for the rest of the batch
+            owners[new_string] = record_id
+
+        rec.apply(action, new_string)
+        to_log.append((record_id, action, new_string))
+        result["status"] = "success"
+        result["message"] = None
+        result["record"] = rec.to_dict()
+
+    if to_log:
+        mutation_date, mutation_ts = now_stamps()
+        conn.executemany(
+            "INSERT INTO qr_mutations (record_id, action, new_string, mutation_date, mutation_ts) VALUES (?, ?, ?, ?, ?)",
+            [(record_id, action, new_string, mutation_date, mutation_ts) for record_id, action, new_string in to_log]
+        )
+        # Same order as the log, so qr_state's UNIQUE(qr_string) never sees a half-applied swap
+        for record_id, action, new_string in to_log:
+            project_mutation(conn, record_id, action, new_string)
+
+        if group is not None:
+            # Where each edited record ended up (strings it passed through on the way are free again)
+            for record_id in {record_id for record_id, action, _ in to_log if action == 'EDIT'}:
+                group.claimed[records[record_id].qr_string] = records[record_id]
+            group.dirty = True # ONE backup for the whole batch
+    return results
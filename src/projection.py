@@ -0,0 +1,181 @@
+import sqlite3
+from state_engine import replay_log
+
+DB_FILE = "qr_data.db"
+
+# qr_records + qr_mutations stay the append-only source of truth.
+# qr_state is just a cached "current state" view of them, kept up to date
+# on every write so the routes can do indexed lookups instead of replaying
+# the whole ghost timeline on every request.
+
+
+def create_projection_schema(cursor):
+    """Creates the qr_state projection table and its indexes if they don't exist."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS qr_state (
+            id INTEGER PRIMARY KEY,
+            qr_string TEXT NOT NULL,
+            original_string TEXT NOT NULL,
+            status TEXT NOT NULL,
+            scan_date TEXT NOT NULL
+        )
+    ''')
+
+    # A string can only be "current" for one record at a time (same rule as the Edit Collision check)
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_qr_state_qr_string
+        ON qr_state (qr_string)
+    ''')
+
+    # Records a rebuild had to leave out of qr_state because another record already holds their string
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS qr_state_conflicts (
+            id INTEGER PRIMARY KEY,
+            qr_string TEXT NOT NULL,
+            kept_id INTEGER NOT NULL
+        )
+    ''')
+
+    create_search_index(cursor)
+
+
+def create_search_index(cursor):
+    """Trigram FTS5 index over the CURRENT strings, kept in sync by triggers.
+
+    Returns False if this SQLite build has no trigram tokenizer (search then falls back to a scan).
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'qr_state_fts'")
+    already_there = cursor.fetchone() is not None
+
+    try:
+        # case_sensitive keeps the admin search exact, like Python's `in` was
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS qr_state_fts USING fts5(
+                qr_string,
+                content='qr_state',
+                content_rowid='id',
+                tokenize='trigram case_sensitive 1'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"⚠️ Trigram search index unavailable ({e}). Admin search will scan instead.")
+        return False
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS qr_state_fts_insert AFTER INSERT ON qr_state BEGIN
+            INSERT INTO qr_state_fts (rowid, qr_string) VALUES (new.id, new.qr_string);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS qr_state_fts_delete AFTER DELETE ON qr_state BEGIN
+            INSERT INTO qr_state_fts (qr_state_fts, rowid, qr_string) VALUES ('delete', old.id, old.qr_string);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS qr_state_fts_update AFTER UPDATE OF qr_string ON qr_state BEGIN
+            INSERT INTO qr_state_fts (qr_state_fts, rowid, qr_string) VALUES ('delete', old.id, old.qr_string);
+            INSERT INTO qr_state_fts (rowid, qr_string) VALUES (new.id, new.qr_string);
+        END
+    ''')
+
+    # Existing registries need the index filled in from what's already in qr_state
+    if not already_there:
+        cursor.execute("INSERT INTO qr_state_fts (qr_state_fts) VALUES ('rebuild')")
+    return True
+
+
+def has_search_index(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'qr_state_fts'"
+    ).fetchone() is not None
+
+
+def project_new_record(cursor, record_id, qr_string, scan_date):
+    """Adds a freshly inserted qr_records row to the projection."""
+    cursor.execute(
+        "INSERT INTO qr_state (id, qr_string, original_string, status, scan_date) VALUES (?, ?, ?, 'ACTIVE', ?)",
+        (record_id, qr_string, qr_string, scan_date)
+    )
+
+
+def project_new_records_since(cursor, last_record_id):
+    """Projects every qr_records row past last_record_id in one go (for executemany batches)."""
+    cursor.execute('''
+        INSERT INTO qr_state (id, qr_string, original_string, status, scan_date)
+        SELECT id, qr_string, qr_string, 'ACTIVE', scan_date FROM qr_records WHERE id > ?
+    ''', (last_record_id,))
+
+
+def project_mutation(cursor, record_id, action, new_string):
+    """Applies one ghost mutation to the projection (same rules as RecordState.apply)."""
+    if action == 'DELETE':
+        cursor.execute("UPDATE qr_state SET status = 'DELETED' WHERE id = ?", (record_id,))
+    elif action == 'EDIT':
+        cursor.execute(
+            "UPDATE qr_state SET status = 'EDITED', qr_string = ? WHERE id = ?",
+            (new_string, record_id)
+        )
+    elif action == 'RESTORE':
+        cursor.execute('''
+            UPDATE qr_state
+            SET status = CASE WHEN qr_string != original_string THEN 'EDITED' ELSE 'ACTIVE' END
+            WHERE id = ?
+        ''', (record_id,))
+
+
+def rebuild_projection(conn):
+    """Throws away qr_state and regenerates it from the full append-only log."""
+    # Fast-forward through history (the shared engine does the actual replay)
+    engine = replay_log(conn)
+
+    # Older logs can hold logical duplicates (two records ending on the same string). Only one of
+    # them fits in qr_state: the lowest id keeps the string, like the engine's lookup index does,
+    # and the others are set aside in qr_state_conflicts until db_cleanup.py merges them.
+    kept = []
+    conflicts = []
+    owners = {}
+    for rec in engine.records.values():
+        owner = owners.setdefault(rec.qr_string, rec.id)
+        if owner == rec.id:
+            kept.append((rec.id, rec.qr_string, rec.original_string, rec.status, rec.scan_date))
+        else:
+            conflicts.append((rec.id, rec.qr_string, owner))
+
+    cursor = conn.cursor()
+    create_projection_schema(cursor)
+    cursor.execute("DELETE FROM qr_state")
+    cursor.execute("DELETE FROM qr_state_conflicts")
+    cursor.executemany(
+        "INSERT INTO qr_state (id, qr_string, original_string, status, scan_date) VALUES (?, ?, ?, ?, ?)", kept
+    )
+    cursor.executemany("INSERT INTO qr_state_conflicts (id, qr_string, kept_id) VALUES (?, ?, ?)", conflicts)
+    if conflicts:
+        print(f"⚠️ {len(conflicts)} record(s) hold a string an older record already has (e.g. ID {conflicts[0][0]} "
+              f"'{conflicts[0][1]}', kept ID {conflicts[0][2]}). They are listed in qr_state_conflicts and left out "
+              "of qr_state. Run db_cleanup.py to merge them!")
+    if has_search_index(conn):
+        cursor.execute("INSERT INTO qr_state_fts (qr_state_fts) VALUES ('rebuild')")
+    conn.commit()
+
+    return len(engine.records)
+
+
+def projection_is_stale(cursor):
+    """Cheap startup check: every qr_records row should have exactly one qr_state (or qr_state_conflicts) row."""
+    cursor.execute("SELECT COUNT(*) FROM qr_records")
+    record_count = cursor.fetchone()[0]
+    cursor.execute("SELECT (SELECT COUNT(*) FROM qr_state) + (SELECT COUNT(*) FROM qr_state_conflicts)")
+    state_count = cursor.fetchone()[0]
+    return record_count != state_count
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        print("🔁 Rebuilding qr_state from the append-only log...")
+        total = rebuild_projection(conn)
+        print(f"✅ qr_state rebuilt with {total} record(s).")
+    except Exception as e:
+        print(f"❌ Rebuild failed: {e}")
+    finally:
+        conn.close()
@@ -0,0 +1,107 @@
+import threading
+from collections import OrderedDict
+
+from projection import has_search_index
+from timestamps import range_clause
+
+# Admin search + paging, pushed down into SQLite:
+#   * substring search goes through the trigram FTS5 index on qr_state (see projection.py)
+#   * pages are fetched by keyset (id < before_id), so page 500 costs the same as page 1
+#   * match counts are cached per data version, so re-paging a search doesn't recount
+#   * from/to date windows go through the qr_records.scan_ts index (see timestamps.py)
+
+PAGE_SIZE = 20
+MIN_TRIGRAM_QUERY = 3 # Trigrams can't match anything shorter, those fall back to a scan
+COUNT_CACHE_SIZE = 256
+
+RECORD_COLUMNS = "s.id, s.qr_string, s.original_string, s.scan_date AS original_date, s.status"
+
+
+def _fts_phrase(search_query):
+    # Quote it as one phrase so characters like '-' or '*' aren't read as FTS syntax
+    return '"' + search_query.replace('"', '""') + '"'
+
+
+def _use_index(conn, search_query):
+    return len(search_query) >= MIN_TRIGRAM_QUERY and has_search_index(conn)
+
+
+def _date_filter(date_from, date_to):
+    # scan_date never changes, so the window is decided by qr_records alone
+    where, params = range_clause("scan_ts", date_from, date_to)
+    return (f"s.id IN (SELECT id FROM qr_records WHERE {where})", params) if where else (None, [])
+
+
+def search_page(conn, search_query="", before_id=None, offset=0, limit=PAGE_SIZE, date_from=None, date_to=None):
+    """Returns (records newest-first, has_more). Pass before_id for keyset paging."""
+    params = []
+    if search_query and _use_index(conn, search_query):
+        where = ["s.id IN (SELECT rowid FROM qr_state_fts WHERE qr_state_fts MATCH ?)"]
+        params.append(_fts_phrase(search_query))
+    elif search_query:
+        where = ["instr(s.qr_string, ?) > 0"]
+        params.append(search_query)
+    else:
+        where = []
+
+    date_where, date_params = _date_filter(date_from, date_to)
+    if date_where:
+        where.append(date_where)
+        params.extend(date_params)
+
+    if before_id is not None:
+        where.append("s.id < ?")
+        params.append(before_id)
+
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    # Fetch one extra row to know whether there's a next page without counting
+    rows = conn.execute(
+        f"SELECT {RECORD_COLUMNS} FROM qr_state s {where_sql} ORDER BY s.id DESC LIMIT ? OFFSET ?",
+        params + [limit + 1, offset]
+    ).fetchall()
+
+    records = [dict(r) for r in rows[:limit]]
+    return records, len(rows) > limit
+
+
+def count_matches(conn, search_query, date_from=None, date_to=None):
+    date_where, date_params = _date_filter(date_from, date_to)
+    if not search_query:
+        return conn.execute(f"SELECT COUNT(*) FROM qr_state s WHERE {date_where or 1}", date_params).fetchone()[0]
+    if _use_index(conn, search_query) and not date_where:
+        return conn.execute(
+            "SELECT COUNT(*) FROM qr_state_fts WHERE qr_state_fts MATCH ?",
+            (_fts_phrase(search_query),)
+        ).fetchone()[0]
+    if _use_index(conn, search_query):
+        where, params = "s.id IN (SELECT rowid FROM qr_state_fts WHERE qr_state_fts MATCH ?)", [_fts_phrase(search_query)]
+    else:
+        where, params = "instr(s.qr_string, ?) > 0", [search_query]
+    if date_where:
+        where += f" AND {date_where}"
+        params += date_params
+    return conn.execute(f"SELECT COUNT(*) FROM qr_state s WHERE {where}", params).fetchone()[0]
+
+
+class CountCache:
+    """Small LRU of search counts, keyed by (query, data version)."""
+
+    def __init__(self, size=COUNT_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_count(self, conn, search_query, version, date_from=None, date_to=None):
+        key = (search_query, date_from, date_to, version)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        total = count_matches(conn, search_query, date_from, date_to)
+
+        with self._lock:
+            self._entries[key] = total
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return total
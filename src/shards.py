@@ -0,0 +1,126 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# One registry per event/site ("shard"), each in its own SQLite file with its own backup set,
+# so writes, replays and uploads scale per event instead of globally.
+#   * the default shard is the registry we always had: qr_data.db, archive/, backups/...
+#   * every other shard lives under shards/<key>/ locally and in the bucket
+#   * shards are opened on first use (restore + migrate in the background, like startup)
+#   * only keys listed in EVENT_KEYS exist, so a typo can't create a stray registry
+# Cross-shard reads (the admin search over every event) fan out on a small thread pool.
+
+DEFAULT_SHARD = "default"
+SHARD_ROOT = "shards"
+SHARD_KEY = re.compile(r"[a-z0-9][a-z0-9_-]{0,39}")
+FAN_OUT_WORKERS = 8
+
+
+def parse_shard_key(value):
+    """?event= / X-Event as a shard key (empty = the default shard). Raises ValueError if malformed."""
+    key = (value or "").strip().lower() or DEFAULT_SHARD
+    if not SHARD_KEY.fullmatch(key):
+        raise ValueError("event must be 1-40 lowercase letters, digits, '-' or '_'.")
+    return key
+
+
+def parse_shard_keys(value):
+    """The EVENT_KEYS setting ("fair-2026,site-b") as a list of keys, default shard first."""
+    keys = [DEFAULT_SHARD]
+    for part in (value or "").split(","):
+        if part.strip() and parse_shard_key(part) not in keys:
+            keys.append(parse_shard_key(part))
+    return keys
+
+
+def shard_path(key, name):
+    """Where a shard keeps a local file/directory (qr_data.db, archive, export_cache, ...)."""
+    return name if key == DEFAULT_SHARD else os.path.join(SHARD_ROOT, key, name)
+
+
+class PrefixedBackend:
+    """The same bucket/directory, with every object name moved under <prefix>/ (one backup set per shard)."""
+
+    def __init__(self, backend, prefix):
+        self.backend = backend
+        self.prefix = prefix.rstrip("/") + "/"
+
+    def upload_file(self, local_path, object_name):
+        return self.backend.upload_file(local_path, self.prefix + object_name)
+
+    def download_file(self, object_name, local_path):
+        return self.backend.download_file(self.prefix + object_name, local_path)
+
+    def upload_bytes(self, data, object_name, if_generation_match=None):
+        return self.backend.upload_bytes(data, self.prefix + object_name, if_generation_match=if_generation_match)
+
+    def download_versioned(self, object_name):
+        return self.backend.download_versioned(self.prefix + object_name)
+
+    def object_info(self, object_name):
+        return self.backend.object_info(self.prefix + object_name)
+
+    def download_bytes(self, object_name, progress=None):
+        return self.backend.download_bytes(self.prefix + object_name, progress)
+
+    def delete(self, object_name):
+        return self.backend.delete(self.prefix + object_name)
+
+
+def shard_backend(backend, key):
+    return backend if key == DEFAULT_SHARD else PrefixedBackend(backend, f"{SHARD_ROOT}/{key}")
+
+
+class ShardRegistry:
+    """Opens shards lazily (open_shard(key) builds one) and fans reads out across them."""
+
+    def __init__(self, keys, open_shard, fan_out_workers=FAN_OUT_WORKERS):
+        self.keys = list(keys)
+        self.open_shard = open_shard
+        self.fan_out_workers = fan_out_workers
+
+        self._lock = threading.Lock()
+        self._shards = {}
+        self._executor = None
+        self._pid = None
+
+    def get(self, key):
+        """The shard for key, opened on first use. Raises KeyError for keys that aren't configured."""
+        shard = self._shards.get(key)
+        if shard is not None:
+            return shard
+        if key not in self.keys:
+            raise KeyError(key)
+        with self._lock:
+            shard = self._shards.get(key)
+            if shard is None:
+                if key != DEFAULT_SHARD:
+                    os.makedirs(os.path.join(SHARD_ROOT, key), exist_ok=True)
+                shard = self._shards[key] = self.open_shard(key)
+            return shard
+
+    def open_shards(self):
+        with self._lock:
+            return list(self._shards.values())
+
+    def _pool(self):
+        # Created lazily (and again after a fork) so each gunicorn worker gets its own threads
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.fan_out_workers, thread_name_prefix="shard-fan-out")
+                self._pid = os.getpid()
+            return self._executor
+
+    def fan_out(self, work, keys=None):
+        """Runs work(shard) on every shard in parallel. Returns {key: (result, error)} in key order."""
+        keys = self.keys if keys is None else keys
+        pool = self._pool()
+        futures = {key: pool.submit(lambda key=key: work(self.get(key))) for key in keys}
+        results = {}
+        for key, future in futures.items():
+            try:
+                results[key] = (future.result(), None)
+            except Exception as e:
+                results[key] = (None, e)
+        return results
@@ -0,0 +1,100 @@
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # Windows dev boxes: no cross-process lock, one worker is the norm there anyway
+    fcntl = None
+
+# Restoring from the bucket used to happen at import time, so a cold start
+# couldn't answer anything until the whole download finished. Now it runs in a
+# background thread while the server is already listening:
+#   * pages that don't touch the DB (/, /admin) are served right away,
+#   * everything else gets a 503 + Retry-After until the DB is ready,
+#   * /readyz reports how far along the restore is (point the startup probe at it).
+# Workers don't share memory, so a file lock makes sure only one of them talks to
+# the bucket; the others then find the local copy already up to date.
+
+
+class Startup:
+    """Runs restore_fn(progress) then init_fn() once, in the background."""
+
+    def __init__(self, lock_file, restore_fn, init_fn):
+        self.lock_file = lock_file
+        self.restore_fn = restore_fn
+        self.init_fn = init_fn
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stage = "pending"
+        self.done = None
+        self.total = None
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self.started = time.time()
+                self._thread = threading.Thread(target=self._run, name="startup-restore", daemon=True)
+                self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        """Blocks until the DB is ready (or timeout). Returns whether it is."""
+        return self._ready.wait(timeout)
+
+    def progress(self, stage, done=None, total=None):
+        with self._lock:
+            self.stage = stage
+            self.done = done
+            self.total = total
+
+    def _run(self):
+        lock = None
+        try:
+            if fcntl is not None:
+                self.progress("waiting_for_other_worker")
+                lock = open(self.lock_file, "a")
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                self.result = self.restore_fn(self.progress)
+            except Exception as e:
+                # Same as before: a failed download still lets us start on the local DB
+                print(f"❌ Cloud Sync Download Failed: {e}")
+
+            self.progress("migrating")
+            self.init_fn()
+            self.progress("ready")
+            self.finished = time.time()
+            self._ready.set()
+        except Exception as e:
+            self.error = str(e)
+            self.progress("failed")
+            print(f"❌ Startup failed: {e}")
+        finally:
+            if lock is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                lock.close()
+
+    def status(self):
+        with self._lock:
+            status = {
+                'ready': self.ready,
+                'stage': self.stage,
+                'result': self.result,
+                'error': self.error,
+                'elapsed_seconds': round((self.finished or time.time()) - self.started, 3) if self.started else None
+            }
+            if self.total:
+                status['done'] = self.done
+                status['total'] = self.total
+                status['percent'] = round(100.0 * (self.done or 0) / self.total, 1)
+            return status
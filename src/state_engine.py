@@ -0,0 +1,205 @@
+import threading
+from db import connect
+
+DB_FILE = "qr_data.db"
+
+# The ONE place that knows how to fast-forward through the ghost timeline.
+# Every route, the projection rebuild and the janitor go through here instead
+# of keeping their own copy of the replay loop.
+
+
+class RecordState:
+    """The current logical state of one qr_records row (slots keep 500k of these small)."""
+    __slots__ = ('id', 'qr_string', 'original_string', 'scan_date', 'status')
+
+    def __init__(self, record_id, qr_string, scan_date):
+        self.id = record_id
+        self.qr_string = qr_string
+        self.original_string = qr_string
+        self.scan_date = scan_date
+        self.status = 'ACTIVE'
+
+    def apply(self, action, new_string):
+        if action == 'DELETE':
+            self.status = 'DELETED'
+        elif action == 'EDIT':
+            self.status = 'EDITED'
+            self.qr_string = new_string
+        elif action == 'RESTORE':
+            is_edited = self.qr_string != self.original_string
+            self.status = 'EDITED' if is_edited else 'ACTIVE'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'qr_string': self.qr_string,
+            'original_string': self.original_string,
+            'scan_date': self.scan_date,
+            'status': self.status
+        }
+
+
+class StateEngine:
+    """In-memory replay of the log that only ever applies rows it hasn't seen yet."""
+
+    def __init__(self, db_file=None):
+        self.db_file = db_file
+        self._conn = None
+        self._lock = threading.RLock()
+        self._data_version = None
+        self._generation = None
+        self.reset()
+
+    def reset(self):
+        self.records = {}    # id -> RecordState, kept in ascending id order
+        self.by_string = {}  # current qr_string -> id
+        self.last_record_id = 0
+        self.last_mutation_id = 0
+        self.mutation_count = 0
+
+    # --- APPLYING THE LOG ---
+
+    def apply_record(self, record_id, qr_string, scan_date):
+        self.records[record_id] = RecordState(record_id, qr_string, scan_date)
+        self.by_string.setdefault(qr_string, record_id)
+        self.last_record_id = max(self.last_record_id, record_id)
+
+    def apply_mutation(self, mutation_id, record_id, action, new_string):
+        rec = self.records.get(record_id)
+        if rec:
+            old_string = rec.qr_string
+            rec.apply(action, new_string)
+            self._reindex(rec, old_string)
+        self.last_mutation_id = max(self.last_mutation_id, mutation_id)
+        self.mutation_count += 1
+
+    def apply_snapshot(self, record_id, qr_string, status):
+        """Jumps a record straight to the state compaction.py saved for it (its older mutations are archived)."""
+        rec = self.records.get(record_id)
+        if rec:
+            old_string = rec.qr_string
+            rec.qr_string = qr_string
+            rec.status = status
+            self._reindex(rec, old_string)
+
+    def _reindex(self, rec, old_string):
+        if rec.qr_string != old_string:
+            if self.by_string.get(old_string) == rec.id:
+                del self.by_string[old_string]
+            self.by_string.setdefault(rec.qr_string, rec.id)
+
+    def catch_up(self, conn):
+        """Applies every qr_records / qr_mutations row past our high-water marks."""
+        with self._lock:
+            # Read both tables from the same snapshot so a new record and its
+            # first mutation can't be split across two refreshes
+            in_transaction = conn.in_transaction
+            if not in_transaction:
+                conn.execute("BEGIN")
+            try:
+                # A fresh load starts from the compaction snapshot, the mutations it covers are archived
+                snapshot = []
+                if self.last_record_id == 0 and self.last_mutation_id == 0:
+                    through, snapshot = read_snapshot(conn)
+                    self.last_mutation_id = through
+                new_records = conn.execute(
+                    "SELECT id, qr_string, scan_date FROM qr_records WHERE id > ? ORDER BY id ASC",
+                    (self.last_record_id,)
+                ).fetchall()
+                new_mutations = conn.execute(
+                    "SELECT id, record_id, action, new_string FROM qr_mutations WHERE id > ? ORDER BY id ASC",
+                    (self.last_mutation_id,)
+                ).fetchall()
+            finally:
+                if not in_transaction:
+                    conn.commit()
+
+            for r in new_records:
+                self.apply_record(r[0], r[1], r[2])
+            for s in snapshot:
+                self.apply_snapshot(s[0], s[1], s[2])
+            for m in new_mutations:
+                self.apply_mutation(m[0], m[1], m[2], m[3])
+
+            return len(new_records) + len(new_mutations)
+
+    def refresh(self):
+        """Cheaply brings the engine up to date with whatever other connections committed."""
+        with self._lock:
+            if self._conn is None:
+                self._conn = connect(self.db_file, check_same_thread=False)
+
+            # data_version only moves when ANOTHER connection commits, so an idle registry costs one PRAGMA
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return self
+            self._data_version = data_version
+
+            # The janitor rewrites history in place, so it bumps user_version to force a full reload
+            generation = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if generation != self._generation:
+                self._generation = generation
+                self.reset()
+
+            self.catch_up(self._conn)
+            return self
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._data_version = None
+            self._generation = None
+
+    # --- READING THE STATE ---
+
+    @property
+    def version(self):
+        """Changes whenever the log does: (janitor generation, last record id, last mutation id)."""
+        return (self._generation, self.last_record_id, self.last_mutation_id)
+
+    def lookup(self, qr_string):
+        """Returns the record whose CURRENT string is exactly qr_string (or None)."""
+        with self._lock:
+            record_id = self.by_string.get(qr_string)
+            return self.records[record_id] if record_id is not None else None
+
+    def recent(self, limit, include_deleted=False):
+        """Newest-first records, stopping as soon as we have enough."""
+        with self._lock:
+            results = []
+            for rec in reversed(self.records.values()):
+                if not include_deleted and rec.status == 'DELETED':
+                    continue
+                results.append(rec)
+                if len(results) >= limit:
+                    break
+            return results
+
+
+def replay_log(conn):
+    """Builds a throwaway engine holding the full logical state of the given connection."""
+    engine = StateEngine()
+    engine.catch_up(conn)
+    return engine
+
+
+def read_snapshot(conn):
+    """(through_mutation_id, [(record_id, qr_string, status), ...]) as left by compaction.py, or (0, [])."""
+    has_snapshot = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'qr_snapshot_meta'"
+    ).fetchone()
+    if not has_snapshot:
+        return 0, [] # Never compacted (or a backup from before compaction existed)
+    row = conn.execute("SELECT through_mutation_id FROM qr_snapshot_meta WHERE id = 1").fetchone()
+    if row is None:
+        return 0, []
+    return row[0], conn.execute("SELECT record_id, qr_string, status FROM qr_snapshot").fetchall()
+
+
+def bump_generation(cursor):
+    """Tells every running StateEngine that history was rewritten and it must reload from scratch."""
+    cursor.execute("PRAGMA user_version")
+    generation = cursor.fetchone()[0]
+    cursor.execute(f"PRAGMA user_version = {generation + 1}")
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+from timestamps import range_clause, to_ts
+
+# Activity counts for the dashboard, aggregated inside SQLite straight off the
+# scan_ts / mutation_ts indexes (see timestamps.py) instead of walking the state.
+# Edits/deletes/restores only cover the live log: mutations archived by
+# compaction.py are no longer counted.
+
+DEFAULT_DAYS = 30
+BUCKETS = {
+    # granularity: length of the timestamp prefix that identifies the bucket
+    'day': 10,  # 2026-10-17
+    'hour': 13  # 2026-10-17 06
+}
+ACTION_KEYS = {'EDIT': 'edits', 'DELETE': 'deletes', 'RESTORE': 'restores'}
+
+
+def default_range():
+    """The last DEFAULT_DAYS days, today included."""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return to_ts(today - timedelta(days=DEFAULT_DAYS - 1)), to_ts(today + timedelta(days=1))
+
+
+def activity_counts(conn, granularity, date_from, date_to):
+    """[{"bucket", "scans", "edits", "deletes", "restores"}, ...] in chronological order."""
+    width = BUCKETS[granularity]
+    buckets = {}
+
+    def bucket(key):
+        if key not in buckets:
+            buckets[key] = {"bucket": key, "scans": 0, "edits": 0, "deletes": 0, "restores": 0}
+        return buckets[key]
+
+    where, params = range_clause("scan_ts", date_from, date_to)
+    for key, count in conn.execute(
+        f"SELECT substr(scan_ts, 1, {width}) AS b, COUNT(*) FROM qr_records "
+        f"WHERE {where or 'scan_ts IS NOT NULL'} GROUP BY b", params
+    ):
+        bucket(key)["scans"] = count
+
+    where, params = range_clause("mutation_ts", date_from, date_to)
+    for key, action, count in conn.execute(
+        f"SELECT substr(mutation_ts, 1, {width}) AS b, action, COUNT(*) FROM qr_mutations "
+        f"WHERE {where or 'mutation_ts IS NOT NULL'} GROUP BY b, action", params
+    ):
+        if action in ACTION_KEYS:
+            bucket(key)[ACTION_KEYS[action]] = count
+
+    return [buckets[key] for key in sorted(buckets)]
+
+
+def activity_stats(conn, date_from=None, date_to=None):
+    """Per-day and per-hour counts plus totals for the range (defaults to the last DEFAULT_DAYS days)."""
+    if date_from is None and date_to is None:
+        date_from, date_to = default_range()
+
+    daily = activity_counts(conn, 'day', date_from, date_to)
+    totals = {key: sum(day[key] for day in daily) for key in ("scans", "edits", "deletes", "restores")}
+    return {
+        "from": date_from,
+        "until": date_to, # Exclusive
+        "totals": totals,
+        "daily": daily,
+        "hourly": activity_counts(conn, 'hour', date_from, date_to)
+    }
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+from db import SCAN_DATE_FORMAT
+
+# scan_date / mutation_date are display strings ("October 17, 2026 at 06:01:45"),
+# which SQLite can't compare, sort or bucket. Every row now also carries a
+# sortable local-time ISO copy ("2026-10-17 06:01:45") in scan_ts / mutation_ts:
+#   * string order == chronological order, so plain indexes serve range filters
+#   * substr(ts, 1, 10) is the day and substr(ts, 1, 13) the hour, no date math needed
+# The display columns stay exactly as they were.
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+DATE_FORMAT = "%Y-%m-%d"
+
+
+def to_ts(when):
+    """datetime -> sortable timestamp string."""
+    return when.strftime(TS_FORMAT)
+
+
+def display_to_ts(display):
+    """A scan_date / mutation_date string -> sortable timestamp (None if it can't be read)."""
+    try:
+        return to_ts(datetime.strptime(display, SCAN_DATE_FORMAT))
+    except (TypeError, ValueError):
+        return None
+
+
+def now_stamps():
+    """(display string, sortable timestamp) for right now, always from the same clock reading."""
+    now = datetime.now()
+    return now.strftime(SCAN_DATE_FORMAT), to_ts(now)
+
+
+def parse_date_range(args):
+    """Reads ?from=YYYY-MM-DD&to=YYYY-MM-DD into (from_ts, to_ts) bounds for `ts >= from AND ts < to`.
+
+    'to' is inclusive, so the upper bound is the start of the next day. Raises ValueError on bad input.
+    """
+    date_from = date_to = None
+    try:
+        if args.get('from'):
+            date_from = to_ts(datetime.strptime(args['from'], DATE_FORMAT))
+        if args.get('to'):
+            date_to = to_ts(datetime.strptime(args['to'], DATE_FORMAT) + timedelta(days=1))
+    except ValueError:
+        raise ValueError("'from' and 'to' must look like YYYY-MM-DD.")
+    return date_from, date_to
+
+
+def range_clause(column, date_from, date_to):
+    """SQL condition + params for a parsed date range (empty when unbounded)."""
+    conditions, params = [], []
+    if date_from:
+        conditions.append(f"{column} >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append(f"{column} < ?")
+        params.append(date_to)
+    return " AND ".join(conditions), params
+
+
+def _has_column(cursor, table, column):
+    return any(row[1] == column for row in cursor.execute(f"PRAGMA table_info({table})").fetchall())
+
+
+def migrate_timestamps(conn):
+    """Adds scan_ts / mutation_ts (+ indexes) if missing and backfills any rows without one."""
+    cursor = conn.cursor()
+    if not _has_column(cursor, "qr_records", "scan_ts"):
+        cursor.execute("ALTER TABLE qr_records ADD COLUMN scan_ts TEXT")
+    if not _has_column(cursor, "qr_mutations", "mutation_ts"):
+        cursor.execute("ALTER TABLE qr_mutations ADD COLUMN mutation_ts TEXT")
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_qr_records_scan_ts ON qr_records (scan_ts)")
+    # Covers the per-day/per-hour action counts in stats.py without touching the table
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_qr_mutations_ts ON qr_mutations (mutation_ts, action)")
+
+    # One set-based UPDATE per table, the parsing runs inside SQLite via a Python function.
+    # Also catches rows restored from older backup segments that predate the columns.
+    conn.create_function("display_to_ts", 1, display_to_ts, deterministic=True)
+    backfilled = cursor.execute(
+        "UPDATE qr_records SET scan_ts = display_to_ts(scan_date) WHERE scan_ts IS NULL"
+    ).rowcount
+    backfilled += cursor.execute(
+        "UPDATE qr_mutations SET mutation_ts = display_to_ts(mutation_date) WHERE mutation_ts IS NULL"
+    ).rowcount
+    return backfilled
@@ -0,0 +1,140 @@
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from db import is_busy_error, run_write
+
+# Every scan used to pay for its own BEGIN IMMEDIATE ... COMMIT (and fsync), so
+# at peak check-in the scanners queued up behind each other's commits. Now
+# request threads hand their write to ONE writer thread per process, which:
+#   * waits a few ms for the burst to pile up,
+#   * applies everything pending inside a single transaction (each job in its own
+#     SAVEPOINT, so one bad write can't take the others down with it),
+#   * commits once, queues one backup, and wakes every request with its own result.
+# Jobs run strictly in arrival order, and they share a WriteGroup so two scans of
+# the same string in one group resolve the same way every time: first one wins.
+
+WINDOW_SECONDS = 0.002
+MAX_GROUP_SIZE = 256
+
+
+class WriteGroup:
+    """What the jobs in one transaction have claimed so far (the engine can't see uncommitted rows)."""
+
+    def __init__(self):
+        self.claimed = {}   # qr_string -> RecordState it now belongs to
+        self.dirty = False  # some job actually wrote something
+
+
+class _Job:
+    __slots__ = ('work', 'done', 'result', 'error')
+
+    def __init__(self, work):
+        self.work = work
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GroupCommitter:
+    """Coalesces concurrent writes into one transaction every few milliseconds."""
+
+    def __init__(self, db_file, window_seconds=WINDOW_SECONDS, max_group_size=MAX_GROUP_SIZE, on_commit=None):
+        self.db_file = db_file
+        self.window_seconds = window_seconds
+        self.max_group_size = max_group_size
+        self.on_commit = on_commit # Called with the WriteGroup after a commit that changed something
+
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._thread = None
+
+        self.group_count = 0
+        self.job_count = 0
+        self.last_group_size = 0
+
+    def submit(self, work):
+        """Runs work(conn, group) in the next group commit and returns its result (or raises its exception)."""
+        job = _Job(work)
+        with self._cond:
+            self._pending.append(job)
+            self._ensure_thread()
+            self._cond.notify_all()
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _ensure_thread(self):
+        # Started lazily so each gunicorn worker gets its own writer after the fork
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._worker, name="group-commit", daemon=True)
+            self._thread.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+
+                # Give the rest of the burst a moment to arrive, unless the group is already full
+                deadline = time.monotonic() + self.window_seconds
+                while len(self._pending) < self.max_group_size and time.monotonic() < deadline:
+                    self._cond.wait(deadline - time.monotonic())
+
+                jobs = [self._pending.popleft() for _ in range(min(len(self._pending), self.max_group_size))]
+
+            self._commit(jobs)
+
+    def _commit(self, jobs):
+        def apply_all(conn):
+            # run_write may retry on SQLITE_BUSY, so every attempt starts from a clean slate
+            group = WriteGroup()
+            outcomes = []
+            for job in jobs:
+                conn.execute("SAVEPOINT job")
+                try:
+                    outcomes.append((job.work(conn, group), None))
+                    conn.execute("RELEASE job")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    if isinstance(e, sqlite3.OperationalError) and is_busy_error(e):
+                        raise # Nothing to do with this job: let run_write retry the whole group
+                    outcomes.append((None, e))
+            return group, outcomes
+
+        try:
+            group, outcomes = run_write(self.db_file, apply_all)
+        except Exception as e:
+            for job in jobs:
+                job.error = e
+                job.done.set()
+            return
+
+        with self._cond:
+            self.group_count += 1
+            self.job_count += len(jobs)
+            self.last_group_size = len(jobs)
+
+        if group.dirty and self.on_commit is not None:
+            try:
+                self.on_commit(group)
+            except Exception as e:
+                print(f"⚠️ Post-commit hook failed: {e}")
+
+        for job, (result, error) in zip(jobs, outcomes):
+            job.result = result
+            job.error = error
+            job.done.set()
+
+    def status(self):
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "groups": self.group_count,
+                "jobs": self.job_count,
+                "last_group_size": self.last_group_size,
+                "window_seconds": self.window_seconds
+            }
@@ -0,0 +1,60 @@
+import importlib
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# The app imports its siblings by plain module name (like `cd src && python app.py` does)
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """A fresh import of app.py serving a brand-new qr_data.db in tmp_path, with local backups."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("BACKUP_BACKEND", "local")
+    monkeypatch.setenv("BACKUP_LOCAL_DIR", str(tmp_path / "backups"))
+    monkeypatch.setenv("BACKUP_WINDOW_SECONDS", "3600") # Only ship when a test asks for it
+    monkeypatch.setenv("EVENT_KEYS", "fair-2026")
+    sys.modules.pop("app", None)
+    module = importlib.import_module("app")
+    assert module.shards.get(module.DEFAULT_SHARD).startup.wait(10)
+    yield module
+
+    for shard in module.shards.open_shards():
+        shard.backup_scheduler.shutdown()
+        shard.engine.close()
+    sys.modules.pop("app", None)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def db_file(app_module):
+    return os.path.abspath(app_module.DB_FILE)
+
+
+def scan(client, qr_string, **params):
+    return client.post("/process-qr", json={"qr_string": qr_string}, query_string=params).get_json()
+
+
+def mutate(client, *operations):
+    return client.post("/admin/api/mutate", json={"operations": list(operations)}).get_json()
+
+
+def read_state(db_file):
+    """qr_state as {id: (qr_string, original_string, status)}."""
+    with sqlite3.connect(db_file) as conn:
+        return {row[0]: tuple(row[1:]) for row in conn.execute(
+            "SELECT id, qr_string, original_string, status FROM qr_state"
+        )}
+
+
+def engine_state(engine):
+    return {rec.id: (rec.qr_string, rec.original_string, rec.status) for rec in engine.records.values()}
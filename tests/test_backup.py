@@ -0,0 +1,128 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from backup import LocalDirBackend, IncrementalShipper, MANIFEST_OBJECT, manifest_objects, restore_from_backup
+from compaction import compact
+from conftest import mutate, read_state, scan
+
+
+def read_log(db_file):
+    with sqlite3.connect(db_file) as conn:
+        return (conn.execute("SELECT id, qr_string, scan_date FROM qr_records ORDER BY id").fetchall(),
+                conn.execute("SELECT id, record_id, action, new_string FROM qr_mutations ORDER BY id").fetchall())
+
+
+def stored_objects(root):
+    found = set()
+    for folder, _, files in os.walk(root):
+        for name in files:
+            if name.endswith((".db.gz", ".json.gz")):
+                found.add(os.path.relpath(os.path.join(folder, name), root).replace(os.sep, "/"))
+    return found
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return LocalDirBackend(str(tmp_path / "bucket"))
+
+
+def test_base_plus_segments_restore_the_log(client, db_file, backend, tmp_path):
+    shipper = IncrementalShipper(db_file, backend)
+    scan(client, "B00000001")
+    scan(client, "B00000002")
+    assert shipper.ship() == "base"
+
+    scan(client, "B00000003")
+    mutate(client, {"record_id": 1, "action": "EDIT", "new_string": "B00000009"},
+           {"record_id": 2, "action": "DELETE"})
+    assert shipper.ship() == "segment"
+    assert shipper.ship() is None # Nothing new
+
+    restored = str(tmp_path / "restored.db")
+    assert restore_from_backup(backend, restored) == "restored"
+    assert read_log(restored) == read_log(db_file)
+    assert read_state(restored) == read_state(db_file)
+
+    # A copy that already has the base only fetches the segments it's missing
+    scan(client, "B00000004")
+    assert shipper.ship() == "segment"
+    assert restore_from_backup(backend, restored) == "caught_up"
+    assert read_log(restored) == read_log(db_file)
+    assert stored_objects(backend.root) == set(manifest_objects(shipper.load_manifest()))
+
+
+def test_a_db_ahead_of_the_backup_is_kept(app_module, client, db_file, backend):
+    scan(client, "AAAAAAAAA")
+    scan(client, "BBBBBBBBB")
+    mutate(client, {"record_id": 1, "action": "DELETE"}, {"record_id": 1, "action": "RESTORE"})
+    shipper = IncrementalShipper(db_file, backend)
+    assert shipper.ship() == "base"
+
+    # Compaction bumps the generation; the scan after it hasn't been shipped yet
+    compact(db_file, through=2, archive_dir=app_module.shards.get(app_module.DEFAULT_SHARD).archive_dir,
+            vacuum=False)
+    scan(client, "CCCCCCCCC")
+    before = read_log(db_file)
+
+    # What a worker (re)start does
+    assert app_module.download_from_gcs(backend, db_file) == "local_ahead"
+    assert read_log(db_file) == before
+    with sqlite3.connect(db_file) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == 1
+
+    # The next ship replaces the old history with a base of the compacted one
+    assert shipper.ship() == "base"
+    assert shipper.load_manifest()["generation"] == 1
+
+
+class RacingBackend(LocalDirBackend):
+    """Once armed, another machine rewrites the manifest right before our next conditional write lands."""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.armed = False
+        self.conflicts = 0
+
+    def upload_bytes(self, data, object_name, if_generation_match=None):
+        if object_name == MANIFEST_OBJECT and if_generation_match is not None and self.armed:
+            self.armed = False
+            self.conflicts += 1
+            current = self.download_bytes(MANIFEST_OBJECT)
+            super().upload_bytes(current, MANIFEST_OBJECT)
+        return super().upload_bytes(data, object_name, if_generation_match)
+
+
+def test_manifest_conflict_is_retried_and_the_orphan_deleted(client, db_file, tmp_path):
+    backend = RacingBackend(str(tmp_path / "bucket"))
+    shipper = IncrementalShipper(db_file, backend)
+    scan(client, "C00000001")
+    assert shipper.ship() == "base"
+
+    backend.armed = True
+    scan(client, "C00000002")
+    assert shipper.ship() == "segment"
+
+    assert backend.conflicts == 1
+    manifest = shipper.load_manifest()
+    assert len(manifest["segments"]) == 1
+    assert stored_objects(backend.root) == set(manifest_objects(manifest))
+
+
+def test_a_db_behind_the_backup_is_never_shipped(client, db_file, backend, tmp_path):
+    scan(client, "D00000001")
+    scan(client, "D00000002")
+    IncrementalShipper(db_file, backend).ship()
+    before = backend.download_bytes(MANIFEST_OBJECT)
+
+    # E.g. the restore failed and the worker came up on an older copy
+    stale = str(tmp_path / "stale.db")
+    shutil.copyfile(db_file, stale)
+    with sqlite3.connect(stale) as conn:
+        conn.execute("DELETE FROM qr_records WHERE id = 2")
+
+    with pytest.raises(RuntimeError, match="behind the backup"):
+        IncrementalShipper(stale, backend).ship()
+    assert backend.download_bytes(MANIFEST_OBJECT) == before
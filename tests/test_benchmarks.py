@@ -0,0 +1,20 @@
+import argparse
+import sys
+
+from benchmarks.generate import DEFAULT_MIX
+from benchmarks.run import ROUTES, bench_size
+
+
+def test_benchmark_runs_every_route_against_the_app(monkeypatch):
+    # load_app points these at its own workdir; monkeypatch puts them back afterwards
+    for name in ("BACKUP_BACKEND", "BACKUP_LOCAL_DIR", "BACKUP_WINDOW_SECONDS"):
+        monkeypatch.setenv(name, "")
+    args = argparse.Namespace(mutations_per_record=0.2, mix=DEFAULT_MIX, seed=42, repeat=2,
+                              concurrency=2, concurrent_requests=6, skip_janitor=False)
+
+    result = bench_size(50, args)
+    sys.modules.pop("app", None)
+
+    assert set(result["routes"]) == set(ROUTES)
+    assert result["concurrent"]["errors"] == 0
+    assert result["janitor_s"] >= 0
@@ -0,0 +1,23 @@
+import sqlite3
+
+from backup import LocalDirBackend, restore_from_backup
+from compaction import compact
+from conftest import mutate, read_state, scan
+
+
+def test_compaction_ships_a_base_of_the_compacted_db(app_module, client, db_file, tmp_path):
+    backend = LocalDirBackend(str(tmp_path / "bucket"))
+    scan(client, "K00000001")
+    for i in (2, 3, 4):
+        mutate(client, {"record_id": 1, "action": "EDIT", "new_string": f"K0000000{i}"})
+
+    summary = compact(db_file, through=2, archive_dir=str(tmp_path / "archive"), backend=backend, vacuum=False)
+    assert summary["through"] == 2
+
+    # A worker starting on another machine gets the compacted history, not the old one
+    restored = str(tmp_path / "restored.db")
+    assert restore_from_backup(backend, restored) == "restored"
+    with sqlite3.connect(restored) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == 1
+        assert conn.execute("SELECT id FROM qr_mutations").fetchall() == [(3,)]
+    assert read_state(restored) == read_state(db_file)
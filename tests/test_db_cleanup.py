@@ -0,0 +1,51 @@
+import sqlite3
+
+import db_cleanup
+from backup import LocalDirBackend, restore_from_backup
+from conftest import read_state
+from projection import projection_is_stale, rebuild_projection
+from state_engine import replay_log
+
+
+def build_log_with_duplicates(db_file):
+    """Records 3 and 4 were edited onto strings 1 and 2 hold, before the collision check existed."""
+    with sqlite3.connect(db_file) as conn:
+        conn.executemany("INSERT INTO qr_records (qr_string, scan_date) VALUES (?, '2026-01-01 09:00:00')",
+                         [("AAAAAAAAA",), ("BBBBBBBBB",), ("CCCCCCCCC",), ("DDDDDDDDD",)])
+        conn.executemany("INSERT INTO qr_mutations (record_id, action, new_string, mutation_date) "
+                         "VALUES (?, ?, ?, '2026-01-01 10:00:00')", [
+                             (3, "EDIT", "AAAAAAAAA"), (4, "EDIT", "BBBBBBBBB"),
+                             (1, "DELETE", None), (1, "DELETE", None), (2, "DELETE", None), (2, "DELETE", None)
+                         ])
+        conn.commit()
+        rebuild_projection(conn)
+
+
+def test_janitor_merges_in_batches_and_keeps_the_projection_in_step(db_file, monkeypatch, tmp_path):
+    build_log_with_duplicates(db_file)
+    monkeypatch.setattr(db_cleanup, "BATCH", 1) # One merge / one record per write transaction
+    backend = LocalDirBackend(str(tmp_path / "bucket"))
+
+    planned = db_cleanup.run_ultimate_janitor(dry_run=True, db_file=db_file, backend=backend)
+    assert backend.object_info("backups/manifest.json") is None # A dry run uploads nothing
+    done = db_cleanup.run_ultimate_janitor(db_file=db_file, backend=backend)
+
+    assert (planned["merged"], planned["swept"]) == (done["merged"], done["swept"]) == (2, 2)
+    with sqlite3.connect(db_file) as conn:
+        engine = replay_log(conn)
+        assert sorted(engine.records) == [1, 2]
+        assert conn.execute("SELECT COUNT(*) FROM qr_state_conflicts").fetchone()[0] == 0
+        assert not projection_is_stale(conn.cursor())
+    assert read_state(db_file) == {rec.id: (rec.qr_string, rec.original_string, rec.status)
+                                   for rec in engine.records.values()}
+
+    # The bucket already holds the merged history
+    restored = str(tmp_path / "restored.db")
+    assert restore_from_backup(backend, restored) == "restored"
+    assert read_state(restored) == read_state(db_file)
+
+    # The checkpoint leaves nothing for an incremental run to do (or to ship)
+    shipped = backend.object_info("backups/manifest.json")
+    again = db_cleanup.run_ultimate_janitor(db_file=db_file, backend=backend)
+    assert (again["merged"], again["swept"]) == (0, 0)
+    assert backend.object_info("backups/manifest.json") == shipped
@@ -0,0 +1,50 @@
+import os
+import shutil
+
+import pytest
+
+from compaction import compact
+from conftest import mutate, scan
+
+
+@pytest.fixture
+def compacted(app_module, client, db_file):
+    """Record 1 edited three times, with the first two edits compacted into the archive."""
+    scan(client, "H00000001")
+    for i in (2, 3, 4):
+        mutate(client, {"record_id": 1, "action": "EDIT", "new_string": f"H0000000{i}"})
+    archive_dir = app_module.shards.get(app_module.DEFAULT_SHARD).archive_dir
+    compact(db_file, through=2, archive_dir=archive_dir, vacuum=False)
+    return archive_dir
+
+
+def records_as_of(client, as_of, **params):
+    return client.get("/admin/api/records", query_string={"as_of": as_of, **params})
+
+
+def test_as_of_reads_the_archive_when_it_reaches_back_that_far(client, compacted):
+    archived = records_as_of(client, 1).get_json()
+    assert [r["qr_string"] for r in archived["records"]] == ["H00000002"]
+
+    # Right at the compaction point the snapshot answers, after it the live log does
+    for as_of, expected in ((2, "H00000003"), (3, "H00000004")):
+        assert [r["qr_string"] for r in records_as_of(client, as_of).get_json()["records"]] == [expected]
+
+
+def test_missing_archive_answers_404(client, compacted):
+    shutil.rmtree(compacted)
+    response = records_as_of(client, 1)
+    assert response.status_code == 404
+    assert "--fetch" in response.get_json()["message"]
+
+    # Questions the live log can answer don't need it
+    assert records_as_of(client, 2).status_code == 200
+    assert records_as_of(client, 3).status_code == 200
+
+
+def test_unreadable_archive_answers_404(client, compacted):
+    for name in os.listdir(compacted):
+        with open(os.path.join(compacted, name), "r+b") as f:
+            f.truncate(10)
+    assert records_as_of(client, 1).status_code == 404
+    assert client.get("/admin/api/records/1/timeline?include_archived=1").status_code == 404
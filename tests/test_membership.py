@@ -0,0 +1,53 @@
+import base64
+import json
+import os
+import re
+import shutil
+import subprocess
+
+import pytest
+
+from conftest import SRC_DIR, scan
+from membership import HASH_COUNT, SECOND_SEED, BloomFilter
+
+SAMPLES = ["AAAAAAAAA", "R00000042", "qr-string", "ÄÖÜ€-中文-9", "", "x" * 64]
+
+
+def js_filter_code():
+    """The hashing half of the scanner page: CRC_TABLE, crc32 and filterPositions."""
+    with open(os.path.join(SRC_DIR, "templates", "index.html"), encoding="utf-8") as f:
+        page = f.read()
+    match = re.search(r"const CRC_TABLE = .*?(?=\n\s*function probablyTaken)", page, re.S)
+    assert match, "index.html no longer has the filter hashing code"
+    return f"const FILTER_SECOND_SEED = {SECOND_SEED};\n{match.group(0)}"
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_scanner_page_hashes_like_the_server():
+    bloom = BloomFilter(5000)
+    script = js_filter_code() + f"""
+        const filter = {{ bits: {bloom.bit_count}, hashes: {HASH_COUNT} }};
+        const samples = {json.dumps(SAMPLES)};
+        console.log(JSON.stringify(samples.map(s => filterPositions(s, filter))));
+    """
+    output = subprocess.run(["node", "-e", script], capture_output=True, text=True, check=True).stdout
+
+    assert json.loads(output) == [list(bloom._positions(s)) for s in SAMPLES]
+
+
+def test_served_filter_holds_every_taken_string(client):
+    scan(client, "M00000001")
+    scan(client, "M00000002")
+    client.post("/admin/api/mutate", json={"record_id": 2, "action": "EDIT", "new_string": "M00000003"})
+
+    payload = client.get("/membership-filter").get_json()
+    assert payload["type"] == "full"
+    bloom = BloomFilter(payload["capacity"])
+    assert bloom.bit_count == payload["bits"]
+    bloom.bits = bytearray(base64.b64decode(payload["filter"]))
+    # The original string stays locked after an edit, so all three are taken
+    assert all(s in bloom for s in ("M00000001", "M00000002", "M00000003"))
+
+    scan(client, "M00000004")
+    delta = client.get(f"/membership-filter?since={payload['version']}").get_json()
+    assert delta["type"] == "delta" and delta["add"] == ["M00000004"]
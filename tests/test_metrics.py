@@ -0,0 +1,20 @@
+from conftest import scan
+
+
+def server_timing(response):
+    return [entry.split(";")[0] for entry in response.headers["Server-Timing"].split(", ")]
+
+
+def test_server_timing_names_each_phase_once(client):
+    scan(client, "T00000001")
+    for path in ("/history?timing=1", "/admin/api/records?timing=1", "/admin/api/records?as_of=0&timing=1"):
+        names = server_timing(client.get(path))
+        assert len(names) == len(set(names)), path
+        assert names[-1] == "total"
+
+
+def test_metrics_report_request_phases(client):
+    client.get("/history")
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'qr_requests_total{method="GET",route="/history",status="200"}' in body
+    assert 'qr_request_phase_seconds_count{phase="etag",route="/history"}' in body
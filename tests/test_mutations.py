@@ -0,0 +1,54 @@
+from conftest import mutate, read_state, scan
+from mutations import collision_message
+
+
+def seed(client):
+    for qr_string in ("AAAAAAAAA", "BBBBBBBBB", "CCCCCCCCC"):
+        scan(client, qr_string)
+
+
+def statuses(response):
+    return [(r["status"], r["message"]) for r in response["results"]]
+
+
+def test_two_edits_to_the_same_string_in_one_batch(client, db_file):
+    seed(client)
+    response = mutate(client, {"record_id": 1, "action": "EDIT", "new_string": "ZZZZZZZZZ"},
+                      {"record_id": 2, "action": "EDIT", "new_string": "ZZZZZZZZZ"})
+
+    assert statuses(response) == [("success", None), ("error", collision_message("ZZZZZZZZZ"))]
+    assert (response["applied"], response["failed"]) == (1, 1)
+    assert read_state(db_file)[2] == ("BBBBBBBBB", "BBBBBBBBB", "ACTIVE")
+
+
+def test_edit_onto_a_string_another_record_holds(client, db_file):
+    seed(client)
+    response = mutate(client, {"record_id": 1, "action": "EDIT", "new_string": "CCCCCCCCC"})
+
+    assert statuses(response) == [("error", collision_message("CCCCCCCCC"))]
+    assert read_state(db_file)[1] == ("AAAAAAAAA", "AAAAAAAAA", "ACTIVE")
+
+
+def test_a_string_freed_earlier_in_the_batch_can_be_taken(client, db_file):
+    seed(client)
+    response = mutate(client, {"record_id": 1, "action": "EDIT", "new_string": "XXXXXXXXX"},
+                      {"record_id": 2, "action": "EDIT", "new_string": "AAAAAAAAA"},
+                      {"record_id": 3, "action": "EDIT", "new_string": "XXXXXXXXX"})
+
+    assert [status for status, _ in statuses(response)] == ["success", "success", "error"]
+    state = read_state(db_file)
+    assert state[1][0] == "XXXXXXXXX"
+    assert state[2][0] == "AAAAAAAAA"
+    assert state[3][0] == "CCCCCCCCC"
+
+
+def test_bad_items_fail_alone(client, db_file):
+    seed(client)
+    response = mutate(client, {"record_id": 1, "action": "DELETE"},
+                      {"record_id": 99, "action": "DELETE"},
+                      {"record_id": 2, "action": "EDIT", "new_string": "short"},
+                      {"record_id": 3, "action": "EXPLODE"})
+
+    assert statuses(response) == [("success", None), ("error", "Record not found."),
+                                  ("error", "String must be 9 characters."), ("error", "Invalid data.")]
+    assert read_state(db_file)[1][2] == "DELETED"
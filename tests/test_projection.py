@@ -0,0 +1,50 @@
+import random
+import sqlite3
+
+from conftest import mutate, read_state, scan
+from projection import projection_is_stale, rebuild_projection
+from state_engine import replay_log
+
+
+def replayed_state(db_file):
+    with sqlite3.connect(db_file) as conn:
+        engine = replay_log(conn)
+    return {rec.id: (rec.qr_string, rec.original_string, rec.status) for rec in engine.records.values()}
+
+
+def test_projection_matches_the_replayed_log(client, db_file):
+    rng = random.Random(7)
+    statuses = []
+    for i in range(60):
+        scan(client, f"P{i:08d}")
+    for i in range(150):
+        record_id = rng.randint(1, 60)
+        action = rng.choice(["EDIT", "DELETE", "RESTORE"])
+        # A small pool of edit targets so plenty of edits collide and get refused
+        result = mutate(client, {"record_id": record_id, "action": action, "new_string": f"E{rng.randint(0, 20):08d}"})
+        statuses.append(result["results"][0]["status"])
+    assert "success" in statuses and "error" in statuses
+
+    projected = read_state(db_file)
+    assert projected == replayed_state(db_file)
+
+    with sqlite3.connect(db_file) as conn:
+        rebuild_projection(conn)
+        assert not projection_is_stale(conn.cursor())
+    assert read_state(db_file) == projected
+
+
+def test_rebuild_quarantines_logical_duplicates(db_file):
+    with sqlite3.connect(db_file) as conn:
+        conn.executemany("INSERT INTO qr_records (qr_string, scan_date) VALUES (?, '2026-01-01 09:00:00')",
+                         [("AAAAAAAAA",), ("BBBBBBBBB",), ("CCCCCCCCC",)])
+        # An old log from before the collision check: record 3 was edited onto record 1's string
+        conn.execute("INSERT INTO qr_mutations (record_id, action, new_string, mutation_date) "
+                     "VALUES (3, 'EDIT', 'AAAAAAAAA', '2026-01-01 10:00:00')")
+        conn.commit()
+
+        rebuild_projection(conn)
+
+        assert conn.execute("SELECT id, qr_string, kept_id FROM qr_state_conflicts").fetchall() == [(3, "AAAAAAAAA", 1)]
+        assert conn.execute("SELECT id FROM qr_state ORDER BY id").fetchall() == [(1,), (2,)]
+        assert not projection_is_stale(conn.cursor())
@@ -0,0 +1,45 @@
+import os
+
+from conftest import read_state, scan
+
+
+def test_events_keep_separate_registries(app_module, client, db_file):
+    fair = app_module.shards.get("fair-2026") # Opened (and restored) on first use
+    assert fair.startup.wait(10)
+
+    assert scan(client, "E00000001")["status"] == "success"
+    # The same string is new in another event's registry
+    assert scan(client, "E00000001", event="fair-2026")["status"] == "success"
+    assert scan(client, "E00000001", event="fair-2026")["status"] == "duplicate"
+
+    assert os.path.abspath(fair.db_file) != db_file
+    assert list(read_state(fair.db_file)) == [1]
+    assert list(read_state(db_file)) == [1]
+
+    response = client.post("/process-qr?event=nope", json={"qr_string": "E00000002"})
+    assert response.status_code == 404
+
+
+def test_event_streams_share_one_budget_per_process(app_module):
+    slots = app_module.stream_slots
+    assert app_module.shards.get("fair-2026").startup.wait(10)
+    broadcasters = [app_module.shards.get(key).broadcaster for key in ("default", "fair-2026")]
+
+    subscribers = []
+    for i in range(slots.limit):
+        broadcaster = broadcasters[i % 2]
+        subscriber, _ = broadcaster.subscribe()
+        assert subscriber is not None
+        subscribers.append((broadcaster, subscriber))
+
+    # Full, whichever event the next stream is for
+    assert all(b.subscribe() == (None, None) for b in broadcasters)
+
+    broadcaster, subscriber = subscribers.pop()
+    broadcaster.unsubscribe(subscriber)
+    broadcaster.unsubscribe(subscriber) # The stream and the response close hook both call it
+    assert slots.in_use == slots.limit - 1
+
+    for broadcaster, subscriber in subscribers:
+        broadcaster.unsubscribe(subscriber)
+    assert slots.in_use == 0
@@ -0,0 +1,42 @@
+import sqlite3
+
+from conftest import engine_state, mutate, scan
+from state_engine import bump_generation, replay_log
+
+
+def replayed(db_file):
+    with sqlite3.connect(db_file) as conn:
+        return engine_state(replay_log(conn))
+
+
+def test_incremental_catch_up_matches_a_fresh_replay(app_module, client, db_file):
+    engine = app_module.shards.get(app_module.DEFAULT_SHARD).engine
+    for i in range(20):
+        scan(client, f"S{i:08d}")
+        if i % 3 == 0:
+            mutate(client, {"record_id": i + 1, "action": "EDIT", "new_string": f"X{i:08d}"})
+        if i % 4 == 0:
+            mutate(client, {"record_id": i // 2 + 1, "action": "DELETE"})
+        assert engine_state(engine.refresh()) == replayed(db_file)
+
+    # The shared engine answers lookups by the CURRENT string only
+    assert engine.lookup("X00000003").id == 4
+    assert engine.lookup("S00000003") is None
+
+
+def test_generation_bump_forces_a_full_reload(app_module, client, db_file):
+    engine = app_module.shards.get(app_module.DEFAULT_SHARD).engine
+    scan(client, "G00000001")
+    mutate(client, {"record_id": 1, "action": "EDIT", "new_string": "G00000002"})
+    assert engine.refresh().lookup("G00000002").id == 1
+
+    # What the janitor does: rewrite history in place, then bump user_version
+    with sqlite3.connect(db_file) as conn:
+        conn.execute("DELETE FROM qr_mutations")
+        bump_generation(conn.cursor())
+        conn.commit()
+
+    engine.refresh()
+    assert engine.lookup("G00000002") is None
+    assert engine.lookup("G00000001").id == 1
+    assert engine_state(engine) == replayed(db_file)
@@ -0,0 +1,83 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from write_queue import GroupCommitter
+
+
+@pytest.fixture
+def committer(tmp_path):
+    db_file = str(tmp_path / "queue.db")
+    with sqlite3.connect(db_file) as conn:
+        conn.execute("CREATE TABLE items (name TEXT UNIQUE NOT NULL)")
+    commits = []
+    # A wide window so every job submitted below lands in the same group
+    writer = GroupCommitter(db_file, window_seconds=0.3, on_commit=commits.append)
+    writer.commits = commits
+    return writer
+
+
+def submit_together(writer, works):
+    """Submits every work from its own thread at once; returns [(result, error)] in submission order."""
+    outcomes = [None] * len(works)
+
+    def run(i, work):
+        try:
+            outcomes[i] = (writer.submit(work), None)
+        except Exception as e:
+            outcomes[i] = (None, e)
+
+    threads = []
+    for i, work in enumerate(works):
+        threads.append(threading.Thread(target=run, args=(i, work)))
+        threads[-1].start()
+        time.sleep(0.01) # Keep the arrival order deterministic
+    for t in threads:
+        t.join()
+    return outcomes
+
+
+def insert(name, fail_after=False):
+    def work(conn, group):
+        conn.execute("INSERT INTO items (name) VALUES (?)", (name,))
+        group.dirty = True
+        if fail_after:
+            raise ValueError(f"{name} failed")
+        return name
+    return work
+
+
+def stored(writer):
+    with sqlite3.connect(writer.db_file) as conn:
+        return [row[0] for row in conn.execute("SELECT name FROM items ORDER BY rowid")]
+
+
+def test_a_failing_job_only_rolls_back_its_own_savepoint(committer):
+    outcomes = submit_together(committer, [insert("a"), insert("b", fail_after=True), insert("c"), insert("a")])
+
+    assert committer.group_count == 1
+    assert outcomes[0] == ("a", None)
+    assert isinstance(outcomes[1][1], ValueError)
+    assert outcomes[2] == ("c", None)
+    assert isinstance(outcomes[3][1], sqlite3.IntegrityError) # Sees job 1's uncommitted row
+    assert stored(committer) == ["a", "c"]
+    assert len(committer.commits) == 1
+
+
+def test_jobs_share_what_the_group_claimed(committer):
+    def claim(name):
+        def work(conn, group):
+            if name in group.claimed:
+                return "duplicate"
+            conn.execute("INSERT INTO items (name) VALUES (?)", (name,))
+            group.claimed[name] = True
+            return "saved"
+        return work
+
+    outcomes = submit_together(committer, [claim("x"), claim("x"), claim("y")])
+
+    assert [result for result, _ in outcomes] == ["saved", "duplicate", "saved"]
+    assert stored(committer) == ["x", "y"]
+    assert committer.commits == [] # Nothing marked the group dirty, so no backup was queued